@@ -23,6 +23,28 @@ def parse_metadata_file(file_path):
                 data[key.strip()] = value.strip()
     return data
 
+def parse_results_file(file_path):
+    """
+    Parses a results.out file and returns, for each query, the list of
+    reported (name, confidence_score) pairs in ranked order.
+    """
+    results = {}
+    query_name = None
+    with open(file_path, "r") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            name, _, value = line.rpartition(": ")
+            try:
+                score = float(value)
+            except ValueError:
+                score = None
+            if name and score is not None and query_name is not None:
+                results[query_name].append((name, score))
+            else:
+                query_name = line
+                results[query_name] = []
+    return results
+
 def aggregate_iteration(iteration_path: Path, independent_var_name: str):
     """
     Aggregates evaluation results of all experiments within
@@ -208,6 +230,8 @@ def aggregate_memory_iteration(iteration_path: Path, independent_var_name: str):
         dependent_var = config[independent_var_name]
 
         memory_data[independent_var_name] = dependent_var
+        if "matching_backend" in config:
+            memory_data["matching_backend"] = config["matching_backend"]
         rows.append(memory_data)
 
     df = pd.DataFrame(rows)
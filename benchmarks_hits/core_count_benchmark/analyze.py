@@ -19,11 +19,24 @@ if __name__=="__main__":
     combined_metadata_path = aggregate_all_iterations(base_dir, independent_var_name)
 
     df_all = pd.read_csv(combined_metadata_path)
-    df = df_all[["iteration", independent_var_name, dependent_var_name]]
+    #runs recorded without a matching backend were run with the process backend
+    if "matching_backend" not in df_all.columns:
+        df_all["matching_backend"] = "process"
+    df_all["matching_backend"] = df_all["matching_backend"].fillna("process")
+    #runs recorded without a worker placement were not pinned
+    if "worker_placement" not in df_all.columns:
+        df_all["worker_placement"] = "unpinned"
+    df_all["worker_placement"] = df_all["worker_placement"].fillna("unpinned")
+    df_all[hue_col_name] = hue_name + " (" + df_all["matching_backend"] + ")"
+    placed = df_all["worker_placement"] != "unpinned"
+    df_all.loc[placed, hue_col_name] = hue_name + " (" + df_all["matching_backend"] + ", " + df_all["worker_placement"] + ")"
+
+    df = df_all[["iteration", independent_var_name, dependent_var_name, "matching_backend", "worker_placement", hue_col_name]]
     df = df[df["core_count"] != 0]
 
+    #the speedup of all runs is relative to the single-core unpinned process run
     baseline = (
-        df[df[independent_var_name] == 1]
+        df[(df[independent_var_name] == 1) & (df["matching_backend"] == "process") & (df["worker_placement"] == "unpinned")]
         .loc[:, ["iteration", dependent_var_name]]
         .rename(columns={dependent_var_name: "baseline_time"})
     )
@@ -31,28 +44,28 @@ if __name__=="__main__":
     df = df.merge(baseline, on="iteration")
 
     df["speed_up"] = df["baseline_time"] / df[dependent_var_name]
-    df = df[[independent_var_name, "speed_up"]]
-    df[hue_col_name] = hue_name
+    df = df[[independent_var_name, "speed_up", hue_col_name]]
 
     plot_benchmark(df, "core_count", "speed_up", "name", "Threads", "rel. Speedup",
                    xgrid_exact=True, error="sd", save_path=plot_path, ref_slope=1, ref_intercept=0, ref_label="ideal")
 
-    df_mean = df.groupby(independent_var_name)["speed_up"].agg("mean").reset_index()
-    df_std = df.groupby(independent_var_name)["speed_up"].agg("std").reset_index()
+    df_mean = df.groupby([hue_col_name, independent_var_name])["speed_up"].agg("mean").reset_index()
+    df_std = df.groupby([hue_col_name, independent_var_name])["speed_up"].agg("std").reset_index()
     print("Mean")
     print(df_mean)
     print("Standard Deviation")
     print(df_std)
 
-    x1 = 1
-    x2 = 24
-    slope = (df_mean.loc[df_mean[independent_var_name] == x2, "speed_up"].values[0] - df_mean.loc[df_mean[independent_var_name] == x1, "speed_up"].values[0]) / (x2 - x1)
-    print(f"Slope: {round(slope, 3)}")
+    for name, df_backend in df_mean.groupby(hue_col_name):
+        x1 = 1
+        x2 = 24
+        slope = (df_backend.loc[df_backend[independent_var_name] == x2, "speed_up"].values[0] - df_backend.loc[df_backend[independent_var_name] == x1, "speed_up"].values[0]) / (x2 - x1)
+        print(f"Slope {name}: {round(slope, 3)}")
 
-    x1 = 24
-    x2 = 48
-    slope = (df_mean.loc[df_mean[independent_var_name] == x2, "speed_up"].values[0] - df_mean.loc[df_mean[independent_var_name] == x1, "speed_up"].values[0]) / (x2 - x1)
-    print(f"Slope: {round(slope, 3)}")
+        x1 = 24
+        x2 = 48
+        slope = (df_backend.loc[df_backend[independent_var_name] == x2, "speed_up"].values[0] - df_backend.loc[df_backend[independent_var_name] == x1, "speed_up"].values[0]) / (x2 - x1)
+        print(f"Slope {name}: {round(slope, 3)}")
 
 
 
@@ -80,9 +93,7 @@ if __name__=="__main__":
 
         plot_path = plot_dir / plot_name
 
-        df_selected = df_all[[independent_var_name, dependent_var_name]]
-
-        df_selected[hue_col_name] = hue_name
+        df_selected = df_all[[independent_var_name, dependent_var_name, hue_col_name]]
 
         plot_benchmark(df_selected, independent_var_name, dependent_var_name, hue_col_name, xlabel, ylabel,
                        xgrid_exact=True, error="sd", save_path=plot_path)
\ No newline at end of file
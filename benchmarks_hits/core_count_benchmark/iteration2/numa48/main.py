@@ -0,0 +1,5 @@
+from simtools.simulator import run_simulation
+
+if __name__ == "__main__":
+    run_simulation()
+    
\ No newline at end of file
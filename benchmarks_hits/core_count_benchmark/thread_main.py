@@ -0,0 +1,13 @@
+from pathlib import Path
+
+from simtools.simulator import run_main_list
+
+if __name__ == "__main__":
+    main_list = []
+    base_dir = Path(__file__).resolve().relative_to(Path.cwd()).parent
+    for i in [1, 2, 3, 4, 5]:
+        for core_count in [1, 2, 4, 8, 16, 24, 32, 40, 48]:
+            main_path = base_dir / f"iteration{i}" / f"thread{core_count}"
+            main_list.append(main_path)
+
+    run_main_list(main_list)
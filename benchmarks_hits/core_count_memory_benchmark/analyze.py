@@ -25,20 +25,25 @@ if __name__=="__main__":
     combined_memory_data_path = aggregate_all_memory_iterations(base_dir, independent_var_name)
     df_all = pd.read_csv(combined_memory_data_path)
     df_all[dependent_var_name] = df_all[dependent_var_name]
-    df_all[hue_col_name] = hue_name
+    #tests configured without a matching backend were run with the process backend
+    if "matching_backend" not in df_all.columns:
+        df_all["matching_backend"] = "process"
+    df_all["matching_backend"] = df_all["matching_backend"].fillna("process")
+    df_all[hue_col_name] = hue_name + " (" + df_all["matching_backend"] + ")"
     df_selected = df_all[[independent_var_name, dependent_var_name, hue_col_name]]
     print(df_selected)
 
-    df_mean = df_selected.groupby(independent_var_name)[dependent_var_name].agg("mean").reset_index()
-    df_std = df_selected.groupby(independent_var_name)[dependent_var_name].agg("std").reset_index()
+    df_mean = df_selected.groupby([hue_col_name, independent_var_name])[dependent_var_name].agg("mean").reset_index()
+    df_std = df_selected.groupby([hue_col_name, independent_var_name])[dependent_var_name].agg("std").reset_index()
     print("Mean")
     print(df_mean)
     print("Standard Deviation")
     print(df_std)
 
-    slope = (df_mean.loc[df_mean[independent_var_name] == 40, dependent_var_name].values[0] - df_mean.loc[df_mean[independent_var_name] == 2, dependent_var_name].values[0]) / (40 - 2)
-    print(f"Slope: {round(slope, 3)}")
-    print(f"Slope (MB): {round(slope * 1024, 3)}")
+    for name, df_backend in df_mean.groupby(hue_col_name):
+        slope = (df_backend.loc[df_backend[independent_var_name] == 40, dependent_var_name].values[0] - df_backend.loc[df_backend[independent_var_name] == 2, dependent_var_name].values[0]) / (40 - 2)
+        print(f"Slope {name}: {round(slope, 3)}")
+        print(f"Slope {name} (MB): {round(slope * 1024, 3)}")
 
     #1 core
     #0.1563987731933593
@@ -53,7 +58,10 @@ if __name__=="__main__":
 
     dependent_var_names = ["generate_dataset peak (GB)", "generate_dataset parent_peak (GB)", "generate_dataset children_peak (GB)",
                            "calculate_lookup peak (GB)", "calculate_lookup parent_peak (GB)", "calculate_lookup children_peak (GB)",
-                           "execute_raxtax peak (GB)", "execute_raxtax parent_peak (GB)", "execute_raxtax children_peak (GB)"]
+                           "execute_raxtax peak (GB)", "execute_raxtax parent_peak (GB)", "execute_raxtax children_peak (GB)",
+                           "execute_raxtax pss_peak (GB)"]
+    #the pss peak is not recorded in older results
+    dependent_var_names = [name for name in dependent_var_names if name in df_all.columns]
 
 
     plot_dir = base_dir / "plots"
@@ -31,9 +31,13 @@ if __name__ == '__main__':
 
     executable_dir_list = []
 
-    for i in core_count_list:
+    #the core counts are run with the process, thread and fork backends
+    test_list = ([("core", None, i) for i in core_count_list] + [("thread", "thread", i) for i in core_count_list]
+                 + [("fork", "fork", i) for i in core_count_list])
+
+    for dir_prefix, matching_backend, i in test_list:
         core_count = i
-        config_dir = base_dir / f"core{core_count}"
+        config_dir = base_dir / f"{dir_prefix}{core_count}"
         config_dir.mkdir(parents=True, exist_ok=True)
 
         create_config_at_path(base_dir=config_dir,
@@ -55,7 +59,8 @@ if __name__ == '__main__':
                               mutation_rate=mutation_rate,
                               mutation_seed=mutation_seed,
                               disorientation_probability=disorientation_probability,
-                              disorientation_seed=disorientation_seed)
+                              disorientation_seed=disorientation_seed,
+                              matching_backend=matching_backend)
 
         executable_dir = config_dir
         create_executable_at_path(base_dir=executable_dir, func_name="generate_dataset", file_name="generate_dataset.py", redo_executable=False)
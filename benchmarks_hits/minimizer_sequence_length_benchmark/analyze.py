@@ -0,0 +1,45 @@
+from pathlib import Path
+import pandas as pd
+
+from analysis.metadata_loader import aggregate_all_iterations
+from analysis.viz import plot_benchmark
+from raxtax_extension_prototype.utils import create_folder
+
+if __name__=="__main__":
+    base_dir = Path(__file__).resolve().relative_to(Path.cwd()).parent
+
+    independent_var_name = "sequence_length"
+    hue_col_name = "index_store"
+
+    combined_metadata_path = aggregate_all_iterations(base_dir, independent_var_name)
+    df_all = pd.read_csv(combined_metadata_path)
+
+    dependent_var_names = ["index_size_bytes", "reference_parse_time", "index_decode_time", "calculate_intersection_sizes_time",
+                           "average_reference_processing_time", "tp", "mc", "fp", "fn", "recall", "precision", "f1_score"]
+    xlabel = "Reference Length"
+    ylabel_list = [s.replace("_", " ") for s in dependent_var_names]
+
+    plot_dir = base_dir / "plots"
+    create_folder(plot_dir)
+
+    for i in range(len(dependent_var_names)):
+        dependent_var_name = dependent_var_names[i]
+        ylabel = ylabel_list[i]
+        plot_path = plot_dir / f"{independent_var_name}_vs_{dependent_var_name}.pdf"
+
+        df_selected = df_all[[independent_var_name, dependent_var_name, hue_col_name]]
+
+        plot_benchmark(df_selected, independent_var_name, dependent_var_name, hue_col_name, xlabel, ylabel,
+                       xgrid_exact=True, error="sd", save_path=plot_path)
+
+    #memory footprint and accuracy of the minimizer index relative to the full index
+    df_mean = df_all.groupby([independent_var_name, hue_col_name])[["index_size_bytes", "f1_score"]].agg("mean").reset_index()
+    df_full = df_mean[df_mean[hue_col_name] == "positions"].set_index(independent_var_name)
+    df_minimizer = df_mean[df_mean[hue_col_name] == "minimizer"].set_index(independent_var_name)
+
+    print("Mean")
+    print(df_mean)
+    print("Relative index size (minimizer / full)")
+    print(df_minimizer["index_size_bytes"] / df_full["index_size_bytes"])
+    print("F1 score difference (minimizer - full)")
+    print(df_minimizer["f1_score"] - df_full["f1_score"])
@@ -0,0 +1,43 @@
+from pathlib import Path
+import pandas as pd
+
+from analysis.viz import plot_benchmark
+from raxtax_extension_prototype.utils import create_folder
+
+if __name__=="__main__":
+    base_dir = Path(__file__).resolve().relative_to(Path.cwd()).parent
+
+    independent_var_name = "batch_size"
+    hue_col_name = "name"
+
+    frames = []
+    iteration_dir_list = sorted([p for p in base_dir.iterdir() if p.is_dir() and p.name.startswith("iteration")])
+    for iteration_dir in iteration_dir_list:
+        print(f"Processing: {iteration_dir}")
+        test_dir_list = sorted([p for p in iteration_dir.iterdir() if p.is_dir() and p.name.startswith("core")])
+        for test_dir in test_dir_list:
+            df = pd.read_csv(list(test_dir.glob("results_server_*/server_benchmark.csv"))[0])
+            df["iteration"] = iteration_dir.name.strip("iteration")
+            df["core_count"] = int(test_dir.name.strip("core"))
+            frames.append(df)
+
+    df_all = pd.concat(frames)
+    combined_metadata_path = base_dir / "combined_metadata.csv"
+    df_all.to_csv(combined_metadata_path, index=False)
+    print(f"Saved: {combined_metadata_path}")
+
+    #cold runs do not depend on the worker pool of the server
+    df_all[hue_col_name] = df_all["mode"].where(df_all["mode"] == "cold", "server, " + df_all["core_count"].astype(str) + " workers")
+
+    plot_dir = base_dir / "plots"
+    create_folder(plot_dir)
+
+    for dependent_var_name, ylabel in (("latency", "latency [s]"), ("throughput", "throughput [queries/s]")):
+        plot_path = plot_dir / f"{independent_var_name}_vs_{dependent_var_name}.pdf"
+        df_selected = df_all[[independent_var_name, dependent_var_name, hue_col_name]]
+        plot_benchmark(df_selected, independent_var_name, dependent_var_name, hue_col_name, "batch size", ylabel,
+                       xgrid_exact=True, error="sd", palette=None, save_path=plot_path)
+
+    df_mean = df_all.groupby([hue_col_name, independent_var_name])[["latency", "throughput"]].agg("mean").reset_index()
+    print("Mean")
+    print(df_mean)
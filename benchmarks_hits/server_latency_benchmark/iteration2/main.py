@@ -0,0 +1,57 @@
+from pathlib import Path
+import yaml
+
+from simtools.config_handler import create_config_at_path
+from simtools.main_handler import create_specific_main_at_path
+from simtools.simulator import run_main_list
+
+if __name__ == '__main__':
+    leaf_count = 1000
+    sequence_length = 50000
+    tree_height = 0.1
+    query_count = 200
+    query_min_length = 100
+    fragment_count = 50
+    nick_freq = 0.005
+    overhang_parameter = 1.0
+    double_strand_deamination = 0.0
+    single_strand_deamination = 0.0
+
+    server_batch_sizes = [1, 10, 100]
+    server_repetitions = 20
+    cold_repetitions = 3
+
+    base_dir = Path(__file__).resolve().relative_to(Path.cwd()).parent
+
+    main_dir_list = []
+
+    #the server is tested with matching in the server process and with a warm worker pool
+    for core_count in (0, 8):
+        config_dir = base_dir / f"core{core_count}"
+        config_dir.mkdir(parents=True, exist_ok=True)
+
+        create_config_at_path(base_dir=config_dir,
+                              redo_config=False,
+                              leaf_count=leaf_count,
+                              sequence_length=sequence_length,
+                              tree_height=tree_height,
+                              query_count=query_count,
+                              core_count=core_count,
+                              query_min_length=query_min_length,
+                              fragment_count=fragment_count,
+                              nick_freq=nick_freq,
+                              overhang_parameter=overhang_parameter,
+                              double_strand_deamination=double_strand_deamination,
+                              single_strand_deamination=single_strand_deamination)
+
+        config_path = config_dir / "config.yaml"
+        with config_path.open("r") as f:
+            config = yaml.safe_load(f)
+        config.update({"server_batch_sizes": server_batch_sizes, "server_repetitions": server_repetitions, "cold_repetitions": cold_repetitions})
+        with config_path.open("w") as f:
+            yaml.dump(config, f, sort_keys=False)
+
+        create_specific_main_at_path(base_dir=config_dir, func_name="run_server_benchmark", redo_main=False)
+        main_dir_list.append(config_dir)
+
+    run_main_list(main_dir_list)
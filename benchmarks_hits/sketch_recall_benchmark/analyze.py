@@ -0,0 +1,76 @@
+from pathlib import Path
+import pandas as pd
+import yaml
+
+from analysis.metadata_loader import parse_metadata_file, parse_results_file
+from analysis.viz import plot_benchmark
+from raxtax_extension_prototype.utils import create_folder
+
+def top_hits(results_path: Path) -> dict:
+    """
+    Returns the best reported name of each query in a results file.
+    """
+    return {query_name: hits[0][0] for query_name, hits in parse_results_file(results_path).items() if hits}
+
+if __name__=="__main__":
+    base_dir = Path(__file__).resolve().relative_to(Path.cwd()).parent
+
+    independent_var_name = "sketch_threshold"
+    hue_col_name = "name"
+    hue_name = "raxtax+ sketch"
+
+    rows = []
+    iteration_dir_list = sorted([p for p in base_dir.iterdir() if p.is_dir() and p.name.startswith("iteration")])
+    for iteration_dir in iteration_dir_list:
+        print(f"Processing: {iteration_dir}")
+        exhaustive_hits = top_hits(list((iteration_dir / "exhaustive").glob("*/results.out"))[0])
+        exhaustive_metadata = parse_metadata_file(list((iteration_dir / "exhaustive").glob("*/metadata.out"))[0])
+
+        test_dir_list = sorted([p for p in iteration_dir.iterdir() if p.is_dir() and p.name.startswith("sketch_threshold")])
+        for test_dir in test_dir_list:
+            with (test_dir / "config.yaml").open("r") as f:
+                config = yaml.safe_load(f)
+            metadata = parse_metadata_file(list(test_dir.glob("*/metadata.out"))[0])
+            sketch_hits = top_hits(list(test_dir.glob("*/results.out"))[0])
+
+            #fraction of queries whose best hit under exhaustive matching is also found after screening
+            agreeing = sum(1 for query_name, name in exhaustive_hits.items() if sketch_hits.get(query_name) == name)
+
+            rows.append({
+                "iteration": iteration_dir.name.strip("iteration"),
+                independent_var_name: config["matching_options"][independent_var_name],
+                "recall_vs_exhaustive": agreeing / max(len(exhaustive_hits), 1),
+                "sketch_skipped_pair_fraction": float(metadata["sketch_skipped_pair_fraction"]),
+                "sketch_time": float(metadata["sketch_time"]),
+                "calculate_intersection_sizes_time": float(metadata["calculate_intersection_sizes_time"]),
+                "speed_up": float(exhaustive_metadata["calculate_intersection_sizes_time"]) / float(metadata["calculate_intersection_sizes_time"]),
+                "f1_score": float(metadata["f1_score"]),
+            })
+
+    df_all = pd.DataFrame(rows).sort_values(by=["iteration", independent_var_name])
+    combined_metadata_path = base_dir / "combined_metadata.csv"
+    df_all.to_csv(combined_metadata_path, index=False)
+    print(f"Saved: {combined_metadata_path}")
+
+    df_all[hue_col_name] = hue_name
+
+    dependent_var_names = ["recall_vs_exhaustive", "sketch_skipped_pair_fraction", "sketch_time",
+                           "calculate_intersection_sizes_time", "speed_up", "f1_score"]
+    xlabel = independent_var_name.replace("_", " ")
+    ylabel_list = [s.replace("_", " ") for s in dependent_var_names]
+
+    plot_dir = base_dir / "plots"
+    create_folder(plot_dir)
+
+    for i in range(len(dependent_var_names)):
+        dependent_var_name = dependent_var_names[i]
+        plot_path = plot_dir / f"{independent_var_name}_vs_{dependent_var_name}.pdf"
+
+        df_selected = df_all[[independent_var_name, dependent_var_name, hue_col_name]]
+
+        plot_benchmark(df_selected, independent_var_name, dependent_var_name, hue_col_name, xlabel, ylabel_list[i],
+                       xgrid_exact=True, error="sd", save_path=plot_path)
+
+    df_mean = df_all.groupby(independent_var_name)[["recall_vs_exhaustive", "sketch_skipped_pair_fraction", "speed_up"]].agg("mean").reset_index()
+    print("Mean")
+    print(df_mean)
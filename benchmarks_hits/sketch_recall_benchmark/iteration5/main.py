@@ -0,0 +1,72 @@
+from pathlib import Path
+
+from simtools.config_handler import create_config_at_path
+from simtools.main_handler import create_main_at_path
+from simtools.simulator import run_main_list
+from raxtax_extension_prototype.utils import create_random_seed, float_to_string_without_point
+
+if __name__ == '__main__':
+    leaf_count = 1000
+    sequence_length = 50000
+    tree_height = 0.1
+    query_count = 200
+    core_count = 8
+    query_min_length = 100
+    fragment_count = 50
+    nick_freq = 0.005
+    overhang_parameter = 1.0
+    double_strand_deamination = 0.0
+    single_strand_deamination = 0.0
+    mutation_rate = -1
+    mutation_seed = -1
+    disorientation_probability = -1
+    disorientation_seed = -1
+
+    index_options = {"sketch_size": 2048}
+
+    base_dir = Path(__file__).resolve().relative_to(Path.cwd()).parent
+
+    #all tests of an iteration share their input data, the exhaustive test serves as ground truth
+    iqtree_seed = create_random_seed()
+    pygargammel_seed = create_random_seed()
+    query_selection_seed = create_random_seed()
+
+    sketch_threshold_list = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+    matching_options_dict = {"exhaustive": {}}
+    for sketch_threshold in sketch_threshold_list:
+        matching_options_dict[f"sketch_threshold{float_to_string_without_point(sketch_threshold)}"] = {"sketch_threshold": sketch_threshold}
+
+    main_dir_list = []
+
+    for test_name, matching_options in matching_options_dict.items():
+        config_dir = base_dir / test_name
+        config_dir.mkdir(parents=True, exist_ok=True)
+
+        create_config_at_path(base_dir=config_dir,
+                              redo_config=False,
+                              leaf_count=leaf_count,
+                              sequence_length=sequence_length,
+                              tree_height=tree_height,
+                              query_count=query_count,
+                              core_count=core_count,
+                              query_min_length=query_min_length,
+                              fragment_count=fragment_count,
+                              nick_freq=nick_freq,
+                              overhang_parameter=overhang_parameter,
+                              double_strand_deamination=double_strand_deamination,
+                              single_strand_deamination=single_strand_deamination,
+                              iqtree_seed=iqtree_seed,
+                              pygargammel_seed=pygargammel_seed,
+                              query_selection_seed=query_selection_seed,
+                              mutation_rate=mutation_rate,
+                              mutation_seed=mutation_seed,
+                              disorientation_probability=disorientation_probability,
+                              disorientation_seed=disorientation_seed,
+                              index_options=index_options,
+                              matching_options=matching_options)
+
+        main_dir = config_dir
+        create_main_at_path(base_dir=main_dir, redo_main=False)
+        main_dir_list.append(main_dir)
+
+    run_main_list(main_dir_list)
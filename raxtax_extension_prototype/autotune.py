@@ -0,0 +1,251 @@
+"""
+autotune.py
+
+Description
+-----------
+Module for choosing the worker count and the chunk size (references per
+task) of get_intersection_sizes_parallel.
+
+A short calibration on a sample of the reference tasks, each matched
+against a sample of its queries, measures
+
+- the time to decode a reference and to match it against one query,
+- the startup time of a worker and the overhead of sending a task to a
+  worker and receiving its result (IPC), and
+- the slowdown of matching when all usable cores match at the same time,
+  e.g. due to the shared memory bandwidth or the GIL.
+
+The matching time of every worker count and chunk size is then estimated
+(see estimate_matching_time), and the fewest workers whose estimate lies
+within TOLERANCE of the best are chosen, so that cores that would hardly
+speed up matching stay idle.
+
+The measurements are persisted per host in a JSON file next to the
+lookup table, keyed by the index hash, the executor type and the kernel,
+so that later runs on the same host and index reuse them without
+calibrating. The file is only rewritten after a calibration, under an
+exclusive lock where fcntl is available, so that concurrent runs on the
+same lookup table keep each other's measurements. The choice itself is
+recomputed from the measurements for the task and query counts of every
+run and only reported in the runtime information.
+"""
+import os
+import json
+import math
+import time
+import socket
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_SAMPLE_TASK_COUNT = 8
+DEFAULT_SAMPLE_QUERY_COUNT = 32
+
+#relative slack within which fewer workers are preferred
+TOLERANCE = 0.05
+
+def get_usable_cpu_count() -> int:
+    """
+    Returns the number of cores the calling process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def get_tuning_path(result_path: Path) -> Path:
+    """
+    Returns the path of the persisted tunings of a lookup table.
+    """
+    return result_path.with_name(result_path.stem + "_autotune.json")
+
+def get_host_key() -> str:
+    """
+    Returns the key of the calling host and its usable core count.
+    """
+    return f"{socket.gethostname()}/{get_usable_cpu_count()}"
+
+def load_tunings(result_path: Path) -> dict:
+    """
+    Returns all persisted tunings of a lookup table.
+    """
+    tuning_path = get_tuning_path(result_path)
+    if not tuning_path.exists():
+        return {}
+    try:
+        return json.loads(tuning_path.read_text())
+    except json.JSONDecodeError:
+        return {}
+
+def save_tuning(result_path: Path, key: str, tuning: dict):
+    """
+    Persists the tuning of the calling host under key, holding an
+    exclusive lock on a companion lock file while the tunings are read,
+    updated and replaced.
+    """
+    tuning_path = get_tuning_path(result_path)
+    with open(tuning_path.with_name(tuning_path.name + ".lock"), "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        tunings = load_tunings(result_path)
+        tunings.setdefault(get_host_key(), {})[key] = tuning
+        temporary_path = tuning_path.with_name(f"{tuning_path.name}.{os.getpid()}.tmp")
+        temporary_path.write_text(json.dumps(tunings, indent=2))
+        temporary_path.replace(tuning_path)
+
+def echo_task(*payload):
+    """
+    Task without work, used to measure the overhead of a task.
+    """
+    return None
+
+def time_match(match_function, reference_data: dict, query_kmer_sets, window_sizes) -> float:
+    """
+    Returns the time of matching a reference against queries.
+    """
+    start_time = time.perf_counter()
+    match_function(reference_data, query_kmer_sets, window_sizes)
+    return time.perf_counter() - start_time
+
+def calibrate(sample_tasks: list[dict], match_function, pool_type, pool_options: dict, max_workers: int) -> dict:
+    """
+    Measures the parameters of estimate_matching_time.
+
+    Parameters
+    ----------
+    sample_tasks : list of dict
+        Sample of the tasks, each with the keys "load_time" (decoding
+        time of the reference), "reference_data", "query_kmer_sets" and
+        "window_sizes" (a sample of its queries) and "payload" (the data
+        sent to a worker with the full task).
+    match_function : callable
+        Function matching a decoded reference against queries, e.g.
+        parser_short_long.calculate_reference_intersection_sizes.
+    pool_type : type
+        ProcessPoolExecutor or ThreadPoolExecutor.
+    pool_options : dict
+        Keyword arguments of the pool, e.g. its mp_context.
+    max_workers : int
+        Number of usable cores.
+
+    Returns
+    -------
+    dict
+        Dictionary with the measured "load_time" per task,
+        "match_time_per_query", "worker_startup_time",
+        "task_overhead_time" and the "contention" coefficient.
+    """
+    load_time = sum(sample_task["load_time"] for sample_task in sample_tasks) / len(sample_tasks)
+    match_times = [time_match(match_function, sample_task["reference_data"], sample_task["query_kmer_sets"], sample_task["window_sizes"])
+                   for sample_task in sample_tasks]
+    match_time_per_query = sum(match_times) / max(sum(len(sample_task["query_kmer_sets"]) for sample_task in sample_tasks), 1)
+
+    with pool_type(max_workers=max_workers, **pool_options) as executor:
+        start_time = time.perf_counter()
+        for future in [executor.submit(echo_task) for _ in range(max_workers)]:
+            future.result()
+        worker_startup_time = (time.perf_counter() - start_time) / max_workers
+
+        start_time = time.perf_counter()
+        for sample_task in sample_tasks:
+            executor.submit(echo_task, *sample_task["payload"]).result()
+        task_overhead_time = (time.perf_counter() - start_time) / len(sample_tasks)
+
+        #slowdown of every task while all cores match, measured within the workers
+        contention = 0
+        if max_workers > 1:
+            task_ids = [task_id % len(sample_tasks) for task_id in range(max(2 * max_workers, len(sample_tasks)))]
+            futures = [executor.submit(time_match, match_function, sample_tasks[task_id]["reference_data"], sample_tasks[task_id]["query_kmer_sets"],
+                                       sample_tasks[task_id]["window_sizes"]) for task_id in task_ids]
+            slowdown = sum(future.result() for future in futures) / max(sum(match_times[task_id] for task_id in task_ids), 1e-9)
+            contention = max(slowdown - 1, 0) / (max_workers - 1)
+
+    return {
+        "load_time": load_time,
+        "match_time_per_query": match_time_per_query,
+        "worker_startup_time": worker_startup_time,
+        "task_overhead_time": task_overhead_time,
+        "contention": contention,
+    }
+
+def estimate_matching_time(measurements: dict, executor_type: str, task_count: int, average_query_count: float, num_workers: int,
+                           chunk_size: int) -> float:
+    """
+    Estimates the matching time with num_workers workers and chunk_size
+    tasks per chunk: the worker startup, the work of all tasks divided
+    by the speedup of the active workers, slowed down by the measured
+    contention, the overhead of every chunk and half a chunk of work at
+    the end of the run. References are only decoded by the workers of
+    the process executor.
+    """
+    task_time = measurements["match_time_per_query"] * average_query_count
+    if executor_type == "process":
+        task_time += measurements["load_time"]
+    chunk_count = math.ceil(task_count / chunk_size)
+    active_workers = min(num_workers, chunk_count)
+    speedup = active_workers / (1 + measurements["contention"] * (active_workers - 1))
+    return (measurements["worker_startup_time"] * num_workers + task_count * task_time / speedup
+            + chunk_count * measurements["task_overhead_time"] / active_workers + chunk_size * task_time / 2)
+
+def choose(measurements: dict, executor_type: str, task_count: int, average_query_count: float, max_workers: int, num_workers: int | None = None,
+           chunk_size: int | None = None) -> tuple[int, int, float]:
+    """
+    Chooses the worker count and chunk size that are not given, i.e. the
+    fewest workers whose estimated matching time lies within TOLERANCE
+    of the best estimate, with their best chunk size.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (num_workers, chunk_size, estimated_time).
+    """
+    worker_counts = [num_workers] if num_workers is not None else range(1, max_workers + 1)
+    chunk_sizes = [chunk_size] if chunk_size is not None else [1 << exponent for exponent in range(max(task_count, 1).bit_length())]
+    estimates = {(worker_count, size): estimate_matching_time(measurements, executor_type, task_count, average_query_count, worker_count, size)
+                 for worker_count in worker_counts for size in chunk_sizes}
+    best_time = min(estimates.values())
+    worker_count = min(worker_count for (worker_count, size), estimate in estimates.items() if estimate <= best_time * (1 + TOLERANCE))
+    size = min((size for (count, size) in estimates if count == worker_count), key=lambda size: estimates[(worker_count, size)])
+    return worker_count, size, estimates[(worker_count, size)]
+
+def tune(result_path: Path, index_hash: str, executor_type: str, kernel: str, task_count: int, average_query_count: float,
+         num_workers: int | None, chunk_size: int | None, calibrate_function) -> dict:
+    """
+    Chooses the worker count and chunk size that are not given, reusing
+    the persisted measurements of this host, index, executor and kernel
+    or calibrating with calibrate_function(max_workers) (see calibrate).
+
+    Returns
+    -------
+    dict
+        Runtime information entries of the tuning, including
+        "autotune_num_workers" and "autotune_chunk_size".
+    """
+    start_time = time.perf_counter()
+    max_workers = get_usable_cpu_count()
+    key = f"{index_hash}/{executor_type}/{kernel}"
+
+    tuning = load_tunings(result_path).get(get_host_key(), {}).get(key)
+    if tuning is not None:
+        measurements = tuning["measurements"]
+        source = "persisted"
+    else:
+        print(f"Calibrating the worker count and chunk size on {max_workers} cores...")
+        measurements = calibrate_function(max_workers)
+        source = "calibrated"
+        save_tuning(result_path, key, {"measurements": measurements})
+
+    chosen_workers, chosen_chunk_size, estimate = choose(measurements, executor_type, task_count, average_query_count, max_workers, num_workers,
+                                                         chunk_size)
+    print(f"Autotuning chose {chosen_workers} workers and chunks of {chosen_chunk_size} references ({source} measurements).")
+
+    return {
+        "autotune_source": source,
+        "autotune_num_workers": chosen_workers,
+        "autotune_chunk_size": chosen_chunk_size,
+        "autotune_estimated_time": estimate,
+        "autotune_measurements": measurements,
+        "autotune_time": time.perf_counter() - start_time,
+    }
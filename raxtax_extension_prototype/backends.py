@@ -0,0 +1,319 @@
+"""
+backends.py
+
+Description
+-----------
+Registry of the matching backends and automatic backend selection.
+
+A backend is a matching driver of parser_short_long together with fixed
+driver options, e.g. the kernel, and its declared capabilities:
+
+- "parallel": the backend runs num_workers workers.
+- "exact": the intersection sizes equal those of the sequential backend
+  without matching options. Automatic selection only considers exact
+  backends unless told otherwise.
+- "streaming": the backend can match query chunks (see streaming).
+- "out_of_core": the result matrix is kept on disk.
+- "index_groups": groups of the lookup table the backend builds on
+  first use. Automatic selection must not modify the lookup table, so it
+  skips backends whose groups are missing.
+- "options": names of the matching options accepted by the driver.
+
+All backends are called through run_backend with the same arguments. The
+backend "auto" selects a backend from the input shape and a short
+calibration run (see select_backend). The chosen backend, its parameters
+and the calibration estimates are recorded in the runtime information.
+"""
+import os
+import time
+import inspect
+import itertools
+from pathlib import Path
+import h5py
+from Bio import SeqIO
+
+import raxtax_extension_prototype.parser_short_long as parser
+
+#arguments passed to every driver by run_backend
+COMMON_ARGUMENTS = ("reference_path", "query_path", "orient_query", "redo", "index_options", "num_workers", "query_records")
+
+#default number of queries of the larger calibration sample
+DEFAULT_CALIBRATION_QUERY_COUNT = 16
+
+BACKENDS = {}
+
+def register_backend(name: str, driver, description: str, fixed_options: dict | None = None, parallel: bool = False, exact: bool = True,
+                     streaming: bool = True, out_of_core: bool = False, index_groups: tuple = ()):
+    """
+    Registers a matching driver as a backend. The accepted matching
+    options are derived from the driver signature.
+    """
+    fixed_options = fixed_options or {}
+    options = tuple(parameter for parameter in inspect.signature(driver).parameters
+                    if parameter not in COMMON_ARGUMENTS and parameter not in fixed_options)
+    BACKENDS[name] = {
+        "name": name,
+        "driver": driver,
+        "description": description,
+        "fixed_options": fixed_options,
+        "capabilities": {
+            "parallel": parallel,
+            "exact": exact,
+            "streaming": streaming,
+            "out_of_core": out_of_core,
+            "index_groups": index_groups,
+            "options": options,
+        },
+    }
+
+register_backend("sequential", parser.get_intersection_sizes, "reference-by-reference matching in the calling process")
+register_backend("batched", parser.get_intersection_sizes, "sequential matching of all queries of a reference in a few NumPy calls",
+                 fixed_options={"kernel": "batched"})
+register_backend("batched_bitmask", parser.get_intersection_sizes,
+                 "batched sequential matching that gathers the occurrences of up to 64 queries through one bitmask",
+                 fixed_options={"kernel": "batched_bitmask"})
+register_backend("strided", parser.get_intersection_sizes, "sequential upper bounds from the block bitsets of a lookup table built with a block_size",
+                 fixed_options={"kernel": "strided"}, exact=False)
+register_backend("process", parser.get_intersection_sizes_parallel, "references matched by a pool of worker processes",
+                 fixed_options={"executor_type": "process"}, parallel=True)
+register_backend("thread", parser.get_intersection_sizes_parallel, "references matched by a pool of threads sharing the decoded index",
+                 fixed_options={"executor_type": "thread"}, parallel=True)
+register_backend("fork", parser.get_intersection_sizes_parallel, "forked worker processes sharing the index decoded by the parent copy-on-write",
+                 fixed_options={"executor_type": "fork"}, parallel=True)
+register_backend("global", parser.get_intersection_sizes_global, "query-by-query matching with the global inverted index",
+                 index_groups=("global_index",))
+register_backend("out_of_core", parser.get_intersection_sizes_out_of_core, "process pool writing into a disk-backed result matrix",
+                 parallel=True, streaming=False, out_of_core=True)
+
+def get_backend(name: str) -> dict:
+    """
+    Returns the registry entry of a backend.
+
+    Raises
+    ------
+    ValueError
+        If no backend of that name is registered.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown matching backend '{name}', expected 'auto' or one of {tuple(BACKENDS)}")
+    return BACKENDS[name]
+
+def get_backend_name(matching_mode: str, core_count: int | None) -> str:
+    """
+    Returns the backend of a matching mode as used by simtools.simulator
+    ("reference" with or without core_count, "global", "out_of_core").
+    Without a core count (None), the process backend is used and
+    simtools.simulator enables its tune_workers option.
+    """
+    if matching_mode == "reference":
+        return "process" if core_count is None or core_count > 0 else "sequential"
+    if matching_mode in ("global", "out_of_core"):
+        return matching_mode
+    raise ValueError(f"Unknown matching mode '{matching_mode}', expected 'reference', 'global' or 'out_of_core'")
+
+def check_options(backend: dict, matching_options: dict):
+    """
+    Raises a ValueError if the backend does not accept all matching
+    options.
+    """
+    unsupported = sorted(set(matching_options) - set(backend["capabilities"]["options"]))
+    if unsupported:
+        raise ValueError(f"The matching backend '{backend['name']}' does not support the options {unsupported}")
+
+def call_backend(backend: dict, reference_path: Path, query_path: Path, orient_query: bool, redo: bool, num_workers: int, index_options: dict | None,
+                 query_records, matching_options: dict):
+    """
+    Calls the driver of a backend and returns its result.
+    """
+    arguments = {"orient_query": orient_query, "redo": redo, "index_options": index_options, **backend["fixed_options"], **matching_options}
+    if query_records is not None:
+        arguments["query_records"] = query_records
+    if backend["capabilities"]["parallel"]:
+        arguments["num_workers"] = num_workers or None
+    return backend["driver"](reference_path, query_path, **arguments)
+
+def run_backend(name: str, reference_path: Path, query_path: Path, orient_query: bool = False, redo: bool = False, num_workers: int = 0,
+                index_options: dict | None = None, query_records=None, calibration_options: dict | None = None, **matching_options):
+    """
+    Computes the intersection sizes with a registered backend.
+
+    Parameters
+    ----------
+    name : str
+        Name of a registered backend or "auto" (see select_backend).
+    reference_path : pathlib.Path
+        Path to the reference FASTA file.
+    query_path : pathlib.Path
+        Path to the query FASTA file.
+    orient_query : bool, optional
+        If True, query sequences are oriented prior to matching.
+    redo : bool, optional
+        If True, the reference lookup table is recomputed.
+    num_workers : int, optional
+        Number of workers of parallel backends; 0 uses all cores.
+    index_options : dict, optional
+        Keyword arguments forwarded to parse_reference_fasta.
+    query_records : iterable of Bio.SeqRecord.SeqRecord, optional
+        If given, these records are matched instead of the queries in
+        query_path (see streaming).
+    calibration_options : dict, optional
+        Keyword arguments forwarded to select_backend with "auto".
+    **matching_options
+        Keyword arguments forwarded to the driver.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (result, reference_names, runtime_info) as
+        returned by the driver, with the backend recorded in
+        runtime_info.
+    """
+    selection_info = {"matching_backend_selection": "fixed"}
+    if name == "auto":
+        if query_records is not None:
+            query_records = list(query_records)
+        result_path = reference_path.with_name(reference_path.stem + "_data.h5")
+        parser.parse_reference_fasta(reference_path, result_path, redo, **(index_options or {}))
+        redo = False
+        name, selection_info = select_backend(reference_path, query_path, orient_query, num_workers, index_options, query_records, matching_options,
+                                              **(calibration_options or {}))
+
+    backend = get_backend(name)
+    check_options(backend, matching_options)
+    result, reference_names, runtime_info = call_backend(backend, reference_path, query_path, orient_query, redo, num_workers, index_options,
+                                                         query_records, matching_options)
+
+    runtime_info["matching_backend"] = name
+    runtime_info["matching_backend_options"] = {**backend["fixed_options"], **matching_options}
+    if backend["capabilities"]["parallel"]:
+        runtime_info["matching_backend_options"]["num_workers"] = runtime_info.get("num_workers") or num_workers or os.cpu_count()
+    runtime_info.update(selection_info)
+    return result, reference_names, runtime_info
+
+def count_queries(query_path: Path, query_records=None) -> int:
+    """
+    Returns the number of queries of a FASTA file or record list.
+    """
+    if query_records is not None:
+        return len(query_records)
+    with open(query_path, "r") as f:
+        return sum(1 for line in f if line.startswith(">"))
+
+def get_candidate_backends(matching_options: dict, num_workers: int, query_count: int, reference_count: int, memory_limit_bytes: int | None,
+                           streaming: bool, exact: bool = True, lookup_groups: set[str] | None = None) -> list[str]:
+    """
+    Returns the backends suited to the input shape: backends accepting
+    all matching options, parallel backends only with more than one
+    worker, the out-of-core backend only if the result matrix would
+    exceed memory_limit_bytes, if exact is True, only exact backends
+    and, if the groups of the lookup table are given, only backends
+    whose index groups exist.
+    """
+    worker_count = num_workers or os.cpu_count() or 1
+    matrix_bytes = query_count * reference_count * 8
+    candidates = []
+    for name, backend in BACKENDS.items():
+        capabilities = backend["capabilities"]
+        if set(matching_options) - set(capabilities["options"]):
+            continue
+        if capabilities["parallel"] and worker_count <= 1:
+            continue
+        if streaming and not capabilities["streaming"]:
+            continue
+        if exact and not capabilities["exact"]:
+            continue
+        if lookup_groups is not None and set(capabilities["index_groups"]) - lookup_groups:
+            continue
+        if capabilities["out_of_core"] != (memory_limit_bytes is not None and matrix_bytes > memory_limit_bytes):
+            continue
+        candidates.append(name)
+    return candidates
+
+def time_backend(backend: dict, reference_path: Path, query_path: Path, orient_query: bool, num_workers: int, index_options: dict | None,
+                 query_records: list, matching_options: dict) -> float:
+    """
+    Returns the wall-clock time of matching query_records with a backend.
+    """
+    start_time = time.perf_counter()
+    call_backend(backend, reference_path, query_path, orient_query, False, num_workers, index_options, query_records, matching_options)
+    return time.perf_counter() - start_time
+
+def select_backend(reference_path: Path, query_path: Path, orient_query: bool = False, num_workers: int = 0, index_options: dict | None = None,
+                   query_records: list | None = None, matching_options: dict | None = None,
+                   calibration_query_count: int = DEFAULT_CALIBRATION_QUERY_COUNT, memory_limit_bytes: int | None = None, streaming: bool = False,
+                   exact: bool = True):
+    """
+    Selects the backend with the lowest estimated matching time for the
+    input shape. The lookup table must exist.
+
+    Every candidate backend (see get_candidate_backends) is warmed up
+    with one query, which also builds backend-specific index data, and
+    then timed on the first calibration_query_count // 2 and
+    calibration_query_count queries. The matching time of all queries is
+    extrapolated linearly from both samples, so that the fixed cost of a
+    backend, e.g. the pool startup, is not scaled with the query count.
+    A candidate that is already slower on the smaller sample than the
+    best estimate so far is not timed on the larger one.
+    Candidates failing on the lookup table (e.g. the batched_bitmask
+    kernel on a minimizer index) are skipped, as are candidates that
+    would first add their index groups (e.g. the global index) to the
+    lookup table. With exact set to False, backends
+    computing approximate intersection sizes (e.g. strided) compete as
+    well. If the input has no more queries than the calibration would
+    match, the sequential backend is chosen without calibration.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (name, selection_info), where selection_info
+        holds the runtime information entries of the selection.
+    """
+    matching_options = matching_options or {}
+    start_time = time.perf_counter()
+
+    result_path = reference_path.with_name(reference_path.stem + "_data.h5")
+    query_count = count_queries(query_path, query_records)
+    with h5py.File(result_path, "r") as f:
+        reference_count = len(parser.get_reference_ids(f))
+        lookup_groups = set(f.keys())
+    candidates = get_candidate_backends(matching_options, num_workers, query_count, reference_count, memory_limit_bytes, streaming, exact,
+                                        lookup_groups)
+    if not candidates:
+        raise ValueError(f"No matching backend supports the options {sorted(matching_options)} with the lookup table {result_path}")
+
+    estimates = {}
+    skipped = {}
+    small_count = max(calibration_query_count // 2, 1)
+    if len(candidates) == 1 or query_count <= 1 + small_count + calibration_query_count:
+        name = "sequential" if "sequential" in candidates else candidates[0]
+    else:
+        records = query_records if query_records is not None else SeqIO.parse(query_path, "fasta")
+        sample = list(itertools.islice(records, calibration_query_count))
+        for candidate in candidates:
+            backend = BACKENDS[candidate]
+            print(f"Calibrating matching backend {candidate}...")
+            try:
+                time_backend(backend, reference_path, query_path, orient_query, num_workers, index_options, sample[:1], matching_options)
+            except ValueError as error:
+                print(f"Skipping matching backend {candidate}: {error}")
+                skipped[candidate] = str(error)
+                continue
+            small_time = time_backend(backend, reference_path, query_path, orient_query, num_workers, index_options, sample[:small_count], matching_options)
+            if estimates and small_time >= min(estimates.values()):
+                estimates[candidate] = small_time
+                continue
+            large_time = time_backend(backend, reference_path, query_path, orient_query, num_workers, index_options, sample, matching_options)
+            per_query_time = max(large_time - small_time, 0) / (len(sample) - small_count)
+            estimates[candidate] = small_time + per_query_time * (query_count - small_count)
+        if not estimates:
+            raise ValueError(f"All candidate matching backends failed during calibration: {skipped}")
+        name = min(estimates, key=estimates.get)
+
+    print(f"Selected matching backend {name} for {query_count} queries and {reference_count} references.")
+    return name, {
+        "matching_backend_selection": "auto",
+        "matching_backend_candidates": candidates,
+        "matching_backend_estimates": estimates,
+        "matching_backend_skipped": skipped,
+        "matching_backend_calibration_time": time.perf_counter() - start_time,
+    }
@@ -0,0 +1,81 @@
+"""
+block_bitsets.py
+
+Description
+-----------
+Module for the per-block k-mer presence bitsets used by the strided
+window kernel (see kernels.calculate_intersection_size_strided).
+
+Each reference is divided into fixed blocks of block_size positions. For
+every block, a bitset over all KMER_COUNT k-mers marks the k-mers that
+start within the block. The bitsets of a reference are stored as a
+gzip-compressed (block count × KMER_COUNT / 64) uint64 matrix next to
+the regular lookup data.
+"""
+import numpy as np
+import h5py
+
+import raxtax_extension_prototype.constants as constants
+
+WORDS_PER_BITSET = constants.KMER_COUNT // 64
+
+def build_block_bitsets(kmer_indices: np.ndarray, block_size: int) -> np.ndarray:
+    """
+    Builds the k-mer presence bitsets of all blocks of a reference.
+
+    Parameters
+    ----------
+    kmer_indices : numpy.ndarray
+        K-mer index at every reference position, -1 for k-mers with
+        ambiguous bases.
+    block_size : int
+        Number of positions per block.
+
+    Returns
+    -------
+    numpy.ndarray
+        uint64 matrix of shape (block count, KMER_COUNT / 64).
+    """
+    block_count = max((len(kmer_indices) + block_size - 1) // block_size, 1)
+    bitsets = np.zeros(block_count * WORDS_PER_BITSET, dtype=np.uint64)
+
+    positions = np.flatnonzero(kmer_indices >= 0)
+    if len(positions) == 0:
+        return bitsets.reshape(block_count, WORDS_PER_BITSET)
+
+    #distinct (block, k-mer) pairs, sorted so that all bits of a word are adjacent
+    keys = np.unique((positions // block_size) * constants.KMER_COUNT + kmer_indices[positions])
+    kmers = keys % constants.KMER_COUNT
+    word_indices = (keys // constants.KMER_COUNT) * WORDS_PER_BITSET + (kmers >> 6)
+    bits = np.left_shift(np.uint64(1), (kmers & 63).astype(np.uint64))
+
+    word_starts = np.flatnonzero(np.concatenate(([True], word_indices[1:] != word_indices[:-1])))
+    bitsets[word_indices[word_starts]] = np.bitwise_or.reduceat(bits, word_starts)
+
+    return bitsets.reshape(block_count, WORDS_PER_BITSET)
+
+def write_block_bitsets(grp: h5py.Group, bitsets: np.ndarray, block_size: int):
+    """
+    Writes the block bitsets of one reference into its HDF5 group.
+    """
+    grp.attrs["block_size"] = block_size
+    grp.create_dataset("block_bitsets", data=bitsets, dtype=np.uint64, compression="gzip",
+                       chunks=(min(len(bitsets), 16), WORDS_PER_BITSET))
+
+def read_block_bitsets(grp: h5py.Group):
+    """
+    Loads the block bitsets of one reference from its HDF5 group.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (bitsets, block_size).
+
+    Raises
+    ------
+    ValueError
+        If the group contains no block bitsets.
+    """
+    if "block_bitsets" not in grp:
+        raise ValueError(f"No block bitsets found in group {grp.name}, rebuild the lookup table with a block_size")
+    return grp["block_bitsets"][:], int(grp.attrs["block_size"])
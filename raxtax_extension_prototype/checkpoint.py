@@ -0,0 +1,110 @@
+"""
+checkpoint.py
+
+Description
+-----------
+Module for checkpointing the reference columns completed by a matching
+run.
+
+A checkpoint is a result matrix (see result_matrix) in a directory named
+after the hash of the lookup table and the hash of the query set. The
+index hash is computed from the reference FASTA file and the index
+options when the lookup table is built; the query-set hash covers the
+query names, k-mer sets and window sizes and the kernel, i.e. everything
+the kernel values depend on. Every completed column stores the values of
+the pairs matched for the reference and -1 for all other pairs, so that a
+column is only restored if all current candidate pairs of its reference
+were matched.
+"""
+import json
+import shutil
+import hashlib
+from pathlib import Path
+import numpy as np
+import h5py
+
+import raxtax_extension_prototype.result_matrix as result_matrix
+
+#default number of seconds between two flushes of a checkpoint
+DEFAULT_CHECKPOINT_INTERVAL = 60
+
+def hash_file(path: Path) -> str:
+    """
+    Returns the SHA-256 digest of the contents of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hash_reference_index(reference_path: Path, index_options: dict) -> str:
+    """
+    Returns the hash identifying a lookup table by its reference FASTA
+    file and the options it was built with.
+    """
+    digest = hashlib.sha256(hash_file(reference_path).encode("ascii"))
+    digest.update(json.dumps(index_options, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+def get_index_hash(f: h5py.File, result_path: Path) -> str:
+    """
+    Returns the index hash stored in a lookup table, or the hash of the
+    lookup table file if it was built without one.
+    """
+    return str(f.attrs.get("index_hash", "")) or hash_file(result_path)
+
+def hash_query_set(query_data: dict, window_sizes, kernel: str) -> str:
+    """
+    Returns the hash identifying a query set by the names, k-mer sets and
+    window sizes of its queries and the matching kernel.
+    """
+    digest = hashlib.sha256(kernel.encode("utf-8"))
+    for query_name, kmer_set, window_size in zip(query_data["query_names"], query_data["kmer_sets"], window_sizes):
+        digest.update(query_name.encode("utf-8") + b"\n")
+        digest.update(np.asarray(kmer_set, dtype=np.int64).tobytes())
+        digest.update(np.int64(window_size).tobytes())
+    return digest.hexdigest()
+
+def open_checkpoint(checkpoint_dir: Path, index_hash: str, query_hash: str, query_count: int, reference_count: int) -> dict:
+    """
+    Opens the checkpoint of a matching run within checkpoint_dir, or
+    creates it if none exists.
+    """
+    checkpoint_path = Path(checkpoint_dir) / f"{index_hash[:16]}_{query_hash[:16]}"
+    return result_matrix.open_result_matrix(checkpoint_path, query_count, reference_count, f"{index_hash}_{query_hash}")
+
+def restore_columns(checkpoint: dict, candidate_query_ids, intersection_sizes: np.ndarray) -> set[int]:
+    """
+    Copies the checkpointed values of all completed references whose
+    current candidate pairs were all matched into intersection_sizes.
+
+    Returns
+    -------
+    set of int
+        Ids of the restored references.
+    """
+    restored = set()
+    for reference_id in result_matrix.get_completed_references(checkpoint):
+        query_ids = candidate_query_ids[reference_id]
+        column = result_matrix.read_column(checkpoint, reference_id)
+        if np.all(column[query_ids] >= 0):
+            intersection_sizes[query_ids, reference_id] = column[query_ids]
+            restored.add(int(reference_id))
+    return restored
+
+def save_column(checkpoint: dict, reference_id: int, query_ids: np.ndarray, sizes: np.ndarray):
+    """
+    Writes the values of the matched pairs of a completed reference. The
+    column is persisted with the next flush.
+    """
+    column = np.full(checkpoint["shape"][0], -1, dtype=np.int64)
+    column[query_ids] = sizes
+    result_matrix.write_column(checkpoint, reference_id, column)
+    result_matrix.mark_completed(checkpoint, reference_id, flush=False)
+
+def remove_checkpoint(checkpoint: dict):
+    """
+    Deletes a checkpoint once its matching run has completed.
+    """
+    shutil.rmtree(checkpoint["path"], ignore_errors=True)
@@ -0,0 +1,177 @@
+"""
+clades.py
+
+Description
+-----------
+Module for clade-level pruning of query–reference pairs.
+
+References are grouped into clades by the prefixes of their lineage
+(e.g. "K_a", "K_a,P_0", "K_a,P_0,C_00"). For each clade, the union of
+the k-mer presence sets of its references is stored. Since the number of
+k-mers a query shares with any member reference cannot exceed the number
+it shares with the union, nor the number of k-mers fitting into the
+query window, the capped union count bounds the windowed intersection
+size of every member reference.
+
+Matching descends the taxonomy from the top-level clades: a clade is
+only evaluated for the queries that passed its parent, and a query is
+pruned from a clade, together with all its descendants and references,
+as soon as the bound falls below the floor. Pruned pairs are bounded by
+the bound of the clade at which they were pruned.
+"""
+import numpy as np
+import h5py
+from scipy import sparse
+
+import raxtax_extension_prototype.constants as constants
+
+#separator between the ranks of a lineage
+RANK_SEPARATOR = ","
+
+def lineage_prefixes(lineage: str) -> list[str]:
+    """
+    Returns all rank prefixes of a lineage, from the top rank down to the
+    full lineage.
+    """
+    ranks = lineage.split(RANK_SEPARATOR)
+    return [RANK_SEPARATOR.join(ranks[:depth]) for depth in range(1, len(ranks) + 1)]
+
+def build_clade_index(reference_names: list[str], presence_matrix: sparse.csr_matrix) -> dict:
+    """
+    Builds the clade tree of a set of references and the union k-mer
+    presence set of every clade.
+
+    Parameters
+    ----------
+    reference_names : list of str
+        Lineages of the references.
+    presence_matrix : scipy.sparse.csr_matrix
+        Binary reference × k-mer presence matrix.
+
+    Returns
+    -------
+    dict
+        Dictionary with the clade names, the parent of each clade (-1 for
+        top-level clades), the deepest clade of each reference and the
+        union presence sets as CSR arrays (indptr, indices). Parents
+        always precede their children.
+    """
+    prefixes = [lineage_prefixes(name) for name in reference_names]
+    clade_names = sorted({prefix for reference_prefixes in prefixes for prefix in reference_prefixes},
+                         key=lambda name: (name.count(RANK_SEPARATOR), name))
+    clade_ids = {name: clade_id for clade_id, name in enumerate(clade_names)}
+
+    parents = np.full(len(clade_names), -1, dtype=np.int64)
+    for reference_prefixes in prefixes:
+        for parent, child in zip(reference_prefixes[:-1], reference_prefixes[1:]):
+            parents[clade_ids[child]] = clade_ids[parent]
+
+    #clade × reference membership, multiplied with the presence matrix to obtain the unions
+    rows = [clade_ids[prefix] for reference_prefixes in prefixes for prefix in reference_prefixes]
+    columns = [reference_id for reference_id, reference_prefixes in enumerate(prefixes) for _ in reference_prefixes]
+    membership = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)), shape=(len(clade_names), len(reference_names)))
+    unions = (membership @ presence_matrix).tocsr()
+    unions.sum_duplicates()
+    unions.sort_indices()
+
+    return {
+        "clade_names": clade_names,
+        "parents": parents,
+        "reference_clades": np.array([clade_ids[reference_prefixes[-1]] for reference_prefixes in prefixes], dtype=np.int64),
+        "indptr": unions.indptr.astype(np.uint64),
+        "indices": unions.indices.astype(np.uint16),
+    }
+
+def write_clade_index(f: h5py.File, clade_index: dict):
+    """
+    Writes a clade index into the "clades" group of a lookup table.
+    """
+    grp = f.create_group("clades")
+    grp.create_dataset("clade_names", data=clade_index["clade_names"], dtype=h5py.string_dtype())
+    grp.create_dataset("parents", data=clade_index["parents"], dtype=np.int64)
+    grp.create_dataset("reference_clades", data=clade_index["reference_clades"], dtype=np.int64)
+    grp.create_dataset("indptr", data=clade_index["indptr"], dtype=np.uint64)
+    grp.create_dataset("indices", data=clade_index["indices"], dtype=np.uint16, compression="gzip")
+
+def read_clade_index(f: h5py.File) -> dict | None:
+    """
+    Reads the clade index of a lookup table, or returns None if the
+    lookup table was written without one.
+    """
+    if "clades" not in f:
+        return None
+    grp = f["clades"]
+    return {
+        "clade_names": list(grp["clade_names"].asstr()[:]),
+        "parents": grp["parents"][:],
+        "reference_clades": grp["reference_clades"][:],
+        "indptr": grp["indptr"][:],
+        "indices": grp["indices"][:],
+    }
+
+def prune_clades(clade_index: dict, query_matrix: sparse.csr_matrix, query_sequence_lengths, floor: int):
+    """
+    Descends the clade tree and prunes clades whose union bound lies
+    below the floor.
+
+    Parameters
+    ----------
+    clade_index : dict
+        Dictionary returned by build_clade_index or read_clade_index.
+    query_matrix : scipy.sparse.csr_matrix
+        Binary query × k-mer matrix.
+    query_sequence_lengths : list of int
+        Lengths of the query sequences, used as window sizes.
+    floor : int
+        Minimum bound of a clade that is descended into.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (candidate_query_ids, clade_bounds,
+        pruned_counts), where candidate_query_ids holds for each
+        reference the ids of the queries that were not pruned,
+        clade_bounds is the query × reference matrix holding the bound
+        of the pruning clade for pruned pairs and zero otherwise, and
+        pruned_counts holds for each clade the number of queries pruned
+        at that clade.
+    """
+    floor = max(floor, 1)
+    query_count = query_matrix.shape[0]
+    parents = clade_index["parents"]
+    clade_count = len(parents)
+    window_capacity = np.maximum(np.asarray(query_sequence_lengths, dtype=np.int64) - constants.K + 1, 0)
+
+    all_queries = np.arange(query_count)
+    survivors = [None] * clade_count
+    pruned = [None] * clade_count
+    union_mask = np.zeros(constants.KMER_COUNT, dtype=np.int32)
+
+    for clade_id in range(clade_count):
+        active = all_queries if parents[clade_id] < 0 else survivors[parents[clade_id]]
+        if len(active) == 0:
+            survivors[clade_id] = active
+            pruned[clade_id] = (active, np.zeros(0, dtype=np.int64))
+            continue
+
+        union = clade_index["indices"][int(clade_index["indptr"][clade_id]):int(clade_index["indptr"][clade_id + 1])].astype(np.int64)
+        union_mask[union] = 1
+        bounds = np.minimum(query_matrix[active] @ union_mask, window_capacity[active]).astype(np.int64)
+        union_mask[union] = 0
+
+        passed = bounds >= floor
+        survivors[clade_id] = active[passed]
+        pruned[clade_id] = (active[~passed], bounds[~passed])
+
+    reference_clades = clade_index["reference_clades"]
+    clade_bounds = np.zeros((query_count, len(reference_clades)), dtype=np.int64)
+    for reference_id, clade_id in enumerate(reference_clades):
+        while clade_id >= 0:
+            query_ids, bounds = pruned[clade_id]
+            clade_bounds[query_ids, reference_id] = bounds
+            clade_id = parents[clade_id]
+
+    candidate_query_ids = [survivors[clade_id] for clade_id in reference_clades]
+    pruned_counts = np.array([len(pruned[clade_id][0]) for clade_id in range(clade_count)], dtype=np.int64)
+
+    return candidate_query_ids, clade_bounds, pruned_counts
@@ -0,0 +1,75 @@
+"""
+dedup.py
+
+Description
+-----------
+Module for collapsing identical query and reference sequences.
+
+Sequences are normalized (upper case, without whitespace) and hashed.
+Sequences with equal digests form one group that is matched only once;
+since identical sequences have identical k-mer sets, lengths and
+occurrence positions, the result of the group applies to every member
+and is fanned back out before scoring.
+
+Reference groups are stored in the lookup table: one reference group per
+distinct sequence, carrying the lineages of all its members in the
+"names" attribute, plus the datasets "all_reference_names" (the lineage
+of every input reference) and "reference_groups" (the group of every
+input reference).
+"""
+import hashlib
+import numpy as np
+import h5py
+
+def normalize_sequence(sequence: str) -> str:
+    """
+    Returns the upper case sequence without whitespace.
+    """
+    return "".join(sequence.split()).upper()
+
+def sequence_digest(sequence: str) -> bytes:
+    """
+    Returns the SHA-256 digest of the normalized sequence.
+    """
+    return hashlib.sha256(normalize_sequence(sequence).encode("ascii")).digest()
+
+def group_duplicates(sequences) -> tuple[list[int], np.ndarray]:
+    """
+    Groups identical sequences.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (representatives, groups), where
+        representatives holds the index of the first sequence of every
+        group and groups the group of every sequence.
+    """
+    group_ids = {}
+    representatives = []
+    groups = np.zeros(len(sequences), dtype=np.int64)
+
+    for sequence_id, sequence in enumerate(sequences):
+        digest = sequence_digest(sequence)
+        if digest not in group_ids:
+            group_ids[digest] = len(representatives)
+            representatives.append(sequence_id)
+        groups[sequence_id] = group_ids[digest]
+
+    return representatives, groups
+
+def write_reference_groups(f: h5py.File, reference_names: list[str], reference_groups: np.ndarray):
+    """
+    Writes the lineage and the group of every input reference into a
+    lookup table.
+    """
+    f.create_dataset("all_reference_names", data=reference_names, dtype=h5py.string_dtype())
+    f.create_dataset("reference_groups", data=reference_groups, dtype=np.int64)
+
+def read_reference_groups(f: h5py.File):
+    """
+    Reads the lineage and the group of every input reference, or returns
+    None if the lookup table was written without deduplication.
+    """
+    if "reference_groups" not in f:
+        return None
+    return list(f["all_reference_names"].asstr()[:]), f["reference_groups"][:]
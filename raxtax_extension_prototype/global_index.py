@@ -0,0 +1,153 @@
+"""
+global_index.py
+
+Description
+-----------
+Module for the global cross-reference inverted index.
+
+The global index maps every k-mer to all (reference, position) pairs in
+one CSR structure. The entries of a k-mer are grouped by reference and
+sorted by position, so a query fetches the occurrences of all of its
+k-mers in one pass and only the references it actually hits are
+evaluated.
+
+Layout within the lookup table (HDF5 group "global_index"):
+
+- "kmer_offsets": KMER_COUNT + 1 offsets into the entry arrays
+- "reference_ids": reference index of every entry
+- "positions": reference position of every entry
+- "reference_names": names of the references in index order
+"""
+import numpy as np
+import h5py
+from pathlib import Path
+
+import raxtax_extension_prototype.constants as constants
+import raxtax_extension_prototype.kernels as kernels
+
+def build_global_index(kmer_list: list, position_list: list, reference_names: list) -> dict:
+    """
+    Builds the global inverted index from the k-mer occurrences of all
+    reference sequences.
+
+    Parameters
+    ----------
+    kmer_list : list of numpy.ndarray
+        For each reference, the k-mer of every occurrence.
+    position_list : list of numpy.ndarray
+        For each reference, the position of every occurrence, sorted
+        ascending within each k-mer.
+    reference_names : list of str
+        Names of the reference sequences.
+
+    Returns
+    -------
+    dict
+        Dictionary in the layout described in the module docstring.
+    """
+    reference_id_list = [np.full(len(positions), reference_id, dtype=np.uint32) for reference_id, positions in enumerate(position_list)]
+
+    kmers = np.concatenate(kmer_list).astype(np.int64) if kmer_list else np.zeros(0, dtype=np.int64)
+    reference_ids = np.concatenate(reference_id_list) if reference_id_list else np.zeros(0, dtype=np.uint32)
+    positions = np.concatenate(position_list) if position_list else np.zeros(0, dtype=np.int64)
+
+    #entries are concatenated by reference, so a stable sort by k-mer keeps them grouped by reference
+    order = np.argsort(kmers, kind="stable")
+    kmer_offsets = np.concatenate(([0], np.cumsum(np.bincount(kmers, minlength=constants.KMER_COUNT))))
+
+    return {
+        "kmer_offsets": kmer_offsets.astype(np.int64),
+        "reference_ids": reference_ids[order],
+        "positions": positions[order].astype(np.uint32),
+        "reference_names": list(reference_names),
+    }
+
+def write_global_index(f: h5py.File, global_index: dict):
+    """
+    Writes the global inverted index into the group "global_index" of an
+    open lookup table, replacing an existing one.
+    """
+    if "global_index" in f:
+        del f["global_index"]
+    grp = f.create_group("global_index")
+    grp.create_dataset("kmer_offsets", data=global_index["kmer_offsets"], dtype=np.uint64)
+    grp.create_dataset("reference_ids", data=global_index["reference_ids"], dtype=np.uint32)
+    grp.create_dataset("positions", data=global_index["positions"], dtype=np.uint32)
+    grp.create_dataset("reference_names", data=global_index["reference_names"], dtype=h5py.string_dtype())
+
+def load_global_index(result_path: Path) -> dict:
+    """
+    Loads the global inverted index into memory.
+
+    Parameters
+    ----------
+    result_path : pathlib.Path
+        Path to the HDF5 lookup table.
+
+    Returns
+    -------
+    dict
+        Dictionary containing the arrays "kmer_offsets",
+        "reference_ids" and "positions" and the list "reference_names".
+
+    Raises
+    ------
+    ValueError
+        If the lookup table does not contain a global index.
+    """
+    with h5py.File(result_path, "r") as f:
+        if "global_index" not in f:
+            raise ValueError(f"{result_path} does not contain a global index, build it with parse_reference_fasta(..., global_index=True)")
+        grp = f["global_index"]
+        return {
+            "kmer_offsets": grp["kmer_offsets"][:].astype(np.int64),
+            "reference_ids": grp["reference_ids"][:],
+            "positions": grp["positions"][:],
+            "reference_names": list(grp["reference_names"].asstr()[:]),
+        }
+
+def calculate_query_intersection_sizes(global_index: dict, kmer_set, window_size: int) -> np.ndarray:
+    """
+    Computes the k-mer intersection sizes between one query and all
+    reference sequences using the global inverted index.
+
+    Only the index entries of the query k-mers are touched, so the cost
+    scales with the number of hits of the query rather than with the
+    number of references.
+
+    Parameters
+    ----------
+    global_index : dict
+        Global index as returned by load_global_index.
+    kmer_set : numpy.ndarray
+        Query k-mer set.
+    window_size : int
+        Size of the sliding window applied to the reference sequences.
+
+    Returns
+    -------
+    numpy.ndarray
+        K-mer intersection size between the query and each reference.
+    """
+    reference_count = len(global_index["reference_names"])
+    kmer_set = np.asarray(kmer_set, dtype=np.int64)
+    kmer_offsets = global_index["kmer_offsets"]
+
+    #expand the CSR ranges of all query k-mers into one index array
+    range_starts = kmer_offsets[kmer_set]
+    range_lengths = kmer_offsets[kmer_set + 1] - range_starts
+    hit_count = int(range_lengths.sum())
+    if hit_count == 0:
+        return np.zeros(reference_count, dtype=np.int64)
+    range_ends = np.cumsum(range_lengths)
+    entries = np.arange(hit_count) + np.repeat(range_starts - (range_ends - range_lengths), range_lengths)
+
+    hit_kmers = np.repeat(kmer_set, range_lengths)
+    reference_ids = global_index["reference_ids"][entries].astype(np.int64)
+    positions = global_index["positions"][entries].astype(np.int64)
+
+    previous_positions = np.full(hit_count, kernels.NO_PREVIOUS_POSITION, dtype=np.int64)
+    same_group = (hit_kmers[1:] == hit_kmers[:-1]) & (reference_ids[1:] == reference_ids[:-1])
+    previous_positions[1:][same_group] = positions[:-1][same_group]
+
+    return kernels.max_window_hits_by_group(reference_ids, positions, previous_positions, window_size, reference_count)
@@ -0,0 +1,450 @@
+"""
+kernels.py
+
+Description
+-----------
+Vectorized kernels for computing windowed k-mer intersection sizes.
+
+All kernels compute the same quantity as
+parser_short_long.calculate_intersection_size: the maximum number of
+distinct query k-mers that occur within a window of window_size bases
+of the reference sequence.
+"""
+import numpy as np
+
+import raxtax_extension_prototype.constants as constants
+
+#previous position assigned to the first occurrence of a k-mer
+NO_PREVIOUS_POSITION = -(1 << 62)
+
+#maximum number of k-mer occurrences gathered at once by calculate_intersection_sizes_batched
+BATCH_OCCURRENCES = 1 << 22
+
+#number of set bits of every byte value, used if numpy lacks bitwise_count
+POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """
+    Counts the set bits of uint64 words, summed over the last axis.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    words = np.ascontiguousarray(words, dtype=np.uint64)
+    return POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+def max_window_hits(positions: np.ndarray, previous_positions: np.ndarray, window_size: int) -> int:
+    """
+    Computes the maximum number of distinct k-mers covered by a window
+    from k-mer occurrences.
+
+    Each occurrence at position p whose previous occurrence of the same
+    k-mer lies at p' adds one to all window starts in
+    [max(p' + 1, p - window_size + K), p]. The maximum over all window
+    starts is found with a sorted sweep over interval boundaries, so the
+    cost depends on the number of occurrences only.
+
+    Parameters
+    ----------
+    positions : numpy.ndarray
+        Reference positions of the query k-mer occurrences.
+    previous_positions : numpy.ndarray
+        Position of the preceding occurrence of the same k-mer, or
+        NO_PREVIOUS_POSITION for the first occurrence.
+    window_size : int
+        Size of the sliding window applied to the reference sequence.
+
+    Returns
+    -------
+    int
+        Maximum windowed k-mer intersection size.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    starts = np.maximum(np.asarray(previous_positions, dtype=np.int64) + 1, positions - window_size + constants.K)
+    ends = positions + 1
+    nonempty = starts < ends
+    if not np.any(nonempty):
+        return 0
+
+    #at equal coordinates interval ends are processed before interval starts
+    keys = np.concatenate((starts[nonempty] * 2 + 1, ends[nonempty] * 2))
+    deltas = np.concatenate((np.ones(np.count_nonzero(nonempty), dtype=np.int64),
+                             -np.ones(np.count_nonzero(nonempty), dtype=np.int64)))
+    order = np.argsort(keys, kind="stable")
+
+    return int(np.max(np.cumsum(deltas[order])))
+
+def calculate_intersection_size_mask(kmer_indices: np.ndarray, query_mask: np.ndarray, window_size: int) -> int:
+    """
+    Computes the maximum k-mer intersection size between a query and a
+    sliding window within a reference sequence using a membership mask
+    over the k-mer of every reference position.
+
+    Parameters
+    ----------
+    kmer_indices : numpy.ndarray
+        K-mer index at every reference position, -1 for k-mers with
+        ambiguous bases.
+    query_mask : numpy.ndarray
+        Boolean array of length KMER_COUNT marking the query k-mers.
+    window_size : int
+        Size of the sliding window applied to the reference sequence.
+
+    Returns
+    -------
+    int
+        Maximum k-mer intersection size between the query and the
+        reference sequence.
+    """
+    hits = query_mask[kmer_indices]
+    hits &= kmer_indices >= 0
+    positions = np.flatnonzero(hits)
+    if len(positions) == 0:
+        return 0
+
+    #group occurrences by k-mer, keeping positions ascending within each group
+    hit_kmers = kmer_indices[positions]
+    order = np.argsort(hit_kmers, kind="stable")
+    positions = positions[order]
+    hit_kmers = hit_kmers[order]
+
+    previous_positions = np.full(len(positions), NO_PREVIOUS_POSITION, dtype=np.int64)
+    same_kmer = hit_kmers[1:] == hit_kmers[:-1]
+    previous_positions[1:][same_kmer] = positions[:-1][same_kmer]
+
+    return max_window_hits(positions, previous_positions, window_size)
+
+def calculate_intersection_size_positions(flat_data: np.ndarray, offsets: np.ndarray, kmer_set: np.ndarray, window_size: int) -> int:
+    """
+    Computes the maximum k-mer intersection size between a query and a
+    sliding window within a reference sequence from the reference k-mer
+    position lists, gathering the occurrences of all query k-mers at
+    once.
+
+    Parameters
+    ----------
+    flat_data : numpy.ndarray
+        Flattened array of k-mer positions for the reference sequence
+        sorted lexicographically by k-mer identity.
+    offsets : numpy.ndarray
+        Offset array defining k-mer position ranges in flat_data.
+    kmer_set : numpy.ndarray
+        Query k-mer set.
+    window_size : int
+        Size of the sliding window applied to the reference sequence.
+
+    Returns
+    -------
+    int
+        Maximum k-mer intersection size between the query and the
+        reference sequence.
+    """
+    kmer_set = np.asarray(kmer_set, dtype=np.int64)
+    bucket_starts = offsets[kmer_set].astype(np.int64)
+    bucket_sizes = offsets[kmer_set + 1].astype(np.int64) - bucket_starts
+    bucket_starts = bucket_starts[bucket_sizes > 0]
+    bucket_sizes = bucket_sizes[bucket_sizes > 0]
+    if len(bucket_sizes) == 0:
+        return 0
+
+    #expand the bucket ranges into indices of flat_data
+    first_entries = np.cumsum(bucket_sizes) - bucket_sizes
+    indices = np.arange(int(bucket_sizes.sum()), dtype=np.int64) + np.repeat(bucket_starts - first_entries, bucket_sizes)
+    positions = flat_data[indices].astype(np.int64)
+
+    previous_positions = np.empty(len(positions), dtype=np.int64)
+    previous_positions[1:] = positions[:-1]
+    previous_positions[first_entries] = NO_PREVIOUS_POSITION
+
+    return max_window_hits(positions, previous_positions, window_size)
+
+def max_window_hits_by_group(groups: np.ndarray, positions: np.ndarray, previous_positions: np.ndarray, window_size: int, group_count: int) -> np.ndarray:
+    """
+    Computes max_window_hits independently for several groups of k-mer
+    occurrences (e.g. one group per reference sequence) in a single
+    sorted sweep.
+
+    Parameters
+    ----------
+    groups : numpy.ndarray
+        Group identifier of every occurrence, in the range
+        [0, group_count).
+    positions : numpy.ndarray
+        Positions of the k-mer occurrences within their group.
+    previous_positions : numpy.ndarray
+        Position of the preceding occurrence of the same k-mer within
+        the same group, or NO_PREVIOUS_POSITION.
+    window_size : int or numpy.ndarray
+        Size of the sliding window, or the window size of every
+        occurrence.
+    group_count : int
+        Number of groups.
+
+    Returns
+    -------
+    numpy.ndarray
+        Maximum windowed intersection size of every group, zero for
+        groups without occurrences.
+    """
+    result = np.zeros(group_count, dtype=np.int64)
+
+    positions = np.asarray(positions, dtype=np.int64)
+    starts = np.maximum(np.asarray(previous_positions, dtype=np.int64) + 1, positions - window_size + constants.K)
+    ends = positions + 1
+    nonempty = starts < ends
+    if not np.any(nonempty):
+        return result
+
+    groups = np.asarray(groups, dtype=np.int64)[nonempty]
+    starts = starts[nonempty]
+    ends = ends[nonempty]
+
+    #sort by group first, then by coordinate with interval ends before starts
+    lowest = int(starts.min()) * 2
+    span = int(ends.max()) * 2 + 2 - lowest
+    keys = np.concatenate((groups * span + (starts * 2 + 1 - lowest), groups * span + (ends * 2 - lowest)))
+    deltas = np.concatenate((np.ones(len(starts), dtype=np.int64), -np.ones(len(ends), dtype=np.int64)))
+    order = np.argsort(keys, kind="stable")
+
+    #every interval closes within its group, so the running sum restarts at zero for each group
+    counts = np.cumsum(deltas[order])
+    sorted_groups = np.concatenate((groups, groups))[order]
+    group_starts = np.flatnonzero(np.concatenate(([True], sorted_groups[1:] != sorted_groups[:-1])))
+    result[sorted_groups[group_starts]] = np.maximum.reduceat(counts, group_starts)
+
+    return result
+
+def calculate_intersection_sizes_batched(flat_data: np.ndarray, offsets: np.ndarray, query_kmer_sets, window_sizes) -> np.ndarray:
+    """
+    Computes the maximum k-mer intersection sizes between one reference
+    and many queries from the reference k-mer position lists.
+
+    The occurrences of the k-mers of all queries are gathered and swept
+    with max_window_hits_by_group, one group per query, so that the work
+    is done in a few large NumPy calls per batch of queries instead of a
+    Python loop per query. Queries are batched such that at most
+    BATCH_OCCURRENCES occurrences are gathered at a time.
+
+    Parameters
+    ----------
+    flat_data : numpy.ndarray
+        Flattened array of k-mer positions for the reference sequence
+        sorted lexicographically by k-mer identity.
+    offsets : numpy.ndarray
+        Offset array defining k-mer position ranges in flat_data.
+    query_kmer_sets : list of numpy.ndarray
+        K-mer sets of the queries.
+    window_sizes : list of int
+        Window size of every query.
+
+    Returns
+    -------
+    numpy.ndarray
+        Maximum k-mer intersection size of every query.
+    """
+    intersection_sizes = np.zeros(len(query_kmer_sets), dtype=np.int64)
+    kmer_counts = np.diff(offsets.astype(np.int64))
+    occurrence_counts = [int(kmer_counts[np.asarray(kmer_set, dtype=np.int64)].sum()) for kmer_set in query_kmer_sets]
+
+    batch_start = 0
+    while batch_start < len(query_kmer_sets):
+        batch_end = batch_start + 1
+        batch_occurrences = occurrence_counts[batch_start]
+        while batch_end < len(query_kmer_sets) and batch_occurrences + occurrence_counts[batch_end] <= BATCH_OCCURRENCES:
+            batch_occurrences += occurrence_counts[batch_end]
+            batch_end += 1
+
+        batch_sets = [np.asarray(kmer_set, dtype=np.int64) for kmer_set in query_kmer_sets[batch_start:batch_end]]
+        kmers = np.concatenate(batch_sets) if batch_sets else np.zeros(0, dtype=np.int64)
+        kmer_queries = np.repeat(np.arange(len(batch_sets)), [len(kmer_set) for kmer_set in batch_sets])
+        bucket_starts = offsets[kmers].astype(np.int64)
+        bucket_sizes = kmer_counts[kmers]
+        present = bucket_sizes > 0
+        bucket_starts = bucket_starts[present]
+        bucket_sizes = bucket_sizes[present]
+
+        if len(bucket_sizes) > 0:
+            #expand the bucket ranges into indices of flat_data, as in calculate_intersection_size_positions
+            first_entries = np.cumsum(bucket_sizes) - bucket_sizes
+            indices = np.arange(int(bucket_sizes.sum()), dtype=np.int64) + np.repeat(bucket_starts - first_entries, bucket_sizes)
+            positions = flat_data[indices].astype(np.int64)
+
+            previous_positions = np.empty(len(positions), dtype=np.int64)
+            previous_positions[1:] = positions[:-1]
+            previous_positions[first_entries] = NO_PREVIOUS_POSITION
+
+            groups = np.repeat(kmer_queries[present], bucket_sizes)
+            occurrence_windows = np.asarray(window_sizes[batch_start:batch_end], dtype=np.int64)[groups]
+            intersection_sizes[batch_start:batch_end] = max_window_hits_by_group(groups, positions, previous_positions, occurrence_windows,
+                                                                                 batch_end - batch_start)
+        batch_start = batch_end
+
+    return intersection_sizes
+
+def strided_window_blocks(window_size: int, block_size: int):
+    """
+    Returns the number of consecutive blocks that cover every window
+    (upper) and the number of consecutive blocks that fit into a window
+    starting at a block boundary (lower).
+
+    A window of size window_size counts the k-mers starting at
+    n = window_size - K + 1 consecutive positions. These positions touch
+    at most floor((n + block_size - 2) / block_size) + 1 blocks, while
+    floor(n / block_size) aligned blocks lie entirely within one window.
+    """
+    kmer_count = max(window_size - constants.K + 1, 0)
+    if kmer_count == 0:
+        return 0, 0
+    return (kmer_count + block_size - 2) // block_size + 1, kmer_count // block_size
+
+def calculate_intersection_size_strided(block_bitsets: np.ndarray, block_size: int, kmer_set: np.ndarray, window_size: int) -> int:
+    """
+    Approximates the maximum k-mer intersection size between a query and
+    a sliding window within a reference sequence using per-block k-mer
+    presence bitsets.
+
+    Only windows spanning whole blocks are evaluated: for every block j,
+    the bitsets of the upper consecutive blocks starting at j (see
+    strided_window_blocks) are OR-ed and intersected with the query
+    bitset. Only the bitset words containing query k-mers are touched.
+
+    Since every window lies within the upper blocks starting at some j,
+    the result is never below the exact maximum. Conversely, the span
+    attaining the result contains lower aligned blocks that fit into one
+    window, and each of the remaining upper - lower blocks adds at most
+    block_size k-mers. The distance from the exact maximum is therefore
+    at most (upper - lower) * block_size.
+
+    Parameters
+    ----------
+    block_bitsets : numpy.ndarray
+        uint64 matrix of block bitsets (see block_bitsets).
+    block_size : int
+        Number of positions per block.
+    kmer_set : numpy.ndarray
+        Query k-mer set.
+    window_size : int
+        Size of the sliding window applied to the reference sequence.
+
+    Returns
+    -------
+    int
+        Upper bound on the maximum k-mer intersection size.
+    """
+    upper_blocks, _ = strided_window_blocks(window_size, block_size)
+    kmer_set = np.unique(np.asarray(kmer_set, dtype=np.int64))
+    if upper_blocks == 0 or len(kmer_set) == 0:
+        return 0
+
+    #query bitset restricted to the words that contain query k-mers
+    words = kmer_set >> 6
+    word_starts = np.flatnonzero(np.concatenate(([True], words[1:] != words[:-1])))
+    query_words = np.bitwise_or.reduceat(np.left_shift(np.uint64(1), (kmer_set & 63).astype(np.uint64)), word_starts)
+    block_hits = block_bitsets[:, words[word_starts]] & query_words
+
+    #OR of upper consecutive blocks for every starting block
+    block_count = len(block_hits)
+    padded = np.zeros((block_count + upper_blocks - 1, len(query_words)), dtype=np.uint64)
+    padded[:block_count] = block_hits
+    spans = padded[:block_count].copy()
+    for offset in range(1, upper_blocks):
+        spans |= padded[offset:offset + block_count]
+
+    return int(popcount(spans).max())
+
+#number of queries whose k-mer membership shares one uint64 mask of the bitmask kernel
+QUERIES_PER_MASK = 64
+
+def build_occurrence_stream(kmers: np.ndarray, positions: np.ndarray):
+    """
+    Converts k-mer occurrences grouped by k-mer (see
+    parser_short_long.get_reference_occurrences) into a stream ordered
+    by reference position.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (positions, kmers, previous_positions) in
+        ascending position order, where previous_positions holds the
+        position of the preceding occurrence of the same k-mer or
+        NO_PREVIOUS_POSITION.
+    """
+    kmers = np.asarray(kmers, dtype=np.int64)
+    positions = np.asarray(positions, dtype=np.int64)
+
+    previous_positions = np.full(len(positions), NO_PREVIOUS_POSITION, dtype=np.int64)
+    same_kmer = kmers[1:] == kmers[:-1]
+    previous_positions[1:][same_kmer] = positions[:-1][same_kmer]
+
+    order = np.argsort(positions, kind="stable")
+    return positions[order], kmers[order], previous_positions[order]
+
+def build_query_masks(query_kmer_sets, query_sequence_lengths) -> list:
+    """
+    Packs the k-mer membership of up to QUERIES_PER_MASK queries of
+    equal length into one uint64 mask per k-mer.
+
+    Returns
+    -------
+    list of tuples
+        Tuples of the form (query_ids, query_masks, window_size), where
+        bit j of query_masks[kmer] is set if the k-mer belongs to query
+        query_ids[j].
+    """
+    query_sequence_lengths = np.asarray(query_sequence_lengths, dtype=np.int64)
+    masks = []
+
+    for window_size in np.unique(query_sequence_lengths):
+        length_query_ids = np.flatnonzero(query_sequence_lengths == window_size)
+        for mask_start in range(0, len(length_query_ids), QUERIES_PER_MASK):
+            query_ids = length_query_ids[mask_start:mask_start + QUERIES_PER_MASK]
+            query_masks = np.zeros(constants.KMER_COUNT, dtype=np.uint64)
+            for bit, query_id in enumerate(query_ids):
+                query_masks[np.asarray(query_kmer_sets[query_id], dtype=np.int64)] |= np.uint64(1 << bit)
+            masks.append((query_ids, query_masks, int(window_size)))
+
+    return masks
+
+def calculate_intersection_sizes_bitmask(positions: np.ndarray, kmers: np.ndarray, previous_positions: np.ndarray, query_masks: np.ndarray,
+                                         window_size: int) -> np.ndarray:
+    """
+    Computes the maximum windowed k-mer intersection size of up to
+    QUERIES_PER_MASK queries sharing one window size, a variant of
+    calculate_intersection_sizes_batched that finds the query
+    occurrences through membership bitmasks.
+
+    The membership masks of all reference occurrences are gathered in a
+    single pass over the occurrence stream, and occurrences of k-mers
+    outside all queries are dropped. The set bits of the remaining masks
+    are expanded into one (occurrence, query) pair each, and the windows
+    of all queries are then evaluated in one grouped sweep (see
+    max_window_hits_by_group), i.e. per query, not word-wise.
+
+    Parameters
+    ----------
+    positions : numpy.ndarray
+        Reference positions of all k-mer occurrences, ascending.
+    kmers : numpy.ndarray
+        K-mer of every occurrence.
+    previous_positions : numpy.ndarray
+        Position of the preceding occurrence of the same k-mer, or
+        NO_PREVIOUS_POSITION.
+    query_masks : numpy.ndarray
+        uint64 membership mask of every k-mer (see build_query_masks).
+    window_size : int
+        Size of the sliding window shared by all queries of the mask.
+
+    Returns
+    -------
+    numpy.ndarray
+        Maximum windowed intersection size for every bit of the mask.
+    """
+    masks = query_masks[kmers]
+    hits = np.flatnonzero(masks)
+    if len(hits) == 0:
+        return np.zeros(QUERIES_PER_MASK, dtype=np.int64)
+
+    bits = np.unpackbits(masks[hits].astype("<u8").view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    occurrences, query_bits = np.nonzero(bits)
+    hits = hits[occurrences]
+
+    return max_window_hits_by_group(query_bits, positions[hits], previous_positions[hits], window_size, QUERIES_PER_MASK)
@@ -0,0 +1,73 @@
+"""
+length_buckets.py
+
+Description
+-----------
+Module for grouping queries into length buckets.
+
+Queries whose lengths fall into the same bucket of bucket_width bases
+are matched with a shared window size, the largest query length of the
+bucket, so that kernels working on several queries at once (e.g. the
+batched_bitmask kernel) can share their sweep across the whole bucket.
+
+A larger window never contains fewer query k-mers, so the bucketed
+intersection size u of a pair is an upper bound on the exact size e.
+Conversely, the best bucketed window contains a window of the query
+length that misses at most delta = bucket window - query length k-mer
+positions, so e >= u - delta. A reference can only hold the top hit of a
+query if its upper bound reaches the largest lower bound of the query,
+and only such pairs need to be re-checked with the exact window.
+"""
+import numpy as np
+
+def bucket_window_sizes(query_sequence_lengths, bucket_width: int) -> np.ndarray:
+    """
+    Returns the shared window size of every query, the largest length
+    among the queries of its length bucket [b * bucket_width,
+    (b + 1) * bucket_width).
+
+    Raises
+    ------
+    ValueError
+        If the bucket width is not positive.
+    """
+    if bucket_width <= 0:
+        raise ValueError(f"The length bucket width must be positive, got {bucket_width}")
+
+    query_sequence_lengths = np.asarray(query_sequence_lengths, dtype=np.int64)
+    buckets = query_sequence_lengths // bucket_width
+    _, bucket_ids = np.unique(buckets, return_inverse=True)
+    bucket_windows = np.zeros(bucket_ids.max(initial=-1) + 1, dtype=np.int64)
+    np.maximum.at(bucket_windows, bucket_ids, query_sequence_lengths)
+
+    return bucket_windows[bucket_ids]
+
+def select_recheck_pairs(intersection_sizes: np.ndarray, refined: np.ndarray, window_increase: np.ndarray) -> np.ndarray:
+    """
+    Selects the pairs that may hold the top hit of their query once
+    matched with the exact window.
+
+    Parameters
+    ----------
+    intersection_sizes : numpy.ndarray
+        Query × reference matrix of bucketed intersection sizes.
+    refined : numpy.ndarray
+        Boolean query × reference matrix marking the pairs matched with
+        the kernel; other pairs are never selected.
+    window_increase : numpy.ndarray
+        Difference between the bucket window and the query length of
+        every query.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean query × reference matrix of the selected pairs. Queries
+        matched with their own length are never selected.
+    """
+    window_increase = np.asarray(window_increase, dtype=np.int64)
+    lower_bounds = np.where(refined, intersection_sizes - window_increase[:, None], 0)
+    best_lower_bounds = lower_bounds.max(axis=1, initial=0)
+
+    selected = refined & (intersection_sizes >= best_lower_bounds[:, None])
+    selected[window_increase == 0] = False
+    return selected
@@ -0,0 +1,93 @@
+"""
+memory_usage.py
+
+Description
+-----------
+Module for measuring the shared and private resident memory of
+processes.
+
+Pages that a forked worker has not written since the fork are shared
+with the parent (copy-on-write) and are counted in the resident set
+size (RSS) of every process mapping them, so that summing the RSS of a
+pool counts them once per worker. The proportional set size (PSS)
+divides every shared page among the processes mapping it, so that the
+PSS of all processes sums to their actual memory usage. Both are read
+from /proc/<pid>/smaps_rollup and are unavailable on other platforms.
+"""
+import os
+
+#fields of smaps_rollup in kB and the keys they are accumulated into
+SMAPS_FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared",
+    "Shared_Dirty": "shared",
+    "Private_Clean": "private",
+    "Private_Dirty": "private",
+}
+
+MEMORY_KEYS = ("rss", "pss", "shared", "private")
+
+def read_memory_usage(pid: int | None = None) -> dict | None:
+    """
+    Returns the resident memory of a process in bytes.
+
+    Parameters
+    ----------
+    pid : int, optional
+        Process id; the calling process if None.
+
+    Returns
+    -------
+    dict or None
+        Dictionary with the keys "rss", "pss", "shared" and "private",
+        or None if smaps_rollup is unavailable or the process has exited.
+    """
+    pid = os.getpid() if pid is None else pid
+    memory_usage = dict.fromkeys(MEMORY_KEYS, 0)
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                field, _, value = line.partition(":")
+                if field in SMAPS_FIELDS:
+                    memory_usage[SMAPS_FIELDS[field]] += int(value.split()[0]) * 1024
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    return memory_usage
+
+def summarize_memory_usage(pids) -> dict:
+    """
+    Sums the resident memory of several processes, skipping processes
+    whose memory cannot be read.
+
+    Returns
+    -------
+    dict
+        Dictionary with the summed keys of read_memory_usage and the
+        number of measured processes as "process_count".
+    """
+    summary = dict.fromkeys(MEMORY_KEYS, 0)
+    summary["process_count"] = 0
+    for pid in pids:
+        memory_usage = read_memory_usage(pid)
+        if memory_usage is None:
+            continue
+        for key in MEMORY_KEYS:
+            summary[key] += memory_usage[key]
+        summary["process_count"] += 1
+    return summary
+
+def record_memory_usage(worker_pids, runtime_info: dict):
+    """
+    Adds the resident memory of the calling process and of its pool
+    workers to runtime_info, as parent_<key>_bytes and worker_<key>_bytes.
+    Nothing is recorded if smaps_rollup is unavailable.
+    """
+    parent_memory_usage = read_memory_usage()
+    if parent_memory_usage is None:
+        return
+    worker_memory_usage = summarize_memory_usage(worker_pids)
+    for key in MEMORY_KEYS:
+        runtime_info[f"parent_{key}_bytes"] = parent_memory_usage[key]
+        runtime_info[f"worker_{key}_bytes"] = worker_memory_usage[key]
+    runtime_info["worker_process_count"] = worker_memory_usage["process_count"]
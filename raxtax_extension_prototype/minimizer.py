@@ -0,0 +1,111 @@
+"""
+minimizer.py
+
+Description
+-----------
+Module for the minimizer-sampled reference store.
+
+Instead of every k-mer position, only the (w, k) window minimizers of a
+reference are indexed: for every run of w consecutive k-mers, the k-mer
+with the smallest rank under a fixed pseudo-random order is kept
+(leftmost on ties). The sampled positions are stored like regular
+position lists (see position_encoding), so the index shrinks roughly by
+the minimizer density of 2 / (w + 1).
+
+Windowed intersection sizes are estimated from the sampled positions
+and rescaled by the sampling density of the reference, so that the
+estimate stays in units of shared k-mers and remains comparable with
+the query k-mer set size used by the prob_fast model.
+"""
+import numpy as np
+import h5py
+
+import raxtax_extension_prototype.constants as constants
+import raxtax_extension_prototype.position_encoding as position_encoding
+
+#fixed pseudo-random order of all k-mers, avoids the bias of lexicographic minimizers
+KMER_RANKS = np.random.default_rng(0).permutation(constants.KMER_COUNT).astype(np.uint64)
+
+def select_minimizer_positions(kmer_indices: np.ndarray, window: int) -> np.ndarray:
+    """
+    Selects the positions of the (w, k) window minimizers of a sequence.
+
+    Parameters
+    ----------
+    kmer_indices : numpy.ndarray
+        K-mer index at every sequence position, -1 for k-mers with
+        ambiguous bases.
+    window : int
+        Number of consecutive k-mers per minimizer window.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sorted positions of the selected k-mers.
+    """
+    length = len(kmer_indices)
+    if length == 0:
+        return np.zeros(0, dtype=np.int64)
+    window = min(window, length)
+
+    #rank in the high bits, position in the low bits: the minimum key is the leftmost minimal k-mer
+    valid = kmer_indices >= 0
+    keys = np.full(length, np.iinfo(np.uint64).max, dtype=np.uint64)
+    keys[valid] = (KMER_RANKS[kmer_indices[valid]] << np.uint64(32)) | np.flatnonzero(valid).astype(np.uint64)
+
+    #sliding window minimum in linear time from block-wise prefix and suffix minima
+    block_count = (length + window - 1) // window
+    padded = np.full(block_count * window, np.iinfo(np.uint64).max, dtype=np.uint64)
+    padded[:length] = keys
+    blocks = padded.reshape(block_count, window)
+    prefix_min = np.minimum.accumulate(blocks, axis=1).ravel()
+    suffix_min = np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+
+    window_starts = np.arange(length - window + 1)
+    window_min = np.minimum(suffix_min[window_starts], prefix_min[window_starts + window - 1])
+    window_min = window_min[window_min != np.iinfo(np.uint64).max]
+
+    return np.unique(window_min & np.uint64(0xFFFFFFFF)).astype(np.int64)
+
+def write_minimizer_index(grp: h5py.Group, kmer_indices: np.ndarray, window: int, encoding: str = "gzip"):
+    """
+    Writes the minimizer-sampled k-mer position lists of one reference
+    into an HDF5 group.
+
+    Parameters
+    ----------
+    grp : h5py.Group
+        HDF5 group of the reference sequence.
+    kmer_indices : numpy.ndarray
+        K-mer index at every reference position, -1 for k-mers with
+        ambiguous bases.
+    window : int
+        Number of consecutive k-mers per minimizer window.
+    encoding : str, optional
+        Position list encoding (see position_encoding).
+    """
+    positions = select_minimizer_positions(kmer_indices, window)
+    kmers = kmer_indices[positions]
+
+    bucket_sizes = np.bincount(kmers, minlength=constants.KMER_COUNT)
+    flat_data = positions[np.argsort(kmers, kind="stable")]
+    offsets = np.concatenate((np.array([0]), np.cumsum(bucket_sizes)))
+    position_encoding.write_positions(grp, flat_data, offsets, len(kmer_indices), encoding)
+
+    grp.attrs["store"] = "minimizer"
+    grp.attrs["minimizer_window"] = window
+    grp.attrs["minimizer_density"] = len(positions) / max(int(np.count_nonzero(kmer_indices >= 0)), 1)
+
+def estimate_intersection_size(sampled_size: int, density: float, query_set_size: int, window_size: int) -> int:
+    """
+    Rescales a windowed intersection size computed on minimizer-sampled
+    positions to an estimate of the full intersection size.
+
+    The estimate is capped at the query k-mer set size and at the number
+    of k-mers that fit into the window, so that it never exceeds values
+    the exact kernel can produce.
+    """
+    if density <= 0:
+        return 0
+    estimate = int(round(sampled_size / density))
+    return min(estimate, query_set_size, max(window_size - constants.K + 1, 0))
@@ -11,6 +11,7 @@ import operator
 from pathlib import Path
 
 import raxtax_extension_prototype.prob_fast as prob_fast
+import raxtax_extension_prototype.streaming as streaming
 
 def evaluate_confidence_scores(names, prob):
     """
@@ -68,6 +69,8 @@ def output_s_t(results, reference_names, runtime_info, result_dir: Path, total_e
         Names of the reference sequences.
     runtime_info : dict
         Runtime measurements for the individual processing steps.
+        Additional entries (e.g. index statistics) are appended to the
+        metadata unchanged.
     result_dir : pathlib.Path
         Directory where result files and metadata are written.
     total_execution_time : float
@@ -80,44 +83,115 @@ def output_s_t(results, reference_names, runtime_info, result_dir: Path, total_e
     None
         Results and metadata are written to disk.
     """
-    tp = 0
-    mc = 0
-    fn = 0
-    fp = 0
+    counts = {"tp": 0, "mc": 0, "fp": 0, "fn": 0}
 
-    average_prob_calculation_time = 0
+    result_dir.mkdir(exist_ok=True)
+    results_file = result_dir / "results.out"
+
+    with results_file.open("w") as f:
+        prob_calculation_time = write_query_results(f, results, reference_names, counts, confidence_threshold)
+    average_prob_calculation_time = prob_calculation_time / len(results)
+
+    metadata = build_metadata(counts, len(reference_names), len(results), runtime_info, total_execution_time, average_prob_calculation_time)
+    output_meta_data(result_dir, metadata)
+
+def output_s_t_stream(chunks, result_dir: Path, start_time: float, confidence_threshold=0.5):
+    """
+    Evaluates and records confidence scores and evaluation metrics for
+    results arriving in chunks (see streaming).
+
+    Each chunk is scored and written as soon as it arrives, so that only
+    one chunk is held in memory. The metadata equal those of output_s_t,
+    with the runtime information merged over all chunks (see
+    streaming.merge_runtime_info).
+
+    Parameters
+    ----------
+    chunks : iterable of tuples
+        Tuples of the form (results, reference_names, runtime_info) as
+        yielded by streaming.stream_intersection_sizes.
+    result_dir : pathlib.Path
+        Directory where result files and metadata are written.
+    start_time : float
+        time.perf_counter() value at the start of the simulation; the
+        total execution time is measured once all chunks are written.
+    confidence_threshold : float, optional
+        Minimum confidence score required for a positive classification.
+
+    Returns
+    -------
+    None
+        Results and metadata are written to disk.
+    """
+    counts = {"tp": 0, "mc": 0, "fp": 0, "fn": 0}
+    prob_calculation_time = 0
+    query_count = 0
+    reference_names = []
+    runtime_info = None
 
     result_dir.mkdir(exist_ok=True)
     results_file = result_dir / "results.out"
 
     with results_file.open("w") as f:
-        for query_name, query_set_size, intersection_sizes in results:
-            f.write(query_name + "\n")
-            t = query_set_size // 2
+        for results, reference_names, chunk_runtime_info in chunks:
+            prob_calculation_time += write_query_results(f, results, reference_names, counts, confidence_threshold)
+            query_count += len(results)
+            runtime_info = streaming.merge_runtime_info(runtime_info, chunk_runtime_info, len(results))
+
+    total_execution_time = time.perf_counter() - start_time
+    average_prob_calculation_time = prob_calculation_time / query_count
+
+    metadata = build_metadata(counts, len(reference_names), query_count, runtime_info, total_execution_time, average_prob_calculation_time)
+    output_meta_data(result_dir, metadata)
 
-            start_calculation_prob_time = time.perf_counter()
-            prob = prob_fast.calculate_confidence_scores(intersection_sizes, t, query_set_size)
-            end_calculation_prob_time = time.perf_counter()
-            calculation_prob_time = end_calculation_prob_time - start_calculation_prob_time
+def write_query_results(f, results, reference_names, counts: dict, confidence_threshold=0.5) -> float:
+    """
+    Computes the confidence scores of a list of query results, writes
+    them to an open results file and updates the classification counts
+    (tp, mc, fp, fn) in place.
 
-            average_prob_calculation_time += calculation_prob_time
+    Returns
+    -------
+    float
+        Total time spent calculating confidence scores.
+    """
+    prob_calculation_time = 0
 
-            filtered_result = evaluate_confidence_scores(reference_names, prob)
+    for query_name, query_set_size, intersection_sizes in results:
+        f.write(query_name + "\n")
+        t = query_set_size // 2
 
-            for (n, p) in filtered_result:
-                f.write(str(n) + ": " + str(p) + "\n")
+        start_calculation_prob_time = time.perf_counter()
+        prob = prob_fast.calculate_confidence_scores(intersection_sizes, t, query_set_size)
+        end_calculation_prob_time = time.perf_counter()
+        calculation_prob_time = end_calculation_prob_time - start_calculation_prob_time
 
-            if filtered_result[0][1] > confidence_threshold:
-                if filtered_result[0][0] == query_name:
-                    tp += 1
-                elif query_name in reference_names:
-                    mc += 1
-                else:
-                    fp += 1
+        prob_calculation_time += calculation_prob_time
+
+        filtered_result = evaluate_confidence_scores(reference_names, prob)
+
+        for (n, p) in filtered_result:
+            f.write(str(n) + ": " + str(p) + "\n")
+
+        if filtered_result[0][1] > confidence_threshold:
+            if filtered_result[0][0] == query_name:
+                counts["tp"] += 1
+            elif query_name in reference_names:
+                counts["mc"] += 1
             else:
-                if query_name in reference_names:
-                    fn += 1
-    average_prob_calculation_time /= len(results)
+                counts["fp"] += 1
+        else:
+            if query_name in reference_names:
+                counts["fn"] += 1
+
+    return prob_calculation_time
+
+def build_metadata(counts: dict, reference_count: int, query_count: int, runtime_info: dict, total_execution_time, average_prob_calculation_time) -> dict:
+    """
+    Combines classification counts, derived evaluation metrics and
+    runtime information into the metadata dictionary.
+    """
+    tp, mc, fp, fn = counts["tp"], counts["mc"], counts["fp"], counts["fn"]
 
     if tp == 0:
         recall = 0
@@ -129,8 +203,8 @@ def output_s_t(results, reference_names, runtime_info, result_dir: Path, total_e
         f1_score = 2 * precision * recall / (recall + precision)
 
     metadata = {
-        "reference_count": len(reference_names),
-        "query_count": len(results),
+        "reference_count": reference_count,
+        "query_count": query_count,
         "total_execution_time": total_execution_time,
         "reference_parse_time": runtime_info["reference_parse_time"],
         "query_parse_time": runtime_info["query_parse_time"],
@@ -147,7 +221,12 @@ def output_s_t(results, reference_names, runtime_info, result_dir: Path, total_e
         "f1_score": round(f1_score, 2),
     }
 
-    output_meta_data(result_dir, metadata)
+    #record additional runtime information, e.g. index size and decode time
+    for key, value in runtime_info.items():
+        if key not in metadata:
+            metadata[key] = value
+
+    return metadata
 
 def output_meta_data(result_dir: Path, metadata):
     """
@@ -16,16 +16,362 @@ import h5py
 import time
 import numpy as np
 from pathlib import Path
-from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 import raxtax_extension_prototype.constants as constants
 import raxtax_extension_prototype.utils as utils
+import raxtax_extension_prototype.position_encoding as position_encoding
+import raxtax_extension_prototype.packed_sequence as packed_sequence
+import raxtax_extension_prototype.kernels as kernels
+import raxtax_extension_prototype.global_index as global_index
+import raxtax_extension_prototype.prefilter as prefilter
+import raxtax_extension_prototype.minimizer as minimizer
+import raxtax_extension_prototype.sketch as sketch
+import raxtax_extension_prototype.block_bitsets as block_bitsets
+import raxtax_extension_prototype.stop_kmers as stop_kmers
+import raxtax_extension_prototype.query_sampling as query_sampling
+import raxtax_extension_prototype.clades as clades
+import raxtax_extension_prototype.segments as segments
+import raxtax_extension_prototype.length_buckets as length_buckets
+import raxtax_extension_prototype.dedup as dedup
+import raxtax_extension_prototype.result_matrix as result_matrix
+import raxtax_extension_prototype.checkpoint as checkpoint
+import raxtax_extension_prototype.memory_usage as memory_usage
+import raxtax_extension_prototype.placement as placement
+import raxtax_extension_prototype.autotune as autotune
+
+INDEX_STORES = ("positions", "packed_sequence", "minimizer")
+KERNELS = ("exact", "batched", "strided", "batched_bitmask")
+
+def get_reference_ids(f: h5py.File) -> list[str]:
+    """
+    Returns the identifiers of all reference groups within a lookup
+    table, skipping global datasets such as kmer_occurrence_count.
+    """
+    return [key for key in f.keys() if key.isdigit()]
+
+def get_reference_names(f: h5py.File, reference_ids: list[str]) -> list[str]:
+    """
+    Returns the lineage names of the given references. The
+    reference_names dataset is used if present, so that the reference
+    groups need not be opened.
+    """
+    if "reference_names" in f:
+        names = f["reference_names"].asstr()[:]
+        return [names[int(idx)] for idx in reference_ids]
+    return [f[idx].attrs["name"] for idx in reference_ids]
+
+def get_index_info(result_path: Path) -> dict:
+    """
+    Reads the index size and decode time recorded by the builder.
+    """
+    with h5py.File(result_path, "r") as f:
+        stop_kmer_percentile, stop_kmer_cap = stop_kmers.read_stop_criteria(f)
+        return {
+            "index_store": f.attrs.get("store", "positions"),
+            "index_encoding": f.attrs.get("encoding", "gzip"),
+            "index_size_bytes": int(f.attrs.get("index_size_bytes", result_path.stat().st_size)),
+            "index_decode_time": float(f.attrs.get("index_decode_time", -1)),
+            "index_minimizer_window": int(f.attrs.get("minimizer_window", -1)),
+            "index_block_size": int(f.attrs.get("block_size", -1)),
+            "index_stop_kmer_count": len(stop_kmers.read_stop_kmers(f)),
+            "index_stop_kmer_percentile": stop_kmer_percentile,
+            "index_stop_kmer_cap": stop_kmer_cap,
+            "index_segment_length": int(f.attrs.get("segment_length", -1)),
+            "index_segment_overlap": int(f.attrs.get("segment_overlap", -1)),
+            "index_duplicate_reference_count": int(f.attrs.get("duplicate_reference_count", 0)),
+            "index_hash": str(f.attrs.get("index_hash", "")),
+        }
+
+def load_reference(grp: h5py.Group, kernel: str = "exact") -> dict:
+    """
+    Loads the lookup data of one reference sequence from its HDF5 group.
+
+    Parameters
+    ----------
+    grp : h5py.Group
+        HDF5 group of the reference sequence.
+    kernel : str, optional
+        "exact" loads the lookup data of the index store, "strided" loads
+        the block bitsets (see block_bitsets) instead and
+        "batched_bitmask" the k-mer occurrences in position order (see
+        kernels.build_occurrence_stream). "batched" loads the k-mer
+        position lists, converting the packed_sequence store, and flags
+        them for kernels.calculate_intersection_sizes_batched.
+
+    Returns
+    -------
+    dict
+        Dictionary containing the store type and either the decoded
+        "flat_data" and "offsets" arrays (positions and minimizer store,
+        the latter with its sampling "density"), the per-position
+        "kmer_indices" array (packed_sequence store) or the
+        "block_bitsets" with their "block_size" (strided kernel) or the
+        "positions", "kmers" and "previous_positions" of the occurrence
+        stream (batched_bitmask kernel). For
+        references split into segments (see segments), the store is
+        "segments" and "segments" holds the lookup data of every segment.
+    """
+    if "segments" in grp:
+        return {"store": "segments", "segments": [load_reference(grp["segments"][segment_id], kernel) for segment_id in grp["segments"]]}
+
+    if kernel == "strided":
+        bitsets, block_size = block_bitsets.read_block_bitsets(grp)
+        return {"store": "block_bitsets", "block_bitsets": bitsets, "block_size": block_size}
+
+    store = grp.attrs.get("store", "positions")
+
+    if kernel == "batched_bitmask":
+        if store == "minimizer":
+            raise ValueError("The batched_bitmask kernel requires all k-mer positions and cannot be used with a minimizer index")
+        positions, kmers, previous_positions = kernels.build_occurrence_stream(*get_reference_occurrences(load_reference(grp)))
+        return {"store": "occurrence_stream", "positions": positions, "kmers": kmers, "previous_positions": previous_positions}
+
+    if store == "packed_sequence" and kernel == "batched":
+        kmers, positions = get_reference_occurrences(load_reference(grp))
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(kmers, minlength=constants.KMER_COUNT))))
+        return {"store": "positions", "flat_data": positions, "offsets": offsets, "batched": True}
+
+    if store == "packed_sequence":
+        #the packed sequence keeps the stop k-mers masked at build time
+        kmer_indices = stop_kmers.mask_kmer_indices(packed_sequence.read_kmer_indices(grp), stop_kmers.read_stop_kmers(grp.file))
+        return {"store": store, "kmer_indices": kmer_indices}
+
+    flat_data, offsets = position_encoding.read_positions(grp)
+    if store == "minimizer":
+        return {"store": store, "flat_data": flat_data, "offsets": offsets, "density": float(grp.attrs["minimizer_density"]), "batched": kernel == "batched"}
+    return {"store": store, "flat_data": flat_data, "offsets": offsets, "batched": kernel == "batched"}
+
+def calculate_reference_intersection_sizes(reference_data: dict, query_kmer_sets, query_sequence_lengths) -> list[int]:
+    """
+    Computes the k-mer intersection sizes between one reference sequence
+    and all query sequences, using the kernel matching the store type of
+    the reference lookup data. For the minimizer store, the returned
+    sizes are estimates (see minimizer.estimate_intersection_size), for
+    block bitsets upper bounds (see
+    kernels.calculate_intersection_size_strided). For the occurrence
+    stream, the occurrences of up to 64 queries are gathered through one
+    bitmask (see kernels.calculate_intersection_sizes_bitmask). Position
+    lists flagged as batched are matched with all queries at once (see
+    kernels.calculate_intersection_sizes_batched).
+
+    Parameters
+    ----------
+    reference_data : dict
+        Lookup data as returned by load_reference.
+    query_kmer_sets : list of numpy.ndarray
+        List of k-mer sets derived from the query sequences.
+    query_sequence_lengths : list of int
+        Lengths of the query sequences, used to define sliding window
+        sizes.
+
+    Returns
+    -------
+    list of int
+        K-mer intersection size between the reference and each query.
+    """
+    intersection_sizes = []
+
+    if reference_data["store"] == "packed_sequence":
+        query_mask = np.zeros(constants.KMER_COUNT, dtype=bool)
+        for query_id, kmer_set in enumerate(query_kmer_sets):
+            query_mask[kmer_set] = True
+            size = kernels.calculate_intersection_size_mask(reference_data["kmer_indices"], query_mask, query_sequence_lengths[query_id])
+            query_mask[kmer_set] = False
+            intersection_sizes.append(size)
+    elif reference_data["store"] == "segments":
+        #the windowed intersection size with the whole reference is the maximum over its segments
+        intersection_sizes = np.zeros(len(query_kmer_sets), dtype=np.int64)
+        for segment_data in reference_data["segments"]:
+            intersection_sizes = np.maximum(intersection_sizes, calculate_reference_intersection_sizes(segment_data, query_kmer_sets, query_sequence_lengths))
+        intersection_sizes = intersection_sizes.tolist()
+    elif reference_data["store"] == "occurrence_stream":
+        intersection_sizes = np.zeros(len(query_kmer_sets), dtype=np.int64)
+        for query_ids, query_masks, window_size in kernels.build_query_masks(query_kmer_sets, query_sequence_lengths):
+            sizes = kernels.calculate_intersection_sizes_bitmask(reference_data["positions"], reference_data["kmers"],
+                                                                 reference_data["previous_positions"], query_masks, window_size)
+            intersection_sizes[query_ids] = sizes[:len(query_ids)]
+        intersection_sizes = intersection_sizes.tolist()
+    elif reference_data["store"] == "block_bitsets":
+        for query_id, kmer_set in enumerate(query_kmer_sets):
+            size = kernels.calculate_intersection_size_strided(reference_data["block_bitsets"], reference_data["block_size"], kmer_set, query_sequence_lengths[query_id])
+            intersection_sizes.append(size)
+    elif reference_data["store"] == "minimizer" and reference_data.get("batched"):
+        sampled_sizes = kernels.calculate_intersection_sizes_batched(reference_data["flat_data"], reference_data["offsets"], query_kmer_sets, query_sequence_lengths)
+        for query_id, kmer_set in enumerate(query_kmer_sets):
+            size = minimizer.estimate_intersection_size(int(sampled_sizes[query_id]), reference_data["density"], len(kmer_set), query_sequence_lengths[query_id])
+            intersection_sizes.append(size)
+    elif reference_data["store"] == "minimizer":
+        for query_id, kmer_set in enumerate(query_kmer_sets):
+            sampled_size = kernels.calculate_intersection_size_positions(reference_data["flat_data"], reference_data["offsets"], kmer_set, query_sequence_lengths[query_id])
+            size = minimizer.estimate_intersection_size(sampled_size, reference_data["density"], len(kmer_set), query_sequence_lengths[query_id])
+            intersection_sizes.append(size)
+    elif reference_data.get("batched"):
+        intersection_sizes = kernels.calculate_intersection_sizes_batched(reference_data["flat_data"], reference_data["offsets"], query_kmer_sets,
+                                                                          query_sequence_lengths).tolist()
+    else:
+        for query_id, kmer_set in enumerate(query_kmer_sets):
+            size = calculate_intersection_size(reference_data["flat_data"], reference_data["offsets"], kmer_set, query_sequence_lengths[query_id])
+            intersection_sizes.append(size)
+
+    return intersection_sizes
 
-def parse_reference_fasta(reference_path: Path, result_path: Path, redo: bool):
+def get_reference_occurrences(reference_data: dict):
+    """
+    Returns the k-mer occurrences of one reference as two arrays
+    (kmers, positions), grouped by k-mer with ascending positions.
+    """
+    if reference_data["store"] == "packed_sequence":
+        kmer_indices = reference_data["kmer_indices"]
+        positions = np.flatnonzero(kmer_indices >= 0)
+        kmers = kmer_indices[positions]
+        order = np.argsort(kmers, kind="stable")
+        return kmers[order], positions[order]
+
+    offsets = reference_data["offsets"].astype(np.int64)
+    kmers = np.repeat(np.arange(constants.KMER_COUNT), np.diff(offsets))
+    return kmers, reference_data["flat_data"].astype(np.int64)
+
+def add_global_index(result_path: Path, redo: bool = False) -> float:
+    """
+    Builds the global inverted index (see global_index) from the
+    per-reference lookup data and stores it in the lookup table.
+
+    Parameters
+    ----------
+    result_path : pathlib.Path
+        Path to the HDF5 lookup table.
+    redo : bool, optional
+        If False and the lookup table already contains a global index,
+        building is skipped.
+
+    Returns
+    -------
+    float
+        Time in seconds required to build the global index, -1 if
+        building was skipped.
+    """
+    with h5py.File(result_path, "r") as f:
+        if "global_index" in f and not redo:
+            return -1
+        if f.attrs.get("store", "positions") == "minimizer":
+            raise ValueError("The global index requires all k-mer positions and cannot be built from a minimizer index")
+        if "segment_length" in f.attrs:
+            raise ValueError("The global index requires reference-wide k-mer positions and cannot be built from a segmented lookup table")
+
+    print("Building global index...")
+    build_start_time = time.perf_counter()
+
+    kmer_list = []
+    position_list = []
+    reference_names = []
+
+    with h5py.File(result_path, "r") as f:
+        for idx in get_reference_ids(f):
+            grp = f[idx]
+            reference_names.append(grp.attrs["name"])
+            kmers, positions = get_reference_occurrences(load_reference(grp))
+            kmer_list.append(kmers)
+            position_list.append(positions)
+
+    index = global_index.build_global_index(kmer_list, position_list, reference_names)
+
+    with h5py.File(result_path, "a") as f:
+        global_index.write_global_index(f, index)
+
+    build_end_time = time.perf_counter()
+    build_time = build_end_time - build_start_time
+    print(f"Building global index took {build_time} seconds.")
+
+    return build_time
+
+def load_presence_matrix(result_path: Path):
+    """
+    Loads the reference × k-mer presence matrix of a lookup table.
+
+    Lookup tables written without a kmer_presence group are handled by
+    deriving the presence matrix from the per-reference lookup data.
+    """
+    with h5py.File(result_path, "r") as f:
+        if "kmer_presence" in f:
+            return prefilter.build_presence_matrix(f["kmer_presence"]["indptr"][:], f["kmer_presence"]["indices"][:])
+
+        presence_list = []
+        for idx in get_reference_ids(f):
+            kmers, _ = get_reference_occurrences(load_reference(f[idx]))
+            presence_list.append(np.unique(kmers))
+
+    indptr = np.concatenate(([0], np.cumsum([len(presence) for presence in presence_list])))
+    indices = np.concatenate(presence_list) if len(presence_list) > 0 else np.zeros(0, dtype=np.int64)
+    return prefilter.build_presence_matrix(indptr, indices)
+
+def load_clade_index(result_path: Path) -> dict:
+    """
+    Loads the clade index of a lookup table (see clades).
+
+    Lookup tables written without a clades group are handled by deriving
+    the clade index from the reference names and the presence matrix.
+    """
+    with h5py.File(result_path, "r") as f:
+        clade_index = clades.read_clade_index(f)
+        if clade_index is not None:
+            return clade_index
+        reference_names = get_reference_names(f, get_reference_ids(f))
+
+    return clades.build_clade_index(reference_names, load_presence_matrix(result_path))
+
+def measure_index_decode_time(result_path: Path) -> float:
+    """
+    Measures the time required to load and decode the lookup data
+    of all reference sequences in a lookup table.
+    """
+    with h5py.File(result_path, "r") as f:
+        decode_start_time = time.perf_counter()
+        for idx in get_reference_ids(f):
+            load_reference(f[idx])
+        decode_end_time = time.perf_counter()
+
+    return decode_end_time - decode_start_time
+
+def write_reference_lookup(grp: h5py.Group, codes: np.ndarray, kmer_indices: np.ndarray, index_store: str, index_encoding: str,
+                           minimizer_window: int, block_size: int | None):
+    """
+    Writes the lookup data of one reference sequence, or of one segment
+    of it, into an HDF5 group (see parse_reference_fasta).
+
+    kmer_indices holds the k-mer index of every position of the
+    sequence, with masked and ambiguous k-mers set to -1.
+    """
+    if index_store == "packed_sequence":
+        packed_sequence.write_packed_sequence(grp, codes)
+    elif index_store == "minimizer":
+        minimizer.write_minimizer_index(grp, kmer_indices, minimizer_window, index_encoding)
+    else:
+        #convert per-k-mer position lists into an offset-based flattened representation
+        valid_positions = np.flatnonzero(kmer_indices >= 0)
+        valid_kmers = kmer_indices[valid_positions]
+        bucket_sizes = np.bincount(valid_kmers, minlength=constants.KMER_COUNT)
+        flat_data = valid_positions[np.argsort(valid_kmers, kind="stable")]
+        offsets = np.concatenate((np.array([0]), np.cumsum(bucket_sizes)))
+        position_encoding.write_positions(grp, flat_data, offsets, len(codes), index_encoding)
+
+    if block_size is not None:
+        block_bitsets.write_block_bitsets(grp, block_bitsets.build_block_bitsets(kmer_indices, block_size), block_size)
+
+def parse_reference_fasta(reference_path: Path, result_path: Path, redo: bool, index_encoding: str = "gzip", index_store: str = "positions",
+                          build_global_index: bool = False, minimizer_window: int = 10, sketch_size: int = 256, block_size: int | None = None,
+                          stop_kmer_percentile: float | None = None, stop_kmer_cap: int | None = None, segment_length: int | None = None,
+                          segment_overlap: int | None = None, deduplicate_references: bool = False):
     """
     Parses reference sequences from a FASTA file and
     constructs a k-mer lookup table.
 
+    After construction, the size of the lookup table and the time
+    required to decode all position lists are measured and stored as
+    attributes of the HDF5 file.
+
     Parameters
     ----------
     reference_path : pathlib.Path
@@ -34,14 +380,67 @@ def parse_reference_fasta(reference_path: Path, result_path: Path, redo: bool):
         Path where the generated lookup table is stored in HDF5 format.
     redo : bool
         If False and the result file already exists, parsing is skipped.
+    index_encoding : str, optional
+        Encoding of the k-mer position lists, one of "gzip", "uint16"
+        or "delta_packed" (see position_encoding).
+    index_store : str, optional
+        "positions" stores k-mer position lists, "packed_sequence"
+        stores 2-bit packed sequences from which k-mers are derived at
+        match time (see packed_sequence). index_encoding only applies to
+        the positions and minimizer store. "minimizer" stores only the
+        positions of (w, k) window minimizers (see minimizer).
+    build_global_index : bool, optional
+        If True, the global cross-reference inverted index is built as
+        well (see add_global_index). If the lookup table already exists
+        without one, it is added without rebuilding the table.
+    minimizer_window : int, optional
+        Number of consecutive k-mers per minimizer window (w), only used
+        by the minimizer store.
+    sketch_size : int, optional
+        Number of hashes in the bottom-s MinHash sketch stored for each
+        reference (see sketch).
+    block_size : int, optional
+        If given, per-block k-mer presence bitsets with blocks of this
+        many positions are stored for the strided kernel (see
+        block_bitsets).
+    stop_kmer_percentile : float, optional
+        If given, k-mers occurring more often than this percentile of the
+        occurrence counts of all occurring k-mers are masked (see
+        stop_kmers). Masked k-mers are recorded in the lookup table and
+        removed from the stored lookup data, or, for the packed_sequence
+        store, from the k-mer indices derived when loading it.
+    stop_kmer_cap : int, optional
+        If given, k-mers occurring more often than this cap are masked.
+    segment_length : int, optional
+        If given, references longer than this many bases are stored as
+        overlapping segments that are matched independently (see
+        segments).
+    segment_overlap : int, optional
+        Number of bases shared by consecutive segments. Must be at least
+        the length of the longest query; required with segment_length.
+    deduplicate_references : bool, optional
+        If True, identical reference sequences are stored once, as one
+        reference group listing the lineages of all its members (see
+        dedup). Matching results are expanded to all references before
+        scoring.
 
     Returns
     -------
-    None
-        The function writes the lookup tables to disk.
+    dict
+        Dictionary containing the index store and encoding, the index
+        size in bytes and the index decode time in seconds.
     """
     if result_path.exists() and not redo:
-        return
+        if build_global_index:
+            add_global_index(result_path)
+        return get_index_info(result_path)
+
+    if index_encoding not in position_encoding.ENCODINGS:
+        raise ValueError(f"Unknown index encoding '{index_encoding}', expected one of {position_encoding.ENCODINGS}")
+    if index_store not in INDEX_STORES:
+        raise ValueError(f"Unknown index store '{index_store}', expected one of {INDEX_STORES}")
+    if segment_length is not None and segment_overlap is None:
+        raise ValueError("segment_length requires a segment_overlap of at least the longest query length")
 
     print("Parsing reference sequences...")
 
@@ -59,34 +458,113 @@ def parse_reference_fasta(reference_path: Path, result_path: Path, redo: bool):
 
     print(f"{len(lineages)} lineages found.")
 
-    lin_seq_pair = zip(lineages, sequences)
+    #one entry per distinct sequence, weighted by its number of duplicates in the occurrence counts
+    if deduplicate_references:
+        representatives, reference_groups = dedup.group_duplicates(sequences)
+        print(f"{len(lineages) - len(representatives)} duplicate reference sequences collapsed.")
+    else:
+        representatives, reference_groups = list(range(len(sequences))), np.arange(len(sequences))
+    group_sizes = np.bincount(reference_groups, minlength=len(representatives))
+    group_lineages = [lineages[reference_id] for reference_id in representatives]
+
+    lin_seq_pair = zip(group_lineages, [sequences[reference_id] for reference_id in representatives])
+
+    #stop k-mers are selected from the occurrence counts of all references
+    stop_kmer_set = np.zeros(0, dtype=np.int64)
+    if stop_kmer_percentile is not None or stop_kmer_cap is not None:
+        full_occurrence_count = np.zeros(constants.KMER_COUNT, dtype=np.int64)
+        for sequence in sequences:
+            kmer_indices = utils.sequence_to_kmer_indices(sequence)
+            full_occurrence_count += np.bincount(kmer_indices[kmer_indices >= 0], minlength=constants.KMER_COUNT)
+        stop_kmer_set = stop_kmers.select_stop_kmers(full_occurrence_count, stop_kmer_percentile, stop_kmer_cap)
+        print(f"{len(stop_kmer_set)} stop k-mers masked.")
+    stop_mask = np.zeros(constants.KMER_COUNT, dtype=bool)
+    stop_mask[stop_kmer_set] = True
 
     with h5py.File(result_path, "w", track_order=True) as f:
+        f.attrs["store"] = index_store
+        f.attrs["encoding"] = index_encoding
+        if index_store == "minimizer":
+            f.attrs["minimizer_window"] = minimizer_window
+        if block_size is not None:
+            f.attrs["block_size"] = block_size
+        if segment_length is not None:
+            f.attrs["segment_length"] = segment_length
+            f.attrs["segment_overlap"] = segment_overlap
+        f.attrs["duplicate_reference_count"] = len(lineages) - len(representatives)
+        f.attrs["index_hash"] = checkpoint.hash_reference_index(reference_path, {
+            "index_encoding": index_encoding, "index_store": index_store, "minimizer_window": minimizer_window, "sketch_size": sketch_size,
+            "block_size": block_size, "stop_kmer_percentile": stop_kmer_percentile, "stop_kmer_cap": stop_kmer_cap,
+            "segment_length": segment_length, "segment_overlap": segment_overlap, "deduplicate_references": deduplicate_references,
+        })
 
         kmer_occurrence_count = np.zeros(constants.KMER_COUNT, dtype=np.uint32)
+        presence_list = []
+        sketches = np.zeros((len(representatives), sketch_size), dtype=np.uint64)
 
         for idx, (lineage, sequence) in enumerate(lin_seq_pair):
 
-            kmer_map = [[] for _ in range(constants.KMER_COUNT)]
+            codes = utils.sequence_to_codes(sequence)
+            kmer_indices = utils.codes_to_kmer_indices(codes)
+
+            bucket_sizes = np.bincount(kmer_indices[kmer_indices >= 0], minlength=constants.KMER_COUNT)
+            kmer_occurrence_count += bucket_sizes.astype(np.uint32) * np.uint32(group_sizes[idx])
 
-            for i in range(len(sequence) - constants.K + 1):
-                kmer = utils.kmer_to_index(sequence[i:i + constants.K])
-                kmer_map[kmer].append(i)
-                kmer_occurrence_count[kmer] += 1
+            if len(stop_kmer_set) > 0:
+                kmer_indices = np.where(stop_mask[np.maximum(kmer_indices, 0)], -1, kmer_indices)
+                bucket_sizes = np.bincount(kmer_indices[kmer_indices >= 0], minlength=constants.KMER_COUNT)
 
-            #convert per-k-mer position lists into an offset-based flattened representation
-            flat_data = np.concatenate(kmer_map)
-            bucket_sizes = np.array([len(b) for b in kmer_map], dtype=np.uint32)
-            offsets = np.concatenate((np.array([0]), np.cumsum(bucket_sizes)))
+            presence_list.append(np.flatnonzero(bucket_sizes))
+            sketches[idx] = sketch.build_sketch(presence_list[-1], sketch_size)
 
             grp = f.create_group(str(idx))
             grp.attrs["name"] = lineage
-            grp.create_dataset("flat_data", data=flat_data, dtype=np.uint32, compression="gzip")
-            grp.create_dataset("offsets", data=offsets, dtype=np.uint32, compression="gzip")
+            if deduplicate_references:
+                grp.attrs["names"] = [lineages[reference_id] for reference_id in np.flatnonzero(reference_groups == idx)]
+
+            bounds = [(0, len(codes))] if segment_length is None else segments.segment_bounds(len(codes), segment_length, segment_overlap)
+            if len(bounds) == 1:
+                write_reference_lookup(grp, codes, kmer_indices, index_store, index_encoding, minimizer_window, block_size)
+            else:
+                segments_grp = grp.create_group("segments", track_order=True)
+                for segment_id, (start, end) in enumerate(bounds):
+                    segment_grp = segments_grp.create_group(str(segment_id))
+                    segment_grp.attrs["start"] = start
+                    write_reference_lookup(segment_grp, codes[start:end], kmer_indices[start:max(end - constants.K + 1, start)], index_store,
+                                           index_encoding, minimizer_window, block_size)
 
         f.create_dataset("kmer_occurrence_count", data=kmer_occurrence_count, dtype=np.uint32, compression="gzip")
 
-def parse_query_fasta(query_path: Path):
+        #distinct k-mers per reference in CSR form, used by the candidate prefilter
+        presence_indptr = np.concatenate(([0], np.cumsum([len(presence) for presence in presence_list])))
+        presence_indices = np.concatenate(presence_list) if len(presence_list) > 0 else np.zeros(0, dtype=np.int64)
+        presence_grp = f.create_group("kmer_presence")
+        presence_grp.create_dataset("indptr", data=presence_indptr, dtype=np.uint64)
+        presence_grp.create_dataset("indices", data=presence_indices, dtype=np.uint16, compression="gzip")
+        clades.write_clade_index(f, clades.build_clade_index(group_lineages, prefilter.build_presence_matrix(presence_indptr, presence_indices)))
+
+        sketch.write_sketches(f, sketches, sketch_size)
+        if stop_kmer_percentile is not None or stop_kmer_cap is not None:
+            stop_kmers.write_stop_kmers(f, stop_kmer_set, stop_kmer_percentile, stop_kmer_cap)
+        f.create_dataset("reference_names", data=group_lineages, dtype=h5py.string_dtype())
+        if deduplicate_references:
+            dedup.write_reference_groups(f, lineages, reference_groups)
+
+    if build_global_index:
+        add_global_index(result_path, redo=True)
+
+    index_decode_time = measure_index_decode_time(result_path)
+    index_size_bytes = result_path.stat().st_size
+
+    with h5py.File(result_path, "a") as f:
+        f.attrs["index_size_bytes"] = index_size_bytes
+        f.attrs["index_decode_time"] = index_decode_time
+
+    print(f"Index store: {index_store}, index encoding: {index_encoding}, index size: {index_size_bytes} bytes, decoding all references took {index_decode_time} seconds.")
+
+    return get_index_info(result_path)
+
+def parse_query_fasta(query_path: Path, deduplicate: bool = False):
     """
     Parses query sequences from a FASTA file and converts each query
     sequence into its k-mer set.
@@ -95,6 +573,10 @@ def parse_query_fasta(query_path: Path):
     ----------
     query_path : pathlib.Path
         Path to the query FASTA file.
+    deduplicate : bool, optional
+        If True, the k-mer set of identical query sequences is computed
+        only once (see dedup). The per-query lists then hold one entry
+        per distinct sequence.
 
     Returns
     -------
@@ -103,15 +585,43 @@ def parse_query_fasta(query_path: Path):
         - "query_names": list of query sequence identifiers
         - "kmer_sets": list of k-mer sets for each query sequence
         - "sequence_lengths": list of query sequence lengths
+        With deduplicate, additionally:
+        - "all_query_names": identifiers of all query sequences
+        - "query_groups": index of the distinct sequence of every query
+    """
+    return parse_query_records(SeqIO.parse(query_path, "fasta"), deduplicate)
+
+def parse_query_records(records, deduplicate: bool = False):
+    """
+    Converts query records into k-mer sets. The records are consumed
+    lazily, so that any iterable of SeqRecord objects, e.g. one chunk of
+    a query file, can be parsed.
+
+    Returns
+    -------
+    dict
+        Dictionary as returned by parse_query_fasta.
     """
     query_names = []
     kmer_sets = []
     sequence_lengths = []
+    all_query_names = []
+    query_groups = []
+    group_ids = {}
 
-    for record in SeqIO.parse(query_path, "fasta"):
-        query_names.append(record.name)
+    for record in records:
         seq = str(record.seq).upper()
 
+        if deduplicate:
+            digest = dedup.sequence_digest(seq)
+            all_query_names.append(record.name)
+            if digest in group_ids:
+                query_groups.append(group_ids[digest])
+                continue
+            group_ids[digest] = len(query_names)
+            query_groups.append(group_ids[digest])
+
+        query_names.append(record.name)
         kmer_sets.append(utils.sequence_to_kmer_set(seq))
         sequence_lengths.append(len(seq))
 
@@ -120,6 +630,9 @@ def parse_query_fasta(query_path: Path):
         "kmer_sets": kmer_sets,
         "sequence_lengths": sequence_lengths,
     }
+    if deduplicate:
+        data["all_query_names"] = all_query_names
+        data["query_groups"] = query_groups
 
     return data
 
@@ -164,10 +677,89 @@ def calculate_intersection_size(flat_data: np.ndarray, offsets: np.ndarray, kmer
 
     return max_intersection_size
 
-def get_intersection_sizes(reference_path: Path, query_path: Path, orient_query: bool = False, redo: bool = False):
+def apply_stop_kmers(result_path: Path, query_data: dict, stop_kmer_percentile: float | None = None, stop_kmer_cap: int | None = None) -> dict:
     """
-    Computes k-mer intersection sizes sequentially between all query
-    sequences and reference sequences.
+    Removes stop k-mers (see stop_kmers) from the query k-mer sets in
+    place, so that match counts and query set sizes passed to the
+    probability model refer to the same k-mers.
+
+    The stop k-mers recorded in the lookup table are always removed.
+    The optional query-time criteria select additional stop k-mers from
+    the global k-mer occurrence counts.
+
+    Returns
+    -------
+    dict
+        Masking statistics for runtime_info, empty if nothing was masked.
+        stop_kmer_count counts all removed stop k-mers, while
+        stop_kmer_percentile and stop_kmer_cap are the query-time
+        criteria; the build-time criteria are reported as
+        index_stop_kmer_percentile and index_stop_kmer_cap.
+    """
+    with h5py.File(result_path, "r") as f:
+        stop_kmer_set = stop_kmers.read_stop_kmers(f)
+        index_stop_kmer_percentile, index_stop_kmer_cap = stop_kmers.read_stop_criteria(f)
+        kmer_occurrence_count = f["kmer_occurrence_count"][:].astype(np.int64)
+
+    if stop_kmer_percentile is not None or stop_kmer_cap is not None:
+        stop_kmer_set = np.union1d(stop_kmer_set, stop_kmers.select_stop_kmers(kmer_occurrence_count, stop_kmer_percentile, stop_kmer_cap))
+
+    if len(stop_kmer_set) == 0:
+        return {}
+
+    query_kmer_count = sum(len(kmer_set) for kmer_set in query_data["kmer_sets"])
+    query_data["kmer_sets"] = stop_kmers.mask_kmer_sets(query_data["kmer_sets"], stop_kmer_set)
+    masked_query_kmer_count = query_kmer_count - sum(len(kmer_set) for kmer_set in query_data["kmer_sets"])
+
+    masked_query_kmer_fraction = masked_query_kmer_count / max(query_kmer_count, 1)
+    masked_occurrence_fraction = kmer_occurrence_count[stop_kmer_set].sum() / max(kmer_occurrence_count.sum(), 1)
+    print(f"Masking {len(stop_kmer_set)} stop k-mers removed {masked_query_kmer_fraction} of all query k-mers and {masked_occurrence_fraction} of all reference k-mer occurrences.")
+
+    return {
+        "stop_kmer_count": len(stop_kmer_set),
+        "stop_kmer_percentile": -1 if stop_kmer_percentile is None else stop_kmer_percentile,
+        "stop_kmer_cap": -1 if stop_kmer_cap is None else stop_kmer_cap,
+        "index_stop_kmer_percentile": index_stop_kmer_percentile,
+        "index_stop_kmer_cap": index_stop_kmer_cap,
+        "masked_query_kmer_fraction": masked_query_kmer_fraction,
+        "masked_occurrence_fraction": float(masked_occurrence_fraction),
+    }
+
+def apply_query_sampling(query_data: dict, query_sample_size: int | None = None, query_sample_fraction: float | None = None) -> dict:
+    """
+    Replaces the query k-mer sets in place by their deterministic
+    hash-based samples (see query_sampling), so that match counts and
+    query set sizes passed to the probability model refer to the sample.
+
+    Returns
+    -------
+    dict
+        Sampling statistics for runtime_info, empty if sampling is
+        disabled.
+    """
+    if query_sample_size is None and query_sample_fraction is None:
+        return {}
+
+    query_kmer_count = sum(len(kmer_set) for kmer_set in query_data["kmer_sets"])
+    query_data["kmer_sets"] = [
+        query_sampling.subsample_kmer_set(kmer_set, query_sampling.get_sample_size(len(kmer_set), query_sample_size, query_sample_fraction))
+        for kmer_set in query_data["kmer_sets"]
+    ]
+    sampled_query_kmer_fraction = sum(len(kmer_set) for kmer_set in query_data["kmer_sets"]) / max(query_kmer_count, 1)
+    print(f"Query k-mer subsampling kept {sampled_query_kmer_fraction} of all query k-mers.")
+
+    return {
+        "query_sample_size": -1 if query_sample_size is None else query_sample_size,
+        "query_sample_fraction": -1 if query_sample_fraction is None else query_sample_fraction,
+        "sampled_query_kmer_fraction": sampled_query_kmer_fraction,
+    }
+
+def prepare_matching(reference_path: Path, query_path: Path, orient_query: bool = False, redo: bool = False, index_options: dict | None = None,
+                     stop_kmer_percentile: float | None = None, stop_kmer_cap: int | None = None, query_sample_size: int | None = None,
+                     query_sample_fraction: float | None = None, deduplicate_queries: bool = False, query_records=None):
+    """
+    Builds or reuses the reference lookup table, optionally orients the
+    query sequences and parses them into k-mer sets.
 
     Parameters
     ----------
@@ -179,31 +771,45 @@ def get_intersection_sizes(reference_path: Path, query_path: Path, orient_query:
         If True, query sequences are oriented prior to matching.
     redo : bool, optional
         If True, existing reference lookup data are recomputed.
+    index_options : dict, optional
+        Keyword arguments forwarded to parse_reference_fasta.
+    stop_kmer_percentile : float, optional
+        Query-time stop k-mer percentile (see apply_stop_kmers).
+    stop_kmer_cap : int, optional
+        Query-time stop k-mer cap (see apply_stop_kmers).
+    query_sample_size : int, optional
+        Fixed query k-mer sample size (see apply_query_sampling).
+    query_sample_fraction : float, optional
+        Query k-mer sample fraction (see apply_query_sampling).
+    deduplicate_queries : bool, optional
+        If True, identical query sequences are matched only once (see
+        parse_query_fasta).
+    query_records : iterable of Bio.SeqRecord.SeqRecord, optional
+        If given, these records are matched instead of the queries in
+        query_path and oriented in memory (see streaming).
 
     Returns
     -------
     tuple
-        A tuple containing:
-        - result : list of tuples
-            For each query, a tuple of the form
-            (query_name, query_kmer_set_size, intersection_sizes),
-            where intersection_sizes is a list of k-mer intersection
-            sizes with all reference sequences.
-        - reference_names : list of str
-            Names of the reference sequences.
-        - runtime_info : dict
-            Dictionary containing runtime measurements for the
-            individual processing steps.
+        A tuple of the form (result_path, query_data, runtime_info),
+        where result_path is the path of the lookup table, query_data is
+        the dictionary returned by parse_query_fasta and runtime_info
+        contains the parse and orientation times and the index
+        statistics.
     """
-
     #parse reference sequences
     result_path = reference_path.with_name(reference_path.stem + "_data.h5")
 
+    if index_options is None:
+        index_options = {}
+
+    lookup_exists = result_path.exists() and not redo
+
     reference_start_time = time.perf_counter()
-    parse_reference_fasta(reference_path, result_path, redo)
+    index_info = parse_reference_fasta(reference_path, result_path, redo, **index_options)
     reference_end_time = time.perf_counter()
     reference_parse_time = reference_end_time - reference_start_time
-    if reference_parse_time < 1:
+    if lookup_exists:
         reference_parse_time = -1
         print("Lookup table already exists.")
     else:
@@ -213,7 +819,14 @@ def get_intersection_sizes(reference_path: Path, query_path: Path, orient_query:
     #orient queries
     query_oriented_path = query_path
     orient_queries_time = 0
-    if orient_query:
+    if orient_query and query_records is not None:
+        orient_queries_start_time = time.perf_counter()
+        with h5py.File(result_path, "r") as f:
+            kmer_occurrence_count = f["kmer_occurrence_count"][:]
+        query_records = [orient_record(record, kmer_occurrence_count) for record in query_records]
+        orient_queries_end_time = time.perf_counter()
+        orient_queries_time = orient_queries_end_time - orient_queries_start_time
+    elif orient_query:
         orient_queries_start_time = time.perf_counter()
         query_oriented_path = query_path.with_name(query_path.stem + "_oriented" + query_path.suffix)
         orient_queries(query_path, result_path, redo=True)
@@ -222,57 +835,523 @@ def get_intersection_sizes(reference_path: Path, query_path: Path, orient_query:
 
     #parse query sequences
     query_start_time = time.perf_counter()
-    query_data = parse_query_fasta(query_oriented_path)
+    if query_records is not None:
+        query_data = parse_query_records(query_records, deduplicate_queries)
+    else:
+        query_data = parse_query_fasta(query_oriented_path, deduplicate_queries)
     query_end_time = time.perf_counter()
     query_parse_time = query_end_time - query_start_time
     print(f"Parsing query sequences took {query_parse_time} seconds.")
 
+    stop_kmer_info = apply_stop_kmers(result_path, query_data, stop_kmer_percentile, stop_kmer_cap)
+    query_sampling_info = apply_query_sampling(query_data, query_sample_size, query_sample_fraction)
 
-    query_names = query_data["query_names"]
-    query_kmer_sets = query_data["kmer_sets"]
-    query_sequence_lengths = query_data["sequence_lengths"]
+    runtime_info = {
+        "reference_parse_time": reference_parse_time,
+        "query_parse_time": query_parse_time,
+        "orient_queries_time": orient_queries_time,
+        **index_info,
+        **stop_kmer_info,
+        **query_sampling_info,
+    }
 
-    intersection_sizes = [[] for _ in range(len(query_names))]
-    reference_names = []
+    return result_path, query_data, runtime_info
+
+def build_result(query_data: dict, intersection_sizes) -> list:
+    """
+    Combines query names, query k-mer set sizes and intersection sizes
+    into the per-query result tuples
+    (query_name, query_kmer_set_size, intersection_sizes). For
+    deduplicated queries, the result of every distinct sequence is
+    fanned out to all queries sharing it.
+    """
+    result = []
+
+    if "query_groups" in query_data:
+        for query_name, query_id in zip(query_data["all_query_names"], query_data["query_groups"]):
+            result.append((query_name, len(query_data["kmer_sets"][query_id]), intersection_sizes[query_id]))
+        return result
+
+    for query_id, query_name in enumerate(query_data["query_names"]):
+        result.append((query_name, len(query_data["kmer_sets"][query_id]), intersection_sizes[query_id]))
+
+    return result
+
+def expand_reference_groups(result_path: Path, query_data: dict, intersection_sizes: np.ndarray, reference_names: list[str], runtime_info: dict):
+    """
+    Expands the intersection sizes of deduplicated reference groups (see
+    dedup) to all input references and records the number of duplicate
+    queries and references and the fraction of query–reference pairs
+    that did not have to be matched.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (intersection_sizes, reference_names) with one
+        column and one name per input reference.
+    """
+    groups, reference_names = load_reference_groups(result_path, query_data, reference_names, runtime_info)
+    if groups is not None:
+        intersection_sizes = intersection_sizes[:, groups]
+
+    return intersection_sizes, reference_names
+
+def load_reference_groups(result_path: Path, query_data: dict, reference_names: list[str], runtime_info: dict):
+    """
+    Loads the reference groups of a deduplicated lookup table and records
+    the deduplication statistics (see expand_reference_groups).
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (groups, reference_names), where groups holds
+        the group of every input reference, or None without reference
+        deduplication, and reference_names one name per input reference.
+    """
+    with h5py.File(result_path, "r") as f:
+        reference_groups = dedup.read_reference_groups(f)
+
+    distinct_reference_count = len(reference_names)
+    groups = None
+    if reference_groups is not None:
+        reference_names, groups = reference_groups
+
+    if "query_groups" in query_data or reference_groups is not None:
+        distinct_query_count = len(query_data["query_names"])
+        query_count = len(query_data.get("all_query_names", query_data["query_names"]))
+        runtime_info["duplicate_query_count"] = query_count - distinct_query_count
+        runtime_info["duplicate_reference_count"] = len(reference_names) - distinct_reference_count
+        runtime_info["dedup_saved_pair_fraction"] = 1 - distinct_query_count * distinct_reference_count / max(query_count * len(reference_names), 1)
+
+    return groups, reference_names
+
+def screen_references(result_path: Path, query_data: dict, reference_count: int, sketch_threshold: float,
+                      runtime_info: dict | None = None) -> list[np.ndarray]:
+    """
+    Screens all queries against the reference sketches (see sketch) and
+    returns for each reference the sorted ids of the queries it remains
+    a candidate for.
+    """
+    query_count = len(query_data["query_names"])
+
+    sketch_start_time = time.perf_counter()
+    sketch_index = sketch.load_sketch_index(result_path)
+    screened = [sketch.screen_query(sketch_index, kmer_set, sketch_threshold) for kmer_set in query_data["kmer_sets"]]
+
+    #regroup the candidate references of every query by reference
+    pair_query_ids = np.repeat(np.arange(query_count, dtype=np.int64), [len(reference_ids) for reference_ids in screened])
+    pair_reference_ids = np.concatenate(screened) if screened else np.zeros(0, dtype=np.int64)
+    order = np.argsort(pair_reference_ids, kind="stable")
+    screened_query_ids = np.split(pair_query_ids[order], np.searchsorted(pair_reference_ids[order], np.arange(1, reference_count)))
+    sketch_end_time = time.perf_counter()
+    sketch_time = sketch_end_time - sketch_start_time
+
+    candidate_pair_count = len(pair_query_ids)
+    print(f"Sketch screening kept {candidate_pair_count} of {query_count * reference_count} pairs and took {sketch_time} seconds.")
+
+    if runtime_info is not None:
+        runtime_info["sketch_threshold"] = sketch_threshold
+        runtime_info["sketch_size"] = int(sketch_index["sketch_size"])
+        runtime_info["sketch_time"] = sketch_time
+        runtime_info["sketch_candidate_pairs"] = candidate_pair_count
+        runtime_info["sketch_skipped_pair_fraction"] = 1 - candidate_pair_count / max(query_count * reference_count, 1)
+
+    return screened_query_ids
+
+def plan_matching(result_path: Path, query_data: dict, reference_count: int, prefilter_floor: int | None = None, prefilter_fill: str = "bound",
+                  refine_top_n: int | None = None, sketch_threshold: float | None = None, clade_floor: int | None = None,
+                  runtime_info: dict | None = None):
+    """
+    Determines which query–reference pairs are evaluated with the exact
+    windowed kernel and initialises the intersection size matrix.
+
+    Without a prefilter floor, all pairs are candidates. Otherwise, the
+    sparse prefilter (see prefilter) bounds all pairs at once and only
+    pairs whose bound reaches the floor remain candidates. Skipping pairs
+    with a bound of zero is exact, so a floor of 1 yields the same result
+    as no prefilter. With refine_top_n, only the top-N candidates per
+    query ranked by bound are matched exactly. With sketch_threshold,
+    only pairs selected by the sketch screening (see sketch) remain
+    candidates. With clade_floor, the clade tree is descended and all
+    references of clades whose union bound lies below the floor are
+    skipped (see clades).
+
+    Parameters
+    ----------
+    result_path : pathlib.Path
+        Path to the HDF5 lookup table.
+    query_data : dict
+        Dictionary returned by parse_query_fasta.
+    reference_count : int
+        Number of reference sequences in the lookup table.
+    prefilter_floor : int, optional
+        Minimum bound of a candidate pair. None disables the prefilter.
+    prefilter_fill : str, optional
+        Value recorded for skipped pairs, either their "bound" or "zero".
+    refine_top_n : int, optional
+        If given, at most this many candidates per query are matched
+        exactly. Enables the prefilter with a floor of 1 if no floor is
+        given.
+    sketch_threshold : float, optional
+        Minimum estimated containment of a candidate pair. None disables
+        the sketch screening. Pairs skipped by the screening are recorded
+        as zero unless the prefilter provides a value.
+    clade_floor : int, optional
+        Minimum union bound of a clade that is descended into. None
+        disables clade pruning. Pruned pairs are recorded according to
+        prefilter_fill, using the tighter per-reference bound if the
+        prefilter is enabled as well.
+    runtime_info : dict, optional
+        If given, the prefilter and screening statistics are added to it.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (candidate_query_ids, intersection_sizes,
+        bounds), where candidate_query_ids holds for each reference the
+        ids of the queries to evaluate, intersection_sizes is the query ×
+        reference matrix prefilled with the values of skipped pairs and
+        bounds is the sparse matrix of bounds (None without prefilter).
+    """
+    query_count = len(query_data["query_names"])
+
+    bounds = None
+    intersection_sizes = np.zeros((query_count, reference_count), dtype=np.int64)
+    candidate_query_ids = [np.arange(query_count) for _ in range(reference_count)]
+
+    if prefilter_floor is not None or refine_top_n is not None:
+        if prefilter_floor is None:
+            prefilter_floor = 1
+
+        prefilter_start_time = time.perf_counter()
+        query_matrix = prefilter.build_query_matrix(query_data["kmer_sets"])
+        bounds = prefilter.calculate_bounds(query_matrix, load_presence_matrix(result_path), query_data["sequence_lengths"])
+        candidate_query_ids = prefilter.select_candidates(bounds, prefilter_floor, refine_top_n)
+        intersection_sizes = prefilter.fill_skipped_pairs(bounds, prefilter_fill)
+        prefilter_end_time = time.perf_counter()
+        prefilter_time = prefilter_end_time - prefilter_start_time
+
+        candidate_pair_count = sum(len(query_ids) for query_ids in candidate_query_ids)
+        skipped_pair_fraction = 1 - candidate_pair_count / max(query_count * reference_count, 1)
+        print(f"Prefilter kept {candidate_pair_count} of {query_count * reference_count} pairs and took {prefilter_time} seconds.")
+
+        if runtime_info is not None:
+            runtime_info["prefilter_floor"] = prefilter_floor
+            runtime_info["prefilter_fill"] = prefilter_fill
+            runtime_info["refine_top_n"] = refine_top_n if refine_top_n is not None else -1
+            runtime_info["prefilter_time"] = prefilter_time
+            runtime_info["prefilter_candidate_pairs"] = candidate_pair_count
+            runtime_info["prefilter_skipped_pair_fraction"] = skipped_pair_fraction
+
+    if clade_floor is not None:
+        if prefilter_fill not in ("bound", "zero"):
+            raise ValueError(f"Unknown prefilter fill '{prefilter_fill}', expected 'bound' or 'zero'")
+
+        clade_start_time = time.perf_counter()
+        clade_index = load_clade_index(result_path)
+        clade_query_ids, clade_bounds, pruned_counts = clades.prune_clades(clade_index, prefilter.build_query_matrix(query_data["kmer_sets"]),
+                                                                          query_data["sequence_lengths"], clade_floor)
+        if bounds is None:
+            candidate_query_ids = clade_query_ids
+            if prefilter_fill == "bound":
+                intersection_sizes = clade_bounds
+        else:
+            candidate_query_ids = [np.intersect1d(query_ids, clade_ids) for query_ids, clade_ids in zip(candidate_query_ids, clade_query_ids)]
+        clade_end_time = time.perf_counter()
+        clade_time = clade_end_time - clade_start_time
+
+        pruned_clades = {clade_index["clade_names"][clade_id]: int(count) for clade_id, count in enumerate(pruned_counts) if count > 0}
+        candidate_pair_count = sum(len(query_ids) for query_ids in candidate_query_ids)
+        print(f"Clade pruning kept {candidate_pair_count} of {query_count * reference_count} pairs, pruned {len(pruned_clades)} of "
+              f"{len(pruned_counts)} clades for at least one query and took {clade_time} seconds.")
+
+        if runtime_info is not None:
+            runtime_info["clade_floor"] = clade_floor
+            runtime_info["clade_count"] = len(pruned_counts)
+            runtime_info["clade_time"] = clade_time
+            runtime_info["clade_candidate_pairs"] = candidate_pair_count
+            runtime_info["clade_skipped_pair_fraction"] = 1 - candidate_pair_count / max(query_count * reference_count, 1)
+            runtime_info["pruned_clades"] = pruned_clades
+
+    if sketch_threshold is not None:
+        screened_query_ids = screen_references(result_path, query_data, reference_count, sketch_threshold, runtime_info)
+        candidate_query_ids = [query_ids[np.isin(query_ids, screened_ids, assume_unique=True)]
+                               for query_ids, screened_ids in zip(candidate_query_ids, screened_query_ids)]
+
+    return candidate_query_ids, intersection_sizes, bounds
+
+def record_kernel_info(query_data: dict, window_sizes, kernel: str, block_size: int, runtime_info: dict):
+    """
+    Validates the matching kernel and adds it to runtime_info. For the
+    strided kernel, the block size and the largest proven distance of a
+    result from the exact intersection size (see
+    kernels.calculate_intersection_size_strided) are added as well, for
+    the batched_bitmask kernel the number of query bitmasks and the
+    fraction of their bits in use. window_sizes holds the window size used for every
+    query (see assign_length_buckets).
+    """
+    if kernel not in KERNELS:
+        raise ValueError(f"Unknown kernel '{kernel}', expected one of {KERNELS}")
+
+    runtime_info["kernel"] = kernel
+    if kernel == "batched_bitmask":
+        query_masks = sum(-(-int(count) // kernels.QUERIES_PER_MASK) for count in np.unique(window_sizes, return_counts=True)[1])
+        runtime_info["bitmask_count"] = query_masks
+        runtime_info["bitmask_fill"] = len(window_sizes) / max(query_masks * kernels.QUERIES_PER_MASK, 1)
+    if kernel != "strided":
+        return
+    if block_size <= 0:
+        raise ValueError("The strided kernel requires a lookup table built with a block_size")
+
+    error_bound = 0
+    for query_id, kmer_set in enumerate(query_data["kmer_sets"]):
+        upper_blocks, lower_blocks = kernels.strided_window_blocks(window_sizes[query_id], block_size)
+        error_bound = max(error_bound, min((upper_blocks - lower_blocks) * block_size, len(kmer_set)))
+
+    runtime_info["strided_block_size"] = int(block_size)
+    runtime_info["strided_error_bound"] = error_bound
+
+def assign_length_buckets(query_data: dict, length_bucket_width: int | None, runtime_info: dict) -> list[int]:
+    """
+    Returns the window size used for every query. Without a bucket
+    width, these are the query lengths; otherwise the queries share the
+    window of their length bucket (see length_buckets) and the bucket
+    count and the largest and mean window increase are added to
+    runtime_info. Since windows only grow, the increase bounds the
+    deviation of every bucketed intersection size.
+    """
+    if length_bucket_width is None:
+        return query_data["sequence_lengths"]
+
+    window_sizes = length_buckets.bucket_window_sizes(query_data["sequence_lengths"], length_bucket_width)
+    window_increase = window_sizes - np.asarray(query_data["sequence_lengths"], dtype=np.int64)
+
+    runtime_info["length_bucket_width"] = length_bucket_width
+    runtime_info["length_bucket_count"] = len(np.unique(window_sizes))
+    runtime_info["length_bucket_error_bound"] = int(window_increase.max(initial=0))
+    runtime_info["mean_length_bucket_window_increase"] = float(window_increase.mean()) if len(window_increase) > 0 else 0.0
+
+    return window_sizes.tolist()
+
+def recheck_length_bucket_winners(result_path: Path, query_data: dict, intersection_sizes: np.ndarray, candidate_query_ids, window_sizes,
+                                  kernel: str, runtime_info: dict):
+    """
+    Re-checks the pairs that may hold the top hit of their query (see
+    length_buckets.select_recheck_pairs) with the exact query length and
+    updates intersection_sizes in place, so that the top hit of every
+    query equals the one without bucketing.
+
+    The number of re-checked pairs, the time spent and the deviation of
+    the bucketed from the exact sizes of these pairs, as well as the
+    number of queries whose top hit changed, are added to runtime_info
+    to report the effect of bucketing on accuracy.
+    """
+    recheck_start_time = time.perf_counter()
+
+    refined = np.zeros(intersection_sizes.shape, dtype=bool)
+    for reference_id, query_ids in enumerate(candidate_query_ids):
+        refined[query_ids, reference_id] = True
+    window_increase = np.asarray(window_sizes, dtype=np.int64) - np.asarray(query_data["sequence_lengths"], dtype=np.int64)
+    selected = length_buckets.select_recheck_pairs(intersection_sizes, refined, window_increase)
+
+    bucketed_top_hits = intersection_sizes.argmax(axis=1)
+    deviations = []
+    with h5py.File(result_path, "r") as f:
+        reference_ids = get_reference_ids(f)
+        for reference_id in np.flatnonzero(selected.any(axis=0)):
+            query_ids = np.flatnonzero(selected[:, reference_id])
+            reference_data = load_reference(f[reference_ids[reference_id]], kernel)
+            sizes = calculate_reference_intersection_sizes(reference_data, [query_data["kmer_sets"][query_id] for query_id in query_ids],
+                                                           [query_data["sequence_lengths"][query_id] for query_id in query_ids])
+            deviations.append(intersection_sizes[query_ids, reference_id] - np.asarray(sizes, dtype=np.int64))
+            intersection_sizes[query_ids, reference_id] = sizes
+
+    recheck_end_time = time.perf_counter()
+    recheck_time = recheck_end_time - recheck_start_time
+    deviations = np.concatenate(deviations) if len(deviations) > 0 else np.zeros(0, dtype=np.int64)
+    changed_top_hits = int(np.count_nonzero(intersection_sizes.argmax(axis=1) != bucketed_top_hits)) if intersection_sizes.shape[1] > 0 else 0
+    print(f"Re-checking {len(deviations)} length bucket winners took {recheck_time} seconds, {changed_top_hits} top hits changed.")
+
+    runtime_info["length_bucket_recheck_pairs"] = len(deviations)
+    runtime_info["length_bucket_recheck_time"] = recheck_time
+    runtime_info["length_bucket_max_deviation"] = int(deviations.max(initial=0))
+    runtime_info["length_bucket_mean_deviation"] = float(deviations.mean()) if len(deviations) > 0 else 0.0
+    runtime_info["length_bucket_changed_top_hits"] = changed_top_hits
+
+def record_segment_info(f: h5py.File, window_sizes, runtime_info: dict):
+    """
+    Ensures that segment-wise matching is exact for all query window
+    sizes (see segments.check_query_lengths) and adds the number of segmented
+    references and segments to runtime_info. Nothing is recorded for
+    lookup tables without segments.
+    """
+    if "segment_length" not in f.attrs:
+        return
+    segments.check_query_lengths(window_sizes, int(f.attrs["segment_overlap"]))
+
+    segment_counts = [len(f[idx]["segments"]) for idx in get_reference_ids(f) if "segments" in f[idx]]
+    runtime_info["segmented_reference_count"] = len(segment_counts)
+    runtime_info["segment_count"] = sum(segment_counts)
+
+def record_confidence_error(query_data: dict, intersection_sizes: np.ndarray, candidate_query_ids, bounds, runtime_info: dict):
+    """
+    Adds the maximum confidence error caused by skipped pairs (see
+    prefilter.calculate_max_confidence_error) to runtime_info. Nothing
+    is recorded if the prefilter was not used.
+    """
+    if bounds is None:
+        return
+
+    refined = np.zeros(intersection_sizes.shape, dtype=bool)
+    for reference_id, query_ids in enumerate(candidate_query_ids):
+        refined[query_ids, reference_id] = True
+
+    query_set_sizes = [len(kmer_set) for kmer_set in query_data["kmer_sets"]]
+    max_errors = prefilter.calculate_max_confidence_error(intersection_sizes, bounds, refined, query_set_sizes)
+    max_confidence_error = float(max_errors.max(initial=0))
+    print(f"Maximum confidence error caused by skipped pairs: {max_confidence_error}")
+
+    runtime_info["max_confidence_error"] = max_confidence_error
+    runtime_info["mean_max_confidence_error"] = float(max_errors.mean()) if len(max_errors) > 0 else 0.0
+
+def get_intersection_sizes(reference_path: Path, query_path: Path, orient_query: bool = False, redo: bool = False, index_options: dict | None = None,
+                           prefilter_floor: int | None = None, prefilter_fill: str = "bound", refine_top_n: int | None = None,
+                           sketch_threshold: float | None = None, kernel: str = "exact", stop_kmer_percentile: float | None = None,
+                           stop_kmer_cap: int | None = None, query_sample_size: int | None = None, query_sample_fraction: float | None = None,
+                           clade_floor: int | None = None, length_bucket_width: int | None = None, length_bucket_exact: bool = False,
+                           deduplicate_queries: bool = False, query_records=None):
+    """
+    Computes k-mer intersection sizes sequentially between all query
+    sequences and reference sequences.
+
+    Parameters
+    ----------
+    reference_path : pathlib.Path
+        Path to the reference FASTA file.
+    query_path : pathlib.Path
+        Path to the query FASTA file.
+    orient_query : bool, optional
+        If True, query sequences are oriented prior to matching.
+    redo : bool, optional
+        If True, existing reference lookup data are recomputed.
+    index_options : dict, optional
+        Keyword arguments forwarded to parse_reference_fasta, e.g.
+        {"index_encoding": "delta_packed"}.
+    prefilter_floor : int, optional
+        If given, only pairs whose prefilter bound reaches this floor are
+        matched exactly (see plan_matching).
+    prefilter_fill : str, optional
+        Value recorded for pairs skipped by the prefilter, either their
+        "bound" or "zero".
+    refine_top_n : int, optional
+        If given, only the top-N candidates per query ranked by their
+        prefilter bound are matched exactly; the maximum resulting
+        confidence error is added to runtime_info.
+    sketch_threshold : float, optional
+        If given, only pairs whose containment estimated from the
+        reference sketches reaches this threshold are matched exactly.
+    clade_floor : int, optional
+        If given, references are skipped clade by clade while descending
+        the taxonomy whenever the bound of the query against the union
+        k-mer set of the clade lies below this floor (see plan_matching).
+    kernel : str, optional
+        "exact" computes exact windowed intersection sizes, "strided"
+        upper bounds from block bitsets on windows aligned to block
+        boundaries (see record_kernel_info). "batched" computes exact
+        intersection sizes for all queries of a reference in a few NumPy
+        calls, "batched_bitmask" likewise after gathering the occurrences
+        of up to 64 queries of equal length through one bitmask.
+    length_bucket_width : int, optional
+        If given, queries are grouped into length buckets of this width
+        and matched with the largest query length of their bucket as
+        window size (see assign_length_buckets). Intersection sizes may
+        only grow.
+    length_bucket_exact : bool, optional
+        If True, the pairs that may hold the top hit of their query are
+        re-checked with the exact query length (see
+        recheck_length_bucket_winners).
+    deduplicate_queries : bool, optional
+        If True, identical query sequences are matched only once and
+        their results are fanned out to all of them.
+    query_records : iterable of Bio.SeqRecord.SeqRecord, optional
+        If given, these records are matched instead of the queries in
+        query_path (see streaming).
+    stop_kmer_percentile : float, optional
+        If given, query k-mers above this occurrence percentile are
+        masked in addition to the stop k-mers of the lookup table (see
+        apply_stop_kmers).
+    stop_kmer_cap : int, optional
+        If given, query k-mers occurring more often than this cap are
+        masked as well.
+    query_sample_size : int, optional
+        If given, each query k-mer set is deterministically subsampled to
+        at most this many k-mers (see apply_query_sampling).
+    query_sample_fraction : float, optional
+        If given, each query k-mer set is deterministically subsampled to
+        this fraction of its k-mers.
+
+    Returns
+    -------
+    tuple
+        A tuple containing:
+        - result : list of tuples
+            For each query, a tuple of the form
+            (query_name, query_kmer_set_size, intersection_sizes),
+            where intersection_sizes is a list of k-mer intersection
+            sizes with all reference sequences.
+        - reference_names : list of str
+            Names of the reference sequences.
+        - runtime_info : dict
+            Dictionary containing runtime measurements for the
+            individual processing steps.
+    """
+
+    result_path, query_data, runtime_info = prepare_matching(reference_path, query_path, orient_query, redo, index_options, stop_kmer_percentile, stop_kmer_cap,
+                                                             query_sample_size, query_sample_fraction, deduplicate_queries, query_records)
+
+    query_kmer_sets = query_data["kmer_sets"]
 
     #calculate intersection sizes sequentially
     calculate_intersection_sizes_start = time.perf_counter()
     average_reference_processing_time = 0
     with h5py.File(result_path, "r") as f:
-        for idx in f.keys():
+        reference_ids = get_reference_ids(f)
+        reference_names = get_reference_names(f, reference_ids)
+        candidate_query_ids, intersection_sizes, bounds = plan_matching(result_path, query_data, len(reference_ids), prefilter_floor, prefilter_fill,
+                                                                         refine_top_n, sketch_threshold, clade_floor, runtime_info)
+        window_sizes = assign_length_buckets(query_data, length_bucket_width, runtime_info)
+        record_kernel_info(query_data, window_sizes, kernel, f.attrs.get("block_size", -1), runtime_info)
+        record_segment_info(f, window_sizes, runtime_info)
+        for reference_id, idx in enumerate(reference_ids):
             reference_processing_time_start = time.perf_counter()
-            grp = f[idx]
-            lineage_name = grp.attrs["name"]
-            print(idx, lineage_name)
-            flat_data = grp["flat_data"][:]
-            offsets = grp["offsets"][:]
-
-            reference_names.append(lineage_name)
+            print(idx, reference_names[reference_id])
 
-            for query_id, kmer_set in enumerate(query_kmer_sets):
-                intersection_sizes[query_id].append(calculate_intersection_size(flat_data, offsets, kmer_set, query_sequence_lengths[query_id]))
+            query_ids = candidate_query_ids[reference_id]
+            if len(query_ids) > 0:
+                reference_data = load_reference(f[idx], kernel)
+                sizes = calculate_reference_intersection_sizes(reference_data, [query_kmer_sets[query_id] for query_id in query_ids],
+                                                               [window_sizes[query_id] for query_id in query_ids])
+                intersection_sizes[query_ids, reference_id] = sizes
 
             reference_processing_time_end = time.perf_counter()
             reference_processing_time = reference_processing_time_end - reference_processing_time_start
             print(f"Processing {idx} reference took {reference_processing_time} seconds.")
             average_reference_processing_time += reference_processing_time
-        average_reference_processing_time /= len(f.keys())
+        average_reference_processing_time /= len(reference_ids)
     calculate_intersection_sizes_end = time.perf_counter()
     calculate_intersection_sizes_time = calculate_intersection_sizes_end - calculate_intersection_sizes_start
     print(f"Calculating intersection sizes took {calculate_intersection_sizes_time} seconds.")
 
-    result = []
+    if length_bucket_width is not None and length_bucket_exact:
+        recheck_length_bucket_winners(result_path, query_data, intersection_sizes, candidate_query_ids, window_sizes, kernel, runtime_info)
 
-    for query_id in range(len(query_names)):
-        result.append((query_names[query_id], len(query_kmer_sets[query_id]), intersection_sizes[query_id]))
+    record_confidence_error(query_data, intersection_sizes, candidate_query_ids, bounds, runtime_info)
+    intersection_sizes, reference_names = expand_reference_groups(result_path, query_data, intersection_sizes, reference_names, runtime_info)
 
-    runtime_info = {
-        "reference_parse_time": reference_parse_time,
-        "query_parse_time": query_parse_time,
-        "orient_queries_time": orient_queries_time,
-        "calculate_intersection_sizes_time": calculate_intersection_sizes_time,
-        "average_reference_processing_time": average_reference_processing_time,
-    }
+    result = build_result(query_data, intersection_sizes.tolist())
+
+    runtime_info["calculate_intersection_sizes_time"] = calculate_intersection_sizes_time
+    runtime_info["average_reference_processing_time"] = average_reference_processing_time
 
     return result, reference_names, runtime_info
 
@@ -305,27 +1384,29 @@ def orient_queries(query_path: Path, reference_data_path: Path, redo: bool = Fal
     with h5py.File(reference_data_path, "r") as f:
         kmer_occurrence_count = f["kmer_occurrence_count"][:]
 
-    records_out = []
+    records_out = [orient_record(record, kmer_occurrence_count) for record in SeqIO.parse(query_path, "fasta")]
 
-    for record in SeqIO.parse(query_path, "fasta"):
-        kmer_net_count = 0
-        seq_str = str(record.seq)
+    SeqIO.write(records_out, oriented_path, "fasta")
+    print(f"[INFO] Oriented queries written to: {oriented_path}")
 
-        for kmer_int in utils.sequence_to_kmer_set(seq_str, constants.K):
-            kmer_complement_int = utils.complement_kmer_index(kmer_int)
-            kmer_net_count += int(kmer_occurrence_count[kmer_int])
-            kmer_net_count -= int(kmer_occurrence_count[kmer_complement_int])
+def orient_record(record: SeqRecord, kmer_occurrence_count: np.ndarray) -> SeqRecord:
+    """
+    Returns the query record as is if its k-mers occur at least as often
+    in the references as their complements, and its complement otherwise.
+    """
+    kmer_net_count = 0
+    seq_str = str(record.seq)
 
-        if kmer_net_count >= 0:
-            records_out.append(record)
-        else:
-            new_record = SeqRecord(Seq(utils.complement_sequence_str(seq_str)), id=record.id, description=record.description)
-            records_out.append(new_record)
+    for kmer_int in utils.sequence_to_kmer_set(seq_str, constants.K):
+        kmer_complement_int = utils.complement_kmer_index(kmer_int)
+        kmer_net_count += int(kmer_occurrence_count[kmer_int])
+        kmer_net_count -= int(kmer_occurrence_count[kmer_complement_int])
 
-    SeqIO.write(records_out, oriented_path, "fasta")
-    print(f"[INFO] Oriented queries written to: {oriented_path}")
+    if kmer_net_count >= 0:
+        return record
+    return SeqRecord(Seq(utils.complement_sequence_str(seq_str)), id=record.id, name=record.name, description=record.description)
 
-def process_reference(idx, result_path, query_kmer_sets, query_sequence_lengths):
+def process_reference(idx, result_path, query_kmer_sets, query_sequence_lengths, kernel: str = "exact", segment_id: str | None = None):
     """
     Computes k-mer intersection sizes between a single reference
     sequence and all query sequences.
@@ -346,6 +1427,11 @@ def process_reference(idx, result_path, query_kmer_sets, query_sequence_lengths)
     query_sequence_lengths : list of int
         Lengths of the query sequences, used to define sliding window
         sizes.
+    kernel : str, optional
+        Matching kernel, one of KERNELS (see load_reference).
+    segment_id : str, optional
+        If given, only this segment of a segmented reference is
+        processed (see segments).
 
     Returns
     -------
@@ -359,13 +1445,11 @@ def process_reference(idx, result_path, query_kmer_sets, query_sequence_lengths)
         reference_processing_time_start = time.perf_counter()
         grp = f[idx]
         lineage_name = grp.attrs["name"]
-        flat_data = grp["flat_data"][:]
-        offsets = grp["offsets"][:]
+        if segment_id is not None:
+            grp = grp["segments"][segment_id]
+        reference_data = load_reference(grp, kernel)
 
-        intersection_sizes = []
-        for query_id, kmer_set in enumerate(query_kmer_sets):
-            size = calculate_intersection_size(flat_data, offsets, kmer_set, query_sequence_lengths[query_id])
-            intersection_sizes.append(size)
+        intersection_sizes = calculate_reference_intersection_sizes(reference_data, query_kmer_sets, query_sequence_lengths)
 
         reference_processing_time_end = time.perf_counter()
         reference_processing_time = reference_processing_time_end - reference_processing_time_start
@@ -373,11 +1457,137 @@ def process_reference(idx, result_path, query_kmer_sets, query_sequence_lengths)
 
     return idx, lineage_name, intersection_sizes
 
-def get_intersection_sizes_parallel(reference_path: Path, query_path: Path, orient_query: bool = False, redo: bool = False, num_workers: int = None):
+def process_loaded_reference(idx, lineage_name: str, reference_data: dict, query_kmer_sets, query_sequence_lengths):
+    """
+    Computes k-mer intersection sizes between a single reference
+    sequence, whose lookup data were already loaded by the caller, and
+    all query sequences. It is used by the thread executor of
+    get_intersection_sizes_parallel, whose threads share the loaded
+    references and the query k-mer sets.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (idx, lineage_name, intersection_sizes) as
+        returned by process_reference.
+    """
+    return idx, lineage_name, calculate_reference_intersection_sizes(reference_data, query_kmer_sets, query_sequence_lengths)
+
+#decoded references and query data preloaded by the parent for the fork executor, inherited copy-on-write by its workers
+_preloaded_references = None
+_preloaded_queries = None
+
+def process_preloaded_reference(idx, segment_id: str | None, query_ids):
+    """
+    Computes k-mer intersection sizes between a single reference
+    sequence (or segment) and the queries query_ids, reading the
+    references and query k-mer sets the parent preloaded before forking
+    the workers of the fork executor of get_intersection_sizes_parallel.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (idx, lineage_name, intersection_sizes) as
+        returned by process_reference.
+    """
+    lineage_name, reference_data = _preloaded_references[(idx, segment_id)]
+    query_kmer_sets, window_sizes = _preloaded_queries
+    intersection_sizes = calculate_reference_intersection_sizes(reference_data, [query_kmer_sets[query_id] for query_id in query_ids],
+                                                                [window_sizes[query_id] for query_id in query_ids])
+    return idx, lineage_name, intersection_sizes
+
+def process_task_chunk(calls: list) -> list:
+    """
+    Runs a chunk of tasks of get_intersection_sizes_parallel in one
+    worker, where calls holds pairs of the form (function, arguments).
+
+    Returns
+    -------
+    list
+        Results of the tasks in order.
+    """
+    return [function(*arguments) for function, arguments in calls]
+
+def tune_parallel_matching(f: h5py.File, result_path: Path, tasks: list, candidate_query_ids, query_kmer_sets, window_sizes, kernel: str,
+                           executor_type: str, pool_type, pool_options: dict, num_workers: int | None, chunk_size: int | None) -> dict:
+    """
+    Chooses the worker count and the chunk size of
+    get_intersection_sizes_parallel that are not given (see autotune).
+    Unless measurements of this host, index, executor and kernel were
+    persisted, the calibration decodes a sample of the tasks spread over
+    the references and matches them against a sample of their queries.
+
+    Returns
+    -------
+    dict
+        Runtime information entries of the tuning as returned by
+        autotune.tune.
+    """
+    average_query_count = sum(len(candidate_query_ids[task[0]]) for task in tasks) / len(tasks)
+
+    def calibrate(max_workers: int) -> dict:
+        sample_tasks = []
+        for reference_id, idx, segment_id in tasks[::max(len(tasks) // autotune.DEFAULT_SAMPLE_TASK_COUNT, 1)][:autotune.DEFAULT_SAMPLE_TASK_COUNT]:
+            query_ids = candidate_query_ids[reference_id]
+            sample_query_ids = query_ids[:autotune.DEFAULT_SAMPLE_QUERY_COUNT]
+            load_start_time = time.perf_counter()
+            grp = f[idx] if segment_id is None else f[idx]["segments"][segment_id]
+            reference_data = load_reference(grp, kernel)
+            load_time = time.perf_counter() - load_start_time
+            #data sent to a worker with the full task
+            if executor_type == "process":
+                payload = ([query_kmer_sets[query_id] for query_id in query_ids], [window_sizes[query_id] for query_id in query_ids])
+            elif executor_type == "fork":
+                payload = (query_ids,)
+            else:
+                payload = ()
+            sample_tasks.append({
+                "load_time": load_time,
+                "reference_data": reference_data,
+                "query_kmer_sets": [query_kmer_sets[query_id] for query_id in sample_query_ids],
+                "window_sizes": [window_sizes[query_id] for query_id in sample_query_ids],
+                "payload": payload,
+            })
+        return autotune.calibrate(sample_tasks, calculate_reference_intersection_sizes, pool_type, pool_options, max_workers)
+
+    return autotune.tune(result_path, checkpoint.get_index_hash(f, result_path), executor_type, kernel, len(tasks), average_query_count, num_workers,
+                         chunk_size, calibrate)
+
+def get_intersection_sizes_parallel(reference_path: Path, query_path: Path, orient_query: bool = False, redo: bool = False, num_workers: int = None,
+                                    index_options: dict | None = None, prefilter_floor: int | None = None, prefilter_fill: str = "bound",
+                                    refine_top_n: int | None = None, sketch_threshold: float | None = None, kernel: str = "exact",
+                                    stop_kmer_percentile: float | None = None, stop_kmer_cap: int | None = None, query_sample_size: int | None = None,
+                                    query_sample_fraction: float | None = None, clade_floor: int | None = None, length_bucket_width: int | None = None,
+                                    length_bucket_exact: bool = False, deduplicate_queries: bool = False, query_records=None,
+                                    checkpoint_dir: Path | None = None, checkpoint_interval: float = checkpoint.DEFAULT_CHECKPOINT_INTERVAL,
+                                    executor_type: str = "process", worker_placement: str | None = None,
+                                    worker_cpu_sets: list[list[int]] | None = None, chunk_size: int | None = None, tune_workers: bool = False):
     """
     Computes k-mer intersection sizes between all query sequences
     and reference sequences using parallel processing.
 
+    With the process executor, every task opens the lookup table and
+    decodes its reference in a worker process. With the thread executor,
+    references are decoded by the calling thread and matched by a pool
+    of threads sharing the decoded references and the query k-mer sets,
+    so that no data are copied per worker. The exact kernel then runs in
+    its batched form, whose work is done in NumPy calls that release the
+    GIL. With the fork executor, the calling process decodes the whole
+    index before forking the worker processes, which read the decoded
+    references copy-on-write instead of holding private copies; only
+    query ids and intersection sizes are sent between the processes.
+    The resident memory of the calling process and of the workers,
+    split into shared and private pages (see memory_usage), is added to
+    runtime_info before the pool is shut down.
+
+    With a worker placement, the workers are bound to cores and, with
+    "numa", run in one pool per NUMA node that matches the shard of
+    references decoded on that node (see placement). Tasks, i.e. a
+    reference or segment matched against its candidate queries, are sent
+    to the workers in chunks of chunk_size tasks. With tune_workers, the
+    worker count and the chunk size that are not given are chosen from a
+    short calibration persisted per host and index (see autotune).
+
     Parameters
     ----------
     reference_path : pathlib.Path
@@ -389,7 +1599,89 @@ def get_intersection_sizes_parallel(reference_path: Path, query_path: Path, orie
     redo : bool, optional
         If True, existing reference lookup data are recomputed.
     num_workers : int, optional
-        Number of parallel processes to use.
+        Number of parallel processes or threads to use; tuned with
+        tune_workers if None.
+    index_options : dict, optional
+        Keyword arguments forwarded to parse_reference_fasta, e.g.
+        {"index_encoding": "delta_packed"}.
+    prefilter_floor : int, optional
+        If given, only pairs whose prefilter bound reaches this floor are
+        matched exactly (see plan_matching).
+    prefilter_fill : str, optional
+        Value recorded for pairs skipped by the prefilter, either their
+        "bound" or "zero".
+    refine_top_n : int, optional
+        If given, only the top-N candidates per query ranked by their
+        prefilter bound are matched exactly; the maximum resulting
+        confidence error is added to runtime_info.
+    sketch_threshold : float, optional
+        If given, only pairs whose containment estimated from the
+        reference sketches reaches this threshold are matched exactly.
+    clade_floor : int, optional
+        If given, references are skipped clade by clade while descending
+        the taxonomy whenever the bound of the query against the union
+        k-mer set of the clade lies below this floor (see plan_matching).
+    kernel : str, optional
+        "exact" computes exact windowed intersection sizes, "strided"
+        upper bounds from block bitsets on windows aligned to block
+        boundaries (see record_kernel_info). "batched" computes exact
+        intersection sizes for all queries of a reference in a few NumPy
+        calls, "batched_bitmask" likewise after gathering the occurrences
+        of up to 64 queries of equal length through one bitmask.
+    length_bucket_width : int, optional
+        If given, queries are grouped into length buckets of this width
+        and matched with the largest query length of their bucket as
+        window size (see assign_length_buckets). Intersection sizes may
+        only grow.
+    length_bucket_exact : bool, optional
+        If True, the pairs that may hold the top hit of their query are
+        re-checked with the exact query length (see
+        recheck_length_bucket_winners).
+    deduplicate_queries : bool, optional
+        If True, identical query sequences are matched only once and
+        their results are fanned out to all of them.
+    query_records : iterable of Bio.SeqRecord.SeqRecord, optional
+        If given, these records are matched instead of the queries in
+        query_path (see streaming).
+    checkpoint_dir : pathlib.Path, optional
+        If given, completed reference columns are checkpointed in a
+        subdirectory keyed by the index hash and the query-set hash (see
+        checkpoint). A rerun of an interrupted run restores the completed
+        references instead of matching them again. The checkpoint is
+        removed once matching has completed.
+    checkpoint_interval : float, optional
+        Minimum number of seconds between two flushes of the checkpoint.
+    executor_type : str, optional
+        "process", "thread" or "fork". The fork executor requires the
+        fork start method (Linux, macOS).
+    worker_placement : str, optional
+        If given, "pinned" binds every worker to one core and "numa"
+        additionally keeps the workers and their references per NUMA
+        node, degrading to "pinned" on a single node (see placement).
+        The placement is added to runtime_info.
+    worker_cpu_sets : list of list of int, optional
+        If given, worker i is bound to the cores worker_cpu_sets[i]
+        instead of a single core; implies "pinned" without
+        worker_placement.
+    chunk_size : int, optional
+        Number of tasks sent to a worker at once; 1 if neither given nor
+        tuned.
+    tune_workers : bool, optional
+        If True, num_workers and chunk_size are tuned unless given. The
+        tuning is added to runtime_info.
+    stop_kmer_percentile : float, optional
+        If given, query k-mers above this occurrence percentile are
+        masked in addition to the stop k-mers of the lookup table (see
+        apply_stop_kmers).
+    stop_kmer_cap : int, optional
+        If given, query k-mers occurring more often than this cap are
+        masked as well.
+    query_sample_size : int, optional
+        If given, each query k-mer set is deterministically subsampled to
+        at most this many k-mers (see apply_query_sampling).
+    query_sample_fraction : float, optional
+        If given, each query k-mer set is deterministically subsampled to
+        this fraction of its k-mers.
 
     Returns
     -------
@@ -407,81 +1699,388 @@ def get_intersection_sizes_parallel(reference_path: Path, query_path: Path, orie
             individual processing steps.
     """
 
-    #parse reference sequences
-    result_path = reference_path.with_name(reference_path.stem + "_data.h5")
+    result_path, query_data, runtime_info = prepare_matching(reference_path, query_path, orient_query, redo, index_options, stop_kmer_percentile, stop_kmer_cap,
+                                                             query_sample_size, query_sample_fraction, deduplicate_queries, query_records)
 
-    reference_start_time = time.perf_counter()
-    parse_reference_fasta(reference_path, result_path, redo)
-    reference_end_time = time.perf_counter()
-    reference_parse_time = reference_end_time - reference_start_time
-    if reference_parse_time < 1:
-        reference_parse_time = -1
-        print("Lookup table already exists.")
+    query_kmer_sets = query_data["kmer_sets"]
+
+    pool_options = {}
+    if executor_type == "thread":
+        pool_type = ThreadPoolExecutor
+        #the exact kernel loops over positions in Python and would hold the GIL
+        if kernel == "exact":
+            kernel = "batched"
+    elif executor_type == "process":
+        pool_type = ProcessPoolExecutor
+    elif executor_type == "fork":
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise ValueError("The fork executor requires the fork start method, which is unavailable on this platform")
+        pool_type = ProcessPoolExecutor
+        pool_options["mp_context"] = multiprocessing.get_context("fork")
     else:
-        print("Lookup table created.")
-        print(f"Parsing and storing reference look up took {reference_parse_time} seconds.")
+        raise ValueError(f"Unknown executor type '{executor_type}', expected 'process', 'thread' or 'fork'")
+    runtime_info["executor_type"] = executor_type
 
-    #orient queries
-    query_oriented_path = query_path
-    orient_queries_time = 0
-    if orient_query:
-        orient_queries_start_time = time.perf_counter()
-        query_oriented_path = query_path.with_name(query_path.stem + "_oriented" + query_path.suffix)
-        orient_queries(query_path, result_path, redo=True)
-        orient_queries_end_time = time.perf_counter()
-        orient_queries_time = orient_queries_end_time - orient_queries_start_time
+    calculate_intersection_sizes_start = time.perf_counter()
+    reference_count = -1
 
-    #parse query sequences
-    query_start_time = time.perf_counter()
-    query_data = parse_query_fasta(query_oriented_path)
-    query_end_time = time.perf_counter()
-    query_parse_time = query_end_time - query_start_time
-    print(f"Parsing query sequences took {query_parse_time} seconds.")
+    #plan the tasks; the thread and fork executors decode all references before the pool starts
+    tasks = []
+    loaded_references = {}
+    remaining_segments = {}
+    with h5py.File(result_path, "r") as f:
+        reference_ids = get_reference_ids(f)
+        reference_count = len(reference_ids)
+        reference_names = get_reference_names(f, reference_ids)
+        candidate_query_ids, intersection_sizes, bounds = plan_matching(result_path, query_data, reference_count, prefilter_floor, prefilter_fill,
+                                                                         refine_top_n, sketch_threshold, clade_floor, runtime_info)
+        window_sizes = assign_length_buckets(query_data, length_bucket_width, runtime_info)
+        record_kernel_info(query_data, window_sizes, kernel, f.attrs.get("block_size", -1), runtime_info)
+        record_segment_info(f, window_sizes, runtime_info)
+
+        checkpoint_data = None
+        restored = set()
+        if checkpoint_dir is not None:
+            checkpoint_data = checkpoint.open_checkpoint(checkpoint_dir, checkpoint.get_index_hash(f, result_path),
+                                                         checkpoint.hash_query_set(query_data, window_sizes, kernel), len(query_kmer_sets), reference_count)
+            restored = checkpoint.restore_columns(checkpoint_data, candidate_query_ids, intersection_sizes)
+            print(f"Restored {len(restored)} of {reference_count} references from checkpoint {checkpoint_data['path']}.")
+
+        for reference_id, idx in enumerate(reference_ids):
+            query_ids = candidate_query_ids[reference_id]
+            if len(query_ids) == 0 or reference_id in restored:
+                continue
+            #segments of a long reference are processed as separate tasks and reduced by their maximum below
+            intersection_sizes[query_ids, reference_id] = 0
+            segment_ids = list(f[idx]["segments"].keys()) if "segments" in f[idx] else [None]
+            remaining_segments[reference_id] = len(segment_ids)
+            tasks.extend((reference_id, idx, segment_id) for segment_id in segment_ids)
+
+        if tune_workers and (num_workers is None or chunk_size is None) and tasks:
+            tuning_info = tune_parallel_matching(f, result_path, tasks, candidate_query_ids, query_kmer_sets, window_sizes, kernel, executor_type,
+                                                 pool_type, pool_options, num_workers, chunk_size)
+            num_workers = tuning_info["autotune_num_workers"]
+            chunk_size = tuning_info["autotune_chunk_size"]
+            runtime_info.update(tuning_info)
+        chunk_size = chunk_size or 1
+        runtime_info["num_workers"] = num_workers
+        runtime_info["chunk_size"] = chunk_size
+
+        placement_plan = None
+        if worker_placement is not None or worker_cpu_sets is not None:
+            placement_plan = placement.plan_placement(worker_placement or "pinned", num_workers or len(placement.get_usable_cpus()), worker_cpu_sets)
+        reference_nodes = placement.assign_shards(reference_count, placement_plan) if placement_plan is not None else [None] * reference_count
+
+        if executor_type != "process":
+            original_cpus = None
+            loading_node = None
+            try:
+                for reference_id, idx, segment_id in tasks:
+                    #decode the shard of a NUMA node on that node, so that its pages are allocated there
+                    if placement_plan is not None and placement_plan["placement"] == "numa" and reference_nodes[reference_id] != loading_node:
+                        loading_node = reference_nodes[reference_id]
+                        previous_cpus = placement.bind_calling_thread(placement_plan["node_cpus"][loading_node])
+                        original_cpus = original_cpus or previous_cpus
+                    grp = f[idx] if segment_id is None else f[idx]["segments"][segment_id]
+                    loaded_references[(idx, segment_id)] = (f[idx].attrs["name"], load_reference(grp, kernel))
+            finally:
+                if original_cpus is not None:
+                    placement.bind_calling_thread(original_cpus)
+
+    if executor_type == "fork":
+        global _preloaded_references, _preloaded_queries
+        _preloaded_references = loaded_references
+        _preloaded_queries = (query_kmer_sets, window_sizes)
+        runtime_info["preload_time"] = time.perf_counter() - calculate_intersection_sizes_start
+
+    #calculate intersection sizes in parallel, with one pool per NUMA node of the placement
+    try:
+        with contextlib.ExitStack() as stack:
+            executors = {}
+            for node, cpu_sets in (placement_plan["nodes"] if placement_plan is not None else {None: None}).items():
+                if cpu_sets is None:
+                    executors[node] = stack.enter_context(pool_type(max_workers=num_workers, **pool_options))
+                    continue
+                mp_context = pool_options.get("mp_context", multiprocessing.get_context()) if pool_type is ProcessPoolExecutor else None
+                executors[node] = stack.enter_context(pool_type(max_workers=len(cpu_sets), initializer=placement.pin_worker,
+                                                                initargs=(placement.create_cpu_set_queue(cpu_sets, mp_context),), **pool_options))
+
+            #every chunk of chunk_size tasks of a node is sent to a worker at once
+            futures = {}
+            for node, executor in executors.items():
+                node_tasks = [task for task in tasks if reference_nodes[task[0]] == node]
+                for start in range(0, len(node_tasks), chunk_size):
+                    calls = []
+                    for reference_id, idx, segment_id in node_tasks[start:start + chunk_size]:
+                        query_ids = candidate_query_ids[reference_id]
+                        if executor_type == "fork":
+                            calls.append((process_preloaded_reference, (idx, segment_id, query_ids)))
+                            continue
+                        task_kmer_sets = [query_kmer_sets[query_id] for query_id in query_ids]
+                        task_window_sizes = [window_sizes[query_id] for query_id in query_ids]
+                        if executor_type == "thread":
+                            lineage_name, reference_data = loaded_references[(idx, segment_id)]
+                            calls.append((process_loaded_reference, (idx, lineage_name, reference_data, task_kmer_sets, task_window_sizes)))
+                        else:
+                            calls.append((process_reference, (idx, result_path, task_kmer_sets, task_window_sizes, kernel, segment_id)))
+                    futures[executor.submit(process_task_chunk, calls)] = [task[0] for task in node_tasks[start:start + chunk_size]]
+
+            last_flush_time = time.perf_counter()
+            for future in as_completed(futures):
+                for reference_id, (idx, lineage_name, sizes) in zip(futures[future], future.result()):
+                    query_ids = candidate_query_ids[reference_id]
+                    intersection_sizes[query_ids, reference_id] = np.maximum(intersection_sizes[query_ids, reference_id], sizes)
+
+                    remaining_segments[reference_id] -= 1
+                    if checkpoint_data is not None and remaining_segments[reference_id] == 0:
+                        checkpoint.save_column(checkpoint_data, reference_id, query_ids, intersection_sizes[query_ids, reference_id])
+                        if time.perf_counter() - last_flush_time >= checkpoint_interval:
+                            result_matrix.flush_result_matrix(checkpoint_data)
+                            last_flush_time = time.perf_counter()
+
+            if checkpoint_data is not None:
+                result_matrix.flush_result_matrix(checkpoint_data)
+
+            #measured while the workers still hold their data
+            worker_pids = [process.pid for process in multiprocessing.active_children()] if executor_type != "thread" else []
+            memory_usage.record_memory_usage(worker_pids, runtime_info)
+            if placement_plan is not None:
+                placement.record_placement(placement_plan, reference_nodes, worker_pids, runtime_info)
+    finally:
+        if executor_type == "fork":
+            _preloaded_references = None
+            _preloaded_queries = None
+    del loaded_references
+
+    calculate_intersection_sizes_end = time.perf_counter()
+    calculate_intersection_sizes_time = calculate_intersection_sizes_end - calculate_intersection_sizes_start
+    average_reference_processing_time = calculate_intersection_sizes_time / reference_count
+    print(f"Calculating intersection sizes took {calculate_intersection_sizes_time} seconds.")
 
+    if length_bucket_width is not None and length_bucket_exact:
+        recheck_length_bucket_winners(result_path, query_data, intersection_sizes, candidate_query_ids, window_sizes, kernel, runtime_info)
 
-    query_names = query_data["query_names"]
-    query_kmer_sets = query_data["kmer_sets"]
-    query_sequence_lengths = query_data["sequence_lengths"]
+    record_confidence_error(query_data, intersection_sizes, candidate_query_ids, bounds, runtime_info)
+    intersection_sizes, reference_names = expand_reference_groups(result_path, query_data, intersection_sizes, reference_names, runtime_info)
 
-    intersection_sizes = [[] for _ in range(len(query_names))]
-    reference_names = []
+    result = build_result(query_data, intersection_sizes.tolist())
+
+    runtime_info["calculate_intersection_sizes_time"] = calculate_intersection_sizes_time
+    runtime_info["average_reference_processing_time"] = average_reference_processing_time
+
+    if checkpoint_data is not None:
+        checkpoint.remove_checkpoint(checkpoint_data)
+        runtime_info["checkpoint_path"] = str(checkpoint_data["path"])
+        runtime_info["resumed_reference_count"] = len(restored)
+
+    return result, reference_names, runtime_info
+
+def get_intersection_sizes_out_of_core(reference_path: Path, query_path: Path, result_matrix_path: Path | None = None, orient_query: bool = False,
+                                       redo: bool = False, num_workers: int = None, index_options: dict | None = None, kernel: str = "exact",
+                                       stop_kmer_percentile: float | None = None, stop_kmer_cap: int | None = None, query_sample_size: int | None = None,
+                                       query_sample_fraction: float | None = None, length_bucket_width: int | None = None,
+                                       deduplicate_queries: bool = False, query_records=None, result_tile_shape=result_matrix.DEFAULT_TILE_SHAPE):
+    """
+    Computes k-mer intersection sizes in parallel into a disk-backed
+    result matrix (see result_matrix).
+
+    Every reference column is written to the memory-mapped matrix as soon
+    as all segments of the reference are matched and is then flagged as
+    completed. If the matrix directory holds a matrix of the same
+    matching run (index hash and query-set hash, see checkpoint), completed references are skipped, so that an
+    interrupted run resumes where it stopped. The query × reference
+    matrix is never held in memory; the result is read from disk one tile
+    row at a time while it is iterated.
+
+    All pairs are matched, so the options that plan matching on a dense
+    matrix (prefilter, sketch screening, clade pruning, exact length
+    bucket re-checks) are not available.
+
+    Parameters
+    ----------
+    reference_path : pathlib.Path
+        Path to the reference FASTA file.
+    query_path : pathlib.Path
+        Path to the query FASTA file.
+    result_matrix_path : pathlib.Path, optional
+        Directory of the result matrix. Defaults to the query path with
+        the suffix "_matrix".
+    orient_query : bool, optional
+        If True, query sequences are oriented prior to matching.
+    redo : bool, optional
+        If True, existing reference lookup data are recomputed.
+    num_workers : int, optional
+        Number of worker processes.
+    index_options : dict, optional
+        Keyword arguments forwarded to parse_reference_fasta.
+    kernel : str, optional
+        Matching kernel (see get_intersection_sizes).
+    stop_kmer_percentile : float, optional
+        Query-time stop k-mer percentile (see apply_stop_kmers).
+    stop_kmer_cap : int, optional
+        Query-time stop k-mer cap (see apply_stop_kmers).
+    query_sample_size : int, optional
+        Fixed query k-mer sample size (see apply_query_sampling).
+    query_sample_fraction : float, optional
+        Query k-mer sample fraction (see apply_query_sampling).
+    length_bucket_width : int, optional
+        Length bucket width (see assign_length_buckets).
+    deduplicate_queries : bool, optional
+        If True, identical query sequences are matched only once.
+    query_records : iterable of Bio.SeqRecord.SeqRecord, optional
+        If given, these records are matched instead of the queries in
+        query_path (see streaming).
+    result_tile_shape : tuple of int, optional
+        Number of queries and references per tile of the result matrix.
+
+    Returns
+    -------
+    tuple
+        A tuple containing:
+        - result : result_matrix.ResultRows
+            Sequence of tuples of the form
+            (query_name, query_kmer_set_size, intersection_sizes),
+            read from the result matrix while iterating.
+        - reference_names : list of str
+            Names of the reference sequences.
+        - runtime_info : dict
+            Dictionary containing runtime measurements for the
+            individual processing steps.
+    """
+    result_path, query_data, runtime_info = prepare_matching(reference_path, query_path, orient_query, redo, index_options, stop_kmer_percentile, stop_kmer_cap,
+                                                             query_sample_size, query_sample_fraction, deduplicate_queries, query_records)
+    if result_matrix_path is None:
+        result_matrix_path = query_path.with_name(query_path.stem + "_matrix")
+
+    query_kmer_sets = query_data["kmer_sets"]
+    query_count = len(query_kmer_sets)
 
     calculate_intersection_sizes_start = time.perf_counter()
-    reference_count = -1
 
-    #calculate intersection sizes in parallel
+    with h5py.File(result_path, "r") as f:
+        reference_ids = get_reference_ids(f)
+        reference_count = len(reference_ids)
+        reference_names = get_reference_names(f, reference_ids)
+        window_sizes = assign_length_buckets(query_data, length_bucket_width, runtime_info)
+        record_kernel_info(query_data, window_sizes, kernel, f.attrs.get("block_size", -1), runtime_info)
+        record_segment_info(f, window_sizes, runtime_info)
+        segment_ids = [list(f[idx]["segments"].keys()) if "segments" in f[idx] else [None] for idx in reference_ids]
+        key = f"{checkpoint.get_index_hash(f, result_path)}_{checkpoint.hash_query_set(query_data, window_sizes, kernel)}"
+
+    matrix = result_matrix.open_result_matrix(result_matrix_path, query_count, reference_count, key, result_tile_shape)
+    completed = set(result_matrix.get_completed_references(matrix).tolist())
+    if completed:
+        print(f"Resuming with {len(completed)} of {reference_count} references completed.")
+
     with ProcessPoolExecutor(max_workers=num_workers) as executor:
-        futures = []
-        with h5py.File(result_path, "r") as f:
-            reference_count = len(f.keys())
-            for idx in f.keys():
-                if idx != "kmer_occurrence_count":
-                    futures.append(executor.submit(
-                        process_reference, idx, result_path, query_kmer_sets, query_sequence_lengths
-                    ))
-
-        for future in futures:
+        future_references = {}
+        remaining_segments = {}
+        for reference_id, idx in enumerate(reference_ids):
+            if reference_id in completed:
+                continue
+            remaining_segments[reference_id] = len(segment_ids[reference_id])
+            for segment_id in segment_ids[reference_id]:
+                future = executor.submit(process_reference, idx, result_path, query_kmer_sets, window_sizes, kernel, segment_id)
+                future_references[future] = reference_id
+
+        #columns are only held until all segments of their reference are reduced
+        columns = {}
+        for future in as_completed(future_references):
+            reference_id = future_references[future]
             idx, lineage_name, sizes = future.result()
-            reference_names.append(lineage_name)
-            for query_id, size in enumerate(sizes):
-                intersection_sizes[query_id].append(size)
+            column = columns.setdefault(reference_id, np.zeros(query_count, dtype=np.int64))
+            np.maximum(column, sizes, out=column)
+            remaining_segments[reference_id] -= 1
+            if remaining_segments[reference_id] == 0:
+                result_matrix.write_column(matrix, reference_id, columns.pop(reference_id))
+                result_matrix.mark_completed(matrix, reference_id)
 
     calculate_intersection_sizes_end = time.perf_counter()
     calculate_intersection_sizes_time = calculate_intersection_sizes_end - calculate_intersection_sizes_start
-    average_reference_processing_time = calculate_intersection_sizes_time / reference_count
     print(f"Calculating intersection sizes took {calculate_intersection_sizes_time} seconds.")
 
-    result = []
+    groups, reference_names = load_reference_groups(result_path, query_data, reference_names, runtime_info)
+    result = result_matrix.ResultRows(matrix, query_data, groups)
 
-    for query_id in range(len(query_names)):
-        result.append((query_names[query_id], len(query_kmer_sets[query_id]), intersection_sizes[query_id]))
+    runtime_info["calculate_intersection_sizes_time"] = calculate_intersection_sizes_time
+    runtime_info["average_reference_processing_time"] = calculate_intersection_sizes_time / max(reference_count, 1)
+    runtime_info["result_matrix_path"] = str(result_matrix_path)
+    runtime_info["result_tile_shape"] = list(matrix["tile_shape"])
+    runtime_info["result_matrix_bytes"] = matrix["tiles"].nbytes
+    runtime_info["resumed_reference_count"] = len(completed)
 
-    runtime_info = {
-        "reference_parse_time": reference_parse_time,
-        "query_parse_time": query_parse_time,
-        "orient_queries_time": orient_queries_time,
-        "calculate_intersection_sizes_time": calculate_intersection_sizes_time,
-        "average_reference_processing_time": average_reference_processing_time,
-    }
+    return result, reference_names, runtime_info
+
+def get_intersection_sizes_global(reference_path: Path, query_path: Path, orient_query: bool = False, redo: bool = False, index_options: dict | None = None,
+                                  query_records=None):
+    """
+    Computes k-mer intersection sizes between all query sequences and
+    reference sequences using the global cross-reference inverted index.
+
+    The global index is loaded once. For each query, the occurrences of
+    all query k-mers are fetched in one pass and only the references that
+    share at least one k-mer with the query are evaluated; all other
+    intersection sizes are zero. The result equals the one of
+    get_intersection_sizes.
+
+    Parameters
+    ----------
+    reference_path : pathlib.Path
+        Path to the reference FASTA file.
+    query_path : pathlib.Path
+        Path to the query FASTA file.
+    orient_query : bool, optional
+        If True, query sequences are oriented prior to matching.
+    redo : bool, optional
+        If True, existing reference lookup data are recomputed.
+    index_options : dict, optional
+        Keyword arguments forwarded to parse_reference_fasta. The global
+        index is always built.
+    query_records : iterable of Bio.SeqRecord.SeqRecord, optional
+        If given, these records are matched instead of the queries in
+        query_path (see streaming).
 
-    return result, reference_names, runtime_info
\ No newline at end of file
+    Returns
+    -------
+    tuple
+        A tuple containing:
+        - result : list of tuples
+            For each query, a tuple of the form
+            (query_name, query_kmer_set_size, intersection_sizes),
+            where intersection_sizes is a list of k-mer intersection
+            sizes with all reference sequences.
+        - reference_names : list of str
+            Names of the reference sequences.
+        - runtime_info : dict
+            Dictionary containing runtime measurements for the
+            individual processing steps.
+    """
+    index_options = {**(index_options or {}), "build_global_index": True}
+
+    result_path, query_data, runtime_info = prepare_matching(reference_path, query_path, orient_query, redo, index_options, query_records=query_records)
+
+    query_kmer_sets = query_data["kmer_sets"]
+    query_sequence_lengths = query_data["sequence_lengths"]
+
+    calculate_intersection_sizes_start = time.perf_counter()
+
+    index = global_index.load_global_index(result_path)
+    reference_names = index["reference_names"]
+
+    intersection_sizes = []
+    for query_id, kmer_set in enumerate(query_kmer_sets):
+        sizes = global_index.calculate_query_intersection_sizes(index, kmer_set, query_sequence_lengths[query_id])
+        intersection_sizes.append(sizes.tolist())
+
+    calculate_intersection_sizes_end = time.perf_counter()
+    calculate_intersection_sizes_time = calculate_intersection_sizes_end - calculate_intersection_sizes_start
+    print(f"Calculating intersection sizes took {calculate_intersection_sizes_time} seconds.")
+
+    runtime_info["calculate_intersection_sizes_time"] = calculate_intersection_sizes_time
+    runtime_info["average_reference_processing_time"] = calculate_intersection_sizes_time / max(len(reference_names), 1)
+
+    intersection_sizes = np.array(intersection_sizes, dtype=np.int64).reshape(len(query_kmer_sets), len(reference_names))
+    intersection_sizes, reference_names = expand_reference_groups(result_path, query_data, intersection_sizes, reference_names, runtime_info)
+    result = build_result(query_data, intersection_sizes.tolist())
+
+    return result, reference_names, runtime_info
@@ -0,0 +1,213 @@
+"""
+placement.py
+
+Description
+-----------
+Module for placing the pool workers of get_intersection_sizes_parallel
+on CPU cores and NUMA nodes.
+
+Without a placement, workers are not bound to cores, so that the
+scheduler may move them to another socket, away from the memory holding
+their data. Two placements are supported:
+
+- "pinned": every worker is bound to one core, or to one of the
+  explicitly given core sets, with os.sched_setaffinity.
+- "numa": the workers are distributed over the NUMA nodes in proportion
+  to their usable cores and each node runs its own pool of workers
+  bound to its cores. The references are split into one contiguous
+  shard per node in proportion to the workers of the node. Since Linux
+  places a page on the node of the thread first writing it, a shard is
+  decoded on the node that matches it: by the pinned workers themselves
+  (process executor) or by the calling process temporarily bound to the
+  node (thread and fork executors).
+
+On a machine with a single NUMA node, "numa" degrades to "pinned". The
+NUMA topology is read from /sys/devices/system/node; binding requires
+os.sched_setaffinity, i.e. Linux.
+"""
+import os
+import queue
+from pathlib import Path
+
+PLACEMENTS = ("pinned", "numa")
+
+NODE_DIR = Path("/sys/devices/system/node")
+
+def parse_cpu_list(cpu_list: str) -> list[int]:
+    """
+    Parses a kernel CPU list such as "0-3,8,10-11".
+    """
+    cpus = []
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        start, _, stop = part.partition("-")
+        cpus.extend(range(int(start), int(stop or start) + 1))
+    return cpus
+
+def get_usable_cpus() -> list[int]:
+    """
+    Returns the cores the calling process may run on.
+    """
+    return sorted(os.sched_getaffinity(0))
+
+def get_numa_nodes() -> dict[int, list[int]]:
+    """
+    Returns the usable cores of every NUMA node. Nodes without usable
+    cores are omitted; without NUMA information, all usable cores form
+    node 0.
+    """
+    usable_cpus = set(get_usable_cpus())
+    nodes = {}
+    for node_path in sorted(NODE_DIR.glob("node[0-9]*"), key=lambda path: int(path.name[4:])):
+        try:
+            cpus = [cpu for cpu in parse_cpu_list((node_path / "cpulist").read_text()) if cpu in usable_cpus]
+        except OSError:
+            continue
+        if cpus:
+            nodes[int(node_path.name[4:])] = cpus
+    if not nodes:
+        nodes = {0: sorted(usable_cpus)}
+    return nodes
+
+def get_node(cpu: int, nodes: dict[int, list[int]]) -> int:
+    """
+    Returns the NUMA node of a core, or the first node if the core is
+    not usable.
+    """
+    for node, cpus in nodes.items():
+        if cpu in cpus:
+            return node
+    return next(iter(nodes))
+
+def distribute_workers(num_workers: int, node_cpu_counts: dict[int, int]) -> dict[int, int]:
+    """
+    Distributes num_workers workers over the nodes in proportion to
+    their core counts (largest remainder). Nodes without workers are
+    omitted.
+    """
+    total_cpu_count = sum(node_cpu_counts.values())
+    shares = {node: num_workers * cpu_count / total_cpu_count for node, cpu_count in node_cpu_counts.items()}
+    worker_counts = {node: int(share) for node, share in shares.items()}
+    for node in sorted(shares, key=lambda node: shares[node] - worker_counts[node], reverse=True)[:num_workers - sum(worker_counts.values())]:
+        worker_counts[node] += 1
+    return {node: worker_count for node, worker_count in worker_counts.items() if worker_count > 0}
+
+def plan_placement(placement: str, num_workers: int, worker_cpu_sets: list[list[int]] | None = None) -> dict:
+    """
+    Plans the cores of every worker.
+
+    Parameters
+    ----------
+    placement : str
+        One of PLACEMENTS.
+    num_workers : int
+        Number of workers.
+    worker_cpu_sets : list of list of int, optional
+        Explicit core set of every worker, reused cyclically if there are
+        fewer sets than workers. With "numa", a set belongs to the node
+        of its first core.
+
+    Returns
+    -------
+    dict
+        Dictionary with the effective placement ("pinned" on a single
+        NUMA node), the number of NUMA nodes, the core sets of the
+        workers of every node ("nodes") and the cores of every node
+        ("node_cpus").
+
+    Raises
+    ------
+    ValueError
+        If the placement is unknown or binding is unsupported.
+    """
+    if placement not in PLACEMENTS:
+        raise ValueError(f"Unknown worker placement '{placement}', expected one of {PLACEMENTS}")
+    if not hasattr(os, "sched_setaffinity"):
+        raise ValueError("Worker placement requires os.sched_setaffinity, which is unavailable on this platform")
+
+    numa_nodes = get_numa_nodes()
+    if len(numa_nodes) == 1:
+        placement = "pinned"
+
+    nodes = {}
+    if worker_cpu_sets is not None:
+        for worker_id in range(num_workers):
+            cpu_set = sorted(worker_cpu_sets[worker_id % len(worker_cpu_sets)])
+            node = get_node(cpu_set[0], numa_nodes) if placement == "numa" else next(iter(numa_nodes))
+            nodes.setdefault(node, []).append(cpu_set)
+    elif placement == "pinned":
+        cpus = [cpu for node_cpus in numa_nodes.values() for cpu in node_cpus]
+        nodes[next(iter(numa_nodes))] = [[cpus[worker_id % len(cpus)]] for worker_id in range(num_workers)]
+    else:
+        for node, worker_count in distribute_workers(num_workers, {node: len(cpus) for node, cpus in numa_nodes.items()}).items():
+            nodes[node] = [[numa_nodes[node][worker_id % len(numa_nodes[node])]] for worker_id in range(worker_count)]
+
+    return {
+        "placement": placement,
+        "numa_node_count": len(numa_nodes),
+        "nodes": nodes,
+        "node_cpus": {node: sorted({cpu for cpu_set in node_cpu_sets for cpu in cpu_set}) for node, node_cpu_sets in nodes.items()},
+    }
+
+def assign_shards(reference_count: int, placement_plan: dict) -> list[int]:
+    """
+    Returns the node of every reference, splitting the references into
+    contiguous shards in proportion to the workers of each node.
+    """
+    nodes = list(placement_plan["nodes"])
+    worker_counts = [len(placement_plan["nodes"][node]) for node in nodes]
+    total_worker_count = sum(worker_counts)
+    reference_nodes = []
+    start = 0
+    for position, node in enumerate(nodes):
+        stop = reference_count * sum(worker_counts[:position + 1]) // total_worker_count
+        reference_nodes.extend([node] * (stop - start))
+        start = stop
+    return reference_nodes
+
+def create_cpu_set_queue(cpu_sets: list[list[int]], mp_context=None):
+    """
+    Returns a queue holding one core set per worker, read by pin_worker.
+    With mp_context, the queue is shared with worker processes,
+    otherwise with threads.
+    """
+    cpu_set_queue = mp_context.Queue() if mp_context is not None else queue.Queue()
+    for cpu_set in cpu_sets:
+        cpu_set_queue.put(cpu_set)
+    return cpu_set_queue
+
+def pin_worker(cpu_set_queue):
+    """
+    Initializer of the pool workers, binding the worker to the next core
+    set of the queue. In a thread, only the calling thread is bound.
+    """
+    os.sched_setaffinity(0, cpu_set_queue.get())
+
+def bind_calling_thread(cpus) -> set[int]:
+    """
+    Binds the calling thread to cpus and returns its previous cores.
+    """
+    previous_cpus = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, cpus)
+    return previous_cpus
+
+def record_placement(placement_plan: dict, reference_nodes: list[int], worker_pids, runtime_info: dict):
+    """
+    Adds the planned placement, the shard sizes and the cores the worker
+    processes are actually bound to to runtime_info. The cores of
+    threads are not measured.
+    """
+    runtime_info["worker_placement"] = placement_plan["placement"]
+    runtime_info["numa_node_count"] = placement_plan["numa_node_count"]
+    runtime_info["worker_cpu_sets"] = {node: cpu_sets for node, cpu_sets in placement_plan["nodes"].items()}
+    runtime_info["shard_reference_counts"] = {node: reference_nodes.count(node) for node in placement_plan["nodes"]}
+    if not worker_pids:
+        return
+    worker_affinity = []
+    for pid in worker_pids:
+        try:
+            worker_affinity.append(sorted(os.sched_getaffinity(pid)))
+        except OSError:
+            pass
+    runtime_info["worker_cpu_affinity"] = sorted(worker_affinity)
@@ -0,0 +1,309 @@
+"""
+position_encoding.py
+
+Description
+-----------
+Module for storing and loading the per-reference k-mer position lists.
+
+The k-mer positions of a reference are kept as a flattened array
+(flat_data) together with an offset array that delimits the position
+bucket of each k-mer. Three storage encodings are supported:
+
+- "gzip": flat_data and offsets are stored as gzip-compressed uint32.
+- "uint16": positions are stored uncompressed as uint16 if the reference
+  is shorter than 65,536 bp, otherwise as uint32; the ids and sizes of
+  the non-empty buckets, or the sizes of all buckets if most are
+  non-empty, replace the offset array. Decoding is a plain copy, but
+  the uint32 positions of long references take more space than gzip.
+- "delta_packed": positions within each bucket are delta encoded and
+  bit packed with a fixed width per bucket; bucket sizes, first
+  positions and widths are bit packed as well.
+"""
+import numpy as np
+import h5py
+
+ENCODINGS = ("gzip", "uint16", "delta_packed")
+
+#header of a delta_packed dataset: bucket count, three field widths and five stream lengths as uint32
+HEADER_BYTES = 9 * 4
+
+def minimal_unsigned_dtype(max_value: int):
+    """
+    Returns the smallest unsigned integer dtype that can hold max_value.
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+def bit_lengths(values: np.ndarray) -> np.ndarray:
+    """
+    Computes the number of bits required to represent each value.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    widths = np.zeros(values.shape, dtype=np.uint8)
+    remaining = values.copy()
+    while np.any(remaining):
+        nonzero = remaining > 0
+        widths[nonzero] += 1
+        remaining >>= np.uint64(1)
+    return widths
+
+def pack_bits(values: np.ndarray, widths: np.ndarray) -> np.ndarray:
+    """
+    Concatenates the lowest widths[i] bits of each values[i] into a
+    little-endian bit stream.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    widths = np.asarray(widths, dtype=np.int64)
+    bit_offsets = np.cumsum(widths) - widths
+    bits = np.zeros(int(widths.sum()), dtype=np.uint8)
+
+    max_width = int(widths.max()) if len(widths) > 0 else 0
+    for j in range(max_width):
+        selected = widths > j
+        bits[bit_offsets[selected] + j] = (values[selected] >> np.uint64(j)) & np.uint64(1)
+
+    return np.packbits(bits, bitorder="little")
+
+def unpack_bits(packed: np.ndarray, widths, count: int | None = None) -> np.ndarray:
+    """
+    Reads consecutive values of the given bit widths (at most 56 bits
+    each) from a little-endian bit stream.
+
+    widths is either an array with one width per value or a single
+    fixed width, in which case count values are read. The values are
+    returned in the smallest unsigned dtype covering the widest value
+    and its bit shift.
+    """
+    if np.isscalar(widths):
+        width = int(widths)
+        if width == 0 or count == 0:
+            return np.zeros(count, dtype=np.uint64)
+        bit_offsets = np.arange(count, dtype=np.int64) * width
+        max_width = width
+    else:
+        if len(widths) == 0:
+            return np.zeros(0, dtype=np.uint64)
+        bit_offsets = np.zeros(len(widths), dtype=np.int64)
+        np.cumsum(widths[:-1], out=bit_offsets[1:])
+        max_width = int(widths.max())
+
+    #read each value from the smallest little-endian word that covers it
+    word_bytes = 1
+    while word_bytes * 8 < max_width + 7:
+        word_bytes *= 2
+    word_dtype = np.dtype(f"<u{word_bytes}")
+
+    #overlapping unaligned view that starts a word at every byte
+    padded = np.concatenate((packed, np.zeros(word_bytes, dtype=np.uint8)))
+    word_view = np.ndarray(shape=(len(padded) - word_bytes + 1,), dtype=word_dtype, buffer=padded, strides=(1,))
+    words = np.take(word_view, bit_offsets >> 3)
+    shifts = (bit_offsets & 7).astype(word_dtype)
+
+    mask_table = ((np.ones(1, dtype=np.uint64) << np.arange(word_bytes * 8 - 6, dtype=np.uint64)) - np.uint64(1)).astype(word_dtype)
+    if np.isscalar(widths):
+        mask = mask_table[width]
+    else:
+        mask = mask_table[widths]
+
+    words >>= shifts
+    words &= mask
+    return words
+
+def encode_delta_packed(flat_data: np.ndarray, offsets: np.ndarray):
+    """
+    Encodes k-mer position buckets using delta encoding and fixed-width
+    bit packing per bucket.
+
+    Non-empty buckets are marked in a bitmap. For each of them the
+    bucket size and the first position are stored with a fixed width.
+    All following positions are stored as differences to their
+    predecessor, bit packed with the width of the largest difference
+    within the bucket.
+
+    Parameters
+    ----------
+    flat_data : numpy.ndarray
+        Flattened array of k-mer positions, sorted within each bucket.
+    offsets : numpy.ndarray
+        Offset array defining k-mer position ranges in flat_data.
+
+    Returns
+    -------
+    numpy.ndarray
+        uint8 array holding a small header with the field widths and
+        stream lengths, followed by the concatenated bit streams (bucket
+        bitmap, sizes, first positions, widths and differences).
+    """
+    flat_data = np.asarray(flat_data, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    bucket_sizes = np.diff(offsets)
+    nonempty = bucket_sizes > 0
+    nonempty_sizes = bucket_sizes[nonempty]
+    starts = offsets[:-1][nonempty]
+
+    #differences to the preceding position, zero at bucket starts
+    deltas = np.zeros(len(flat_data), dtype=np.int64)
+    deltas[1:] = np.diff(flat_data)
+    deltas[starts] = 0
+
+    if len(starts) > 0:
+        bucket_widths = bit_lengths(np.maximum.reduceat(deltas, starts))
+    else:
+        bucket_widths = np.zeros(0, dtype=np.uint8)
+    multi_widths = bucket_widths[nonempty_sizes > 1]
+
+    is_start = np.zeros(len(flat_data), dtype=bool)
+    is_start[starts] = True
+
+    size_width = int(bit_lengths(nonempty_sizes.max(initial=1) - 1))
+    first_width = int(bit_lengths(flat_data.max(initial=0)))
+    width_width = int(bit_lengths(multi_widths.max(initial=0)))
+
+    streams = [
+        np.packbits(nonempty, bitorder="little"),
+        pack_bits(nonempty_sizes - 1, np.full(len(nonempty_sizes), size_width)),
+        pack_bits(flat_data[starts], np.full(len(starts), first_width)),
+        pack_bits(multi_widths, np.full(len(multi_widths), width_width)),
+        pack_bits(deltas[~is_start], np.repeat(bucket_widths, nonempty_sizes - 1)),
+    ]
+    #fixed-size header: bucket count, field widths and stream lengths
+    header = np.array([len(bucket_sizes), size_width, first_width, width_width] + [len(stream) for stream in streams], dtype="<u4")
+
+    return np.concatenate([header.view(np.uint8)] + streams).astype(np.uint8)
+
+def decode_delta_packed(packed: np.ndarray):
+    """
+    Decodes delta encoded and bit-packed k-mer position buckets.
+
+    Parameters
+    ----------
+    packed : numpy.ndarray
+        uint8 array as returned by encode_delta_packed.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (flat_data, offsets) as uint32 arrays.
+    """
+    header = packed[:HEADER_BYTES].view("<u4").astype(np.int64)
+    bucket_count, size_width, first_width, width_width = (int(value) for value in header[:4])
+    stream_ends = np.cumsum(header[4:])
+    bucket_mask, size_stream, first_stream, width_stream, delta_stream = np.split(packed[HEADER_BYTES:], stream_ends[:-1])
+
+    nonempty = np.flatnonzero(np.unpackbits(bucket_mask, count=bucket_count, bitorder="little"))
+    nonempty_count = len(nonempty)
+
+    nonempty_sizes = unpack_bits(size_stream, size_width, nonempty_count).astype(np.int64) + 1
+    bucket_first = unpack_bits(first_stream, first_width, nonempty_count).astype(np.uint32)
+    multi = nonempty_sizes > 1
+    bucket_widths = np.zeros(nonempty_count, dtype=np.uint8)
+    bucket_widths[multi] = unpack_bits(width_stream, width_width, int(np.count_nonzero(multi)))
+
+    #offsets only change after non-empty buckets
+    ends = np.cumsum(nonempty_sizes)
+    starts = ends - nonempty_sizes
+    offsets = np.zeros(bucket_count + 1, dtype=np.uint32)
+    offsets[nonempty + 1] = ends
+    np.maximum.accumulate(offsets, out=offsets)
+    if nonempty_count == 0:
+        return np.zeros(0, dtype=np.uint32), offsets
+
+    #zero-width slots at bucket starts keep the differences aligned with their positions
+    value_widths = np.repeat(bucket_widths, nonempty_sizes)
+    value_widths[starts] = 0
+    values = unpack_bits(delta_stream, value_widths).astype(np.uint32, copy=False)
+
+    #the slot of a bucket start steps from the last position of the preceding
+    #bucket to its first position, so that one prefix sum (modulo 2**32)
+    #restores all positions
+    cumulative = np.cumsum(values, dtype=np.uint32)
+    bucket_last = bucket_first + (cumulative[ends - 1] - cumulative[starts])
+    values[starts[0]] = bucket_first[0]
+    values[starts[1:]] = bucket_first[1:] - bucket_last[:-1]
+    flat_data = np.cumsum(values, dtype=np.uint32, out=values)
+
+    return flat_data, offsets
+
+def write_positions(grp: h5py.Group, flat_data: np.ndarray, offsets: np.ndarray, sequence_length: int, encoding: str = "gzip"):
+    """
+    Writes the k-mer position lists of one reference into an HDF5 group
+    using the requested encoding.
+
+    Parameters
+    ----------
+    grp : h5py.Group
+        HDF5 group of the reference sequence.
+    flat_data : numpy.ndarray
+        Flattened array of k-mer positions.
+    offsets : numpy.ndarray
+        Offset array defining k-mer position ranges in flat_data.
+    sequence_length : int
+        Length of the reference sequence.
+    encoding : str, optional
+        One of "gzip", "uint16" or "delta_packed".
+
+    Raises
+    ------
+    ValueError
+        If the encoding is unknown.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown index encoding '{encoding}', expected one of {ENCODINGS}")
+
+    grp.attrs["encoding"] = encoding
+
+    if encoding == "gzip":
+        grp.create_dataset("flat_data", data=flat_data, dtype=np.uint32, compression="gzip")
+        grp.create_dataset("offsets", data=offsets, dtype=np.uint32, compression="gzip")
+    elif encoding == "uint16":
+        bucket_sizes = np.diff(np.asarray(offsets, dtype=np.int64))
+        nonempty = np.flatnonzero(bucket_sizes)
+        position_dtype = np.uint16 if sequence_length < 65536 else np.uint32
+        id_dtype = minimal_unsigned_dtype(max(len(bucket_sizes) - 1, 0))
+        size_dtype = minimal_unsigned_dtype(int(bucket_sizes.max(initial=0)))
+        grp.create_dataset("flat_data", data=flat_data, dtype=position_dtype)
+        #sparse buckets are cheaper as (id, size) pairs, dense buckets as one size per k-mer
+        if len(nonempty) * (np.dtype(id_dtype).itemsize + np.dtype(size_dtype).itemsize) < len(bucket_sizes) * np.dtype(size_dtype).itemsize:
+            grp.attrs["bucket_count"] = len(bucket_sizes)
+            grp.create_dataset("bucket_ids", data=nonempty, dtype=id_dtype)
+            grp.create_dataset("bucket_sizes", data=bucket_sizes[nonempty], dtype=size_dtype)
+        else:
+            grp.create_dataset("bucket_sizes", data=bucket_sizes, dtype=size_dtype)
+    else:
+        grp.create_dataset("packed", data=encode_delta_packed(flat_data, offsets), dtype=np.uint8)
+
+def read_positions(grp: h5py.Group):
+    """
+    Loads the k-mer position lists of one reference from an HDF5 group.
+
+    Groups written without an encoding attribute are treated as "gzip".
+
+    Parameters
+    ----------
+    grp : h5py.Group
+        HDF5 group of the reference sequence.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (flat_data, offsets) as uint32 arrays.
+    """
+    encoding = grp.attrs.get("encoding", "gzip")
+
+    if encoding == "gzip":
+        return grp["flat_data"][:], grp["offsets"][:]
+    elif encoding == "uint16":
+        if "bucket_ids" in grp:
+            bucket_sizes = np.zeros(int(grp.attrs["bucket_count"]), dtype=np.uint32)
+            bucket_sizes[grp["bucket_ids"][:]] = grp["bucket_sizes"][:]
+        else:
+            bucket_sizes = grp["bucket_sizes"][:]
+        offsets = np.zeros(len(bucket_sizes) + 1, dtype=np.uint32)
+        np.cumsum(bucket_sizes, out=offsets[1:])
+        return grp["flat_data"][:].astype(np.uint32), offsets
+    elif encoding == "delta_packed":
+        return decode_delta_packed(grp["packed"][:])
+    else:
+        raise ValueError(f"Unknown index encoding '{encoding}' in group {grp.name}")
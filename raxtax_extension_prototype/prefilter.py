@@ -0,0 +1,209 @@
+"""
+prefilter.py
+
+Description
+-----------
+Module for the sparse-matrix candidate prefilter.
+
+Before windowed matching, the unwindowed number of shared k-mers is
+computed for all query–reference pairs at once as the sparse product of
+a query × k-mer matrix and a k-mer × reference presence matrix. Since a
+window cannot contain more shared k-mers than the whole reference, nor
+more k-mers than fit into the window, the capped count is an upper bound
+on the windowed intersection size. Pairs whose bound is zero can be
+skipped exactly; pairs whose bound lies below a configurable floor, or
+that are not among the top-N candidates of a query by bound, are skipped
+approximately.
+"""
+import numpy as np
+from scipy import sparse
+
+import raxtax_extension_prototype.constants as constants
+import raxtax_extension_prototype.prob_fast as prob_fast
+
+def build_query_matrix(query_kmer_sets) -> sparse.csr_matrix:
+    """
+    Builds the binary query × k-mer matrix from the query k-mer sets.
+    """
+    indptr = np.concatenate(([0], np.cumsum([len(kmer_set) for kmer_set in query_kmer_sets]))).astype(np.int64)
+    if len(query_kmer_sets) > 0 and indptr[-1] > 0:
+        indices = np.concatenate([np.asarray(kmer_set, dtype=np.int64) for kmer_set in query_kmer_sets])
+    else:
+        indices = np.zeros(0, dtype=np.int64)
+    data = np.ones(len(indices), dtype=np.int32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(query_kmer_sets), constants.KMER_COUNT))
+
+def build_presence_matrix(indptr: np.ndarray, indices: np.ndarray) -> sparse.csr_matrix:
+    """
+    Builds the binary reference × k-mer presence matrix from its CSR
+    arrays.
+    """
+    data = np.ones(len(indices), dtype=np.int32)
+    return sparse.csr_matrix((data, indices.astype(np.int64), indptr.astype(np.int64)), shape=(len(indptr) - 1, constants.KMER_COUNT))
+
+def calculate_bounds(query_matrix: sparse.csr_matrix, presence_matrix: sparse.csr_matrix, query_sequence_lengths) -> sparse.csr_matrix:
+    """
+    Computes an upper bound on the windowed intersection size of every
+    query–reference pair.
+
+    Parameters
+    ----------
+    query_matrix : scipy.sparse.csr_matrix
+        Binary query × k-mer matrix.
+    presence_matrix : scipy.sparse.csr_matrix
+        Binary reference × k-mer presence matrix.
+    query_sequence_lengths : list of int
+        Lengths of the query sequences, used as window sizes.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Query × reference matrix of bounds. Pairs without shared k-mers
+        are not stored.
+    """
+    bounds = (query_matrix @ presence_matrix.T).tocsr()
+    bounds.sum_duplicates()
+
+    #a window of size w contains at most w - K + 1 k-mers
+    window_capacity = np.maximum(np.asarray(query_sequence_lengths, dtype=np.int64) - constants.K + 1, 0)
+    row_capacity = np.repeat(window_capacity, np.diff(bounds.indptr))
+    bounds.data = np.minimum(bounds.data, row_capacity).astype(np.int64)
+    bounds.eliminate_zeros()
+
+    return bounds
+
+def select_candidates(bounds: sparse.csr_matrix, floor: int, top_n: int | None = None) -> list:
+    """
+    Selects the query–reference pairs that require exact windowed
+    matching.
+
+    Parameters
+    ----------
+    bounds : scipy.sparse.csr_matrix
+        Query × reference matrix of bounds.
+    floor : int
+        Minimum bound of a candidate pair. Pairs with a bound of zero
+        are never candidates.
+    top_n : int, optional
+        If given, only the top_n pairs with the highest bound are kept
+        per query. Ties are broken by reference order.
+
+    Returns
+    -------
+    list of numpy.ndarray
+        For each reference, the ids of the candidate queries.
+    """
+    bounds = bounds.copy()
+    bounds.sort_indices()
+    keep = bounds.data >= max(floor, 1)
+
+    if top_n is not None:
+        for query_id in range(bounds.shape[0]):
+            start, end = bounds.indptr[query_id], bounds.indptr[query_id + 1]
+            ranked = np.argsort(-np.where(keep[start:end], bounds.data[start:end], -1), kind="stable")
+            keep[start + ranked[top_n:]] = False
+
+    selected = sparse.csr_matrix((keep.astype(np.int8), bounds.indices, bounds.indptr), shape=bounds.shape)
+    selected.eliminate_zeros()
+    selected_by_reference = selected.T.tocsr()
+    selected_by_reference.sort_indices()
+
+    return [selected_by_reference.indices[selected_by_reference.indptr[reference_id]:selected_by_reference.indptr[reference_id + 1]]
+            for reference_id in range(selected_by_reference.shape[0])]
+
+def fill_skipped_pairs(bounds: sparse.csr_matrix, fill: str) -> np.ndarray:
+    """
+    Returns the dense query × reference matrix used for pairs that are
+    skipped by the prefilter: the bound itself ("bound") or zero
+    ("zero").
+    """
+    if fill == "bound":
+        return bounds.toarray().astype(np.int64)
+    elif fill == "zero":
+        return np.zeros(bounds.shape, dtype=np.int64)
+    else:
+        raise ValueError(f"Unknown prefilter fill '{fill}', expected 'bound' or 'zero'")
+
+def calculate_reference_scores(match_counts: np.ndarray, changed_counts: np.ndarray, t: int, query_set_size: int) -> np.ndarray:
+    """
+    Computes, for every reference r, the confidence score of r that
+    prob_fast.calculate_confidence_scores returns if the match count of
+    r alone is replaced by changed_counts[r] and all other references
+    keep their match_counts.
+
+    The score of r is P(m_r) / sum_s P(m_s), where every P depends on
+    the multiset of match counts only through C, the product of the PMF
+    prefix sums of all counts. Replacing one count therefore updates log
+    C by one term, so that each reference costs one product of the
+    distinct counts with C instead of a full evaluation.
+    """
+    keys, inverse = np.unique(np.concatenate([match_counts, changed_counts]), return_inverse=True)
+    count_ids = inverse[:len(match_counts)]
+    changed_ids = inverse[len(match_counts):]
+
+    pmfs = np.stack([prob_fast.calculate_pmf(key, query_set_size, t) for key in keys])
+    prefix_sums = np.cumsum(pmfs, axis=1, dtype=np.float64)
+    log_prefix_sums = np.log(prefix_sums)
+    weights = pmfs / prefix_sums
+
+    occurrences = np.bincount(count_ids, minlength=len(keys))
+    log_C = occurrences @ log_prefix_sums
+
+    scores = np.zeros(len(match_counts))
+    for reference_id, (count_id, changed_id) in enumerate(zip(count_ids, changed_ids)):
+        changed_occurrences = occurrences.copy()
+        changed_occurrences[count_id] -= 1
+        changed_occurrences[changed_id] += 1
+        C = np.exp(log_C - log_prefix_sums[count_id] + log_prefix_sums[changed_id])
+        P = weights @ C
+        scores[reference_id] = P[changed_id] / (changed_occurrences @ P)
+    return scores
+
+def calculate_max_confidence_error(intersection_sizes: np.ndarray, bounds: sparse.csr_matrix, refined: np.ndarray, query_set_sizes) -> np.ndarray:
+    """
+    Computes, per query, an upper bound on the change of a confidence
+    score that skipping pairs can cause.
+
+    The windowed intersection size of a skipped pair lies between zero
+    and its bound. The confidence of a reference grows with its own match
+    count and shrinks with the match counts of all other references,
+    since the scores are normalized across references. The confidence of
+    reference r is therefore highest with its own skipped pair at its
+    bound and all other skipped pairs at zero, and lowest with the
+    reverse fill (see calculate_reference_scores). The largest gap
+    between both over all references is reported.
+
+    Parameters
+    ----------
+    intersection_sizes : numpy.ndarray
+        Query × reference matrix of intersection sizes, holding exact
+        values for refined pairs.
+    bounds : scipy.sparse.csr_matrix
+        Query × reference matrix of bounds.
+    refined : numpy.ndarray
+        Boolean query × reference matrix marking the pairs matched
+        exactly.
+    query_set_sizes : list of int
+        Sizes of the query k-mer sets.
+
+    Returns
+    -------
+    numpy.ndarray
+        Maximum confidence error of each query.
+    """
+    max_errors = np.zeros(intersection_sizes.shape[0])
+
+    for query_id, query_set_size in enumerate(query_set_sizes):
+        query_bounds = bounds[query_id].toarray().ravel()
+        skipped = ~refined[query_id] & (query_bounds > 0)
+        if not np.any(skipped):
+            continue
+
+        t = query_set_size // 2
+        lower_fill = np.where(skipped, 0, intersection_sizes[query_id])
+        upper_fill = np.where(skipped, query_bounds, intersection_sizes[query_id])
+        highest_scores = calculate_reference_scores(lower_fill, upper_fill, t, query_set_size)
+        lowest_scores = calculate_reference_scores(upper_fill, lower_fill, t, query_set_size)
+        max_errors[query_id] = np.max(highest_scores - lowest_scores)
+
+    return max_errors
@@ -0,0 +1,46 @@
+"""
+query_sampling.py
+
+Description
+-----------
+Module for deterministic subsampling of query k-mer sets.
+
+Each query k-mer set is reduced to the k-mers with the smallest values
+of a fixed hash (see sketch.KMER_HASHES), either to a fixed sample size
+or to a fraction of the set. Since the selection depends on the k-mers
+only, the sample is reproducible across runs and machines, and a k-mer
+sampled in one query is sampled in every query that keeps at least as
+many k-mers with smaller hashes.
+
+The sampled set replaces the query k-mer set during matching, so match
+counts and the query set size passed to
+prob_fast.calculate_confidence_scores both refer to the sample.
+"""
+import math
+import numpy as np
+
+import raxtax_extension_prototype.sketch as sketch
+
+def get_sample_size(set_size: int, sample_size: int | None = None, sample_fraction: float | None = None) -> int:
+    """
+    Returns the number of k-mers kept from a set of set_size k-mers.
+    If both a fixed size and a fraction are given, the smaller sample is
+    used. At least one k-mer is kept from non-empty sets.
+    """
+    kept = set_size
+    if sample_size is not None:
+        kept = min(kept, sample_size)
+    if sample_fraction is not None:
+        kept = min(kept, math.ceil(set_size * sample_fraction))
+    return max(kept, min(set_size, 1))
+
+def subsample_kmer_set(kmer_set, sample_size: int) -> list[int]:
+    """
+    Returns the sample_size k-mers of kmer_set with the smallest hashes,
+    in ascending k-mer order.
+    """
+    kmer_set = np.asarray(kmer_set, dtype=np.int64)
+    if sample_size >= len(kmer_set):
+        return kmer_set.tolist()
+    order = np.argsort(sketch.KMER_HASHES[kmer_set], kind="stable")
+    return np.sort(kmer_set[order[:sample_size]]).tolist()
@@ -0,0 +1,300 @@
+"""
+reference_index.py
+
+Description
+-----------
+Module providing a lookup table that is opened once and reused for
+matching many query batches.
+
+The path-based drivers (see parser_short_long) derive the lookup table
+path, parse the query FASTA file, open a worker pool and tear everything
+down on every call. A ReferenceIndex instead decodes all references once
+and keeps them in memory, optionally together with a warm pool of worker
+processes that hold their own decoded copy, so that notebooks and
+long-running services (see server) only pay the load and pool startup
+once.
+
+Usage
+-----
+with ReferenceIndex.from_fasta(reference_path, num_workers=4) as index:
+    query_data = index.parse_queries([(name, sequence), ...])
+    intersection_sizes = index.match(query_data)
+    confidence_scores = index.score(query_data, intersection_sizes)
+"""
+import os
+import time
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import h5py
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+import raxtax_extension_prototype.parser_short_long as parser
+import raxtax_extension_prototype.prob_fast as prob_fast
+import raxtax_extension_prototype.stop_kmers as stop_kmers
+import raxtax_extension_prototype.segments as segments
+import raxtax_extension_prototype.dedup as dedup
+
+#decoded references of a pool worker, loaded once by load_worker_index
+_worker_references = None
+
+def load_references(result_path: Path, kernel: str = "exact") -> list[dict]:
+    """
+    Loads and decodes the lookup data of all references of a lookup
+    table (see parser_short_long.load_reference).
+    """
+    with h5py.File(result_path, "r") as f:
+        return [parser.load_reference(f[idx], kernel) for idx in parser.get_reference_ids(f)]
+
+def load_worker_index(result_path: Path, kernel: str):
+    """
+    Initializer of the pool workers, decoding all references once per
+    worker.
+    """
+    global _worker_references
+    _worker_references = load_references(result_path, kernel)
+
+def warm_worker(delay: float) -> int:
+    """
+    Keeps a worker busy for delay seconds, so that the pool starts all
+    its workers, and returns its process id.
+    """
+    time.sleep(delay)
+    return os.getpid()
+
+def match_references(references: list[dict], query_kmer_sets, query_sequence_lengths) -> np.ndarray:
+    """
+    Returns the query × reference matrix of intersection sizes between
+    the queries and a list of decoded references.
+    """
+    intersection_sizes = np.zeros((len(query_kmer_sets), len(references)), dtype=np.int64)
+    for reference_id, reference_data in enumerate(references):
+        intersection_sizes[:, reference_id] = parser.calculate_reference_intersection_sizes(reference_data, query_kmer_sets, query_sequence_lengths)
+    return intersection_sizes
+
+def match_worker_references(start: int, stop: int, query_kmer_sets, query_sequence_lengths) -> np.ndarray:
+    """
+    Matches the queries against the references start to stop decoded by
+    the pool worker.
+    """
+    return match_references(_worker_references[start:stop], query_kmer_sets, query_sequence_lengths)
+
+def start_worker_pool(result_path: Path, kernel: str, num_workers: int) -> ProcessPoolExecutor:
+    """
+    Starts a pool of workers that each hold the decoded references and
+    waits until all workers are running.
+    """
+    executor = ProcessPoolExecutor(max_workers=num_workers, initializer=load_worker_index, initargs=(result_path, kernel))
+    list(executor.map(warm_worker, [0.1] * num_workers))
+    return executor
+
+def score_intersection_sizes(intersection_sizes: np.ndarray, query_set_sizes) -> np.ndarray:
+    """
+    Computes the confidence scores of every query row of an intersection
+    size matrix with the subsample size used by
+    output_adapters.output_s_t.
+    """
+    confidence_scores = np.zeros(intersection_sizes.shape, dtype=np.float64)
+    for query_id, query_set_size in enumerate(query_set_sizes):
+        confidence_scores[query_id] = prob_fast.calculate_confidence_scores(intersection_sizes[query_id], query_set_size // 2, query_set_size)
+    return confidence_scores
+
+class ReferenceIndex:
+    """
+    Lookup table held in memory for matching and scoring pre-parsed query
+    batches.
+
+    Matching is exhaustive, i.e. every query is matched against every
+    distinct reference with the kernel the index was opened with; the
+    prefilter, sketch screening and query sampling options of the
+    path-based drivers do not apply. Stop k-mers, segments and reference
+    deduplication of the lookup table are taken into account.
+
+    Parameters
+    ----------
+    result_path : pathlib.Path
+        Path to the lookup table (see parser_short_long.parse_reference_fasta).
+    kernel : str, optional
+        Matching kernel (see parser_short_long.get_intersection_sizes).
+    num_workers : int, optional
+        Size of the warm worker pool; 0 matches in the calling process.
+        The pool can also be started later with start_pool.
+    """
+    def __init__(self, result_path: Path, kernel: str = "exact", num_workers: int = 0):
+        if kernel not in parser.KERNELS:
+            raise ValueError(f"Unknown kernel '{kernel}', expected one of {parser.KERNELS}")
+
+        load_start_time = time.perf_counter()
+        self.result_path = Path(result_path)
+        self.kernel = kernel
+        self.references = load_references(self.result_path, kernel)
+        with h5py.File(self.result_path, "r") as f:
+            self.distinct_reference_names = parser.get_reference_names(f, parser.get_reference_ids(f))
+            self.stop_kmer_set = stop_kmers.read_stop_kmers(f)
+            self.kmer_occurrence_count = f["kmer_occurrence_count"][:]
+            self.reference_groups = dedup.read_reference_groups(f)
+            self.segment_overlap = int(f.attrs.get("segment_overlap", -1))
+        self.index_info = parser.get_index_info(self.result_path)
+        self.load_time = time.perf_counter() - load_start_time
+
+        self.executor = None
+        self.num_workers = 0
+        self.pool_start_time = 0
+        if num_workers > 0:
+            self.start_pool(num_workers)
+
+    @classmethod
+    def from_fasta(cls, reference_path: Path, redo: bool = False, index_options: dict | None = None, kernel: str = "exact",
+                   num_workers: int = 0) -> "ReferenceIndex":
+        """
+        Builds or reuses the lookup table of a reference FASTA file and
+        opens it.
+        """
+        result_path = reference_path.with_name(reference_path.stem + "_data.h5")
+        parser.parse_reference_fasta(reference_path, result_path, redo, **(index_options or {}))
+        return cls(result_path, kernel, num_workers)
+
+    @property
+    def reference_names(self) -> list[str]:
+        """
+        Names of all input references, i.e. of the columns returned by
+        match.
+        """
+        if self.reference_groups is not None:
+            return self.reference_groups[0]
+        return self.distinct_reference_names
+
+    def start_pool(self, num_workers: int):
+        """
+        Starts a warm pool of num_workers workers, replacing a running
+        pool.
+        """
+        self.close()
+        pool_start_time = time.perf_counter()
+        self.executor = start_worker_pool(self.result_path, self.kernel, num_workers)
+        self.num_workers = num_workers
+        self.pool_start_time = time.perf_counter() - pool_start_time
+
+    def close(self):
+        """
+        Shuts down the worker pool. The index stays usable in the calling
+        process.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.executor = None
+        self.num_workers = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def parse_queries(self, queries, orient: bool = False, deduplicate: bool = False) -> dict:
+        """
+        Converts a batch of queries into the query data used for
+        matching, masking the stop k-mers of the index.
+
+        Parameters
+        ----------
+        queries : iterable
+            SeqRecord objects or pairs of the form (query_name, sequence).
+        orient : bool, optional
+            If True, queries are oriented prior to matching.
+        deduplicate : bool, optional
+            If True, identical queries are matched once (see
+            parser_short_long.parse_query_fasta).
+
+        Returns
+        -------
+        dict
+            Dictionary as returned by parser_short_long.parse_query_fasta.
+        """
+        records = [query if isinstance(query, SeqRecord) else SeqRecord(Seq(query[1]), id=query[0], name=query[0], description="")
+                   for query in queries]
+        if orient:
+            records = [parser.orient_record(record, self.kmer_occurrence_count) for record in records]
+
+        query_data = parser.parse_query_records(records, deduplicate)
+        if len(self.stop_kmer_set) > 0:
+            query_data["kmer_sets"] = stop_kmers.mask_kmer_sets(query_data["kmer_sets"], self.stop_kmer_set)
+        if self.segment_overlap >= 0:
+            segments.check_query_lengths(query_data["sequence_lengths"], self.segment_overlap)
+        return query_data
+
+    def match(self, query_data: dict) -> np.ndarray:
+        """
+        Matches parsed queries against all references, in the worker pool
+        if one is running.
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix of intersection sizes with one row per distinct query
+            of query_data and one column per input reference.
+        """
+        query_kmer_sets = query_data["kmer_sets"]
+        query_sequence_lengths = query_data["sequence_lengths"]
+
+        if self.executor is None:
+            intersection_sizes = match_references(self.references, query_kmer_sets, query_sequence_lengths)
+        else:
+            bounds = np.linspace(0, len(self.references), self.num_workers + 1).astype(int)
+            futures = [self.executor.submit(match_worker_references, start, stop, query_kmer_sets, query_sequence_lengths)
+                       for start, stop in zip(bounds[:-1], bounds[1:])]
+            intersection_sizes = np.hstack([future.result() for future in futures])
+
+        if self.reference_groups is not None:
+            intersection_sizes = intersection_sizes[:, self.reference_groups[1]]
+        return intersection_sizes
+
+    def score(self, query_data: dict, intersection_sizes: np.ndarray) -> np.ndarray:
+        """
+        Computes the confidence scores of matched queries with the
+        subsample size used by output_adapters.output_s_t.
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix of confidence scores of the same shape as
+            intersection_sizes.
+        """
+        return score_intersection_sizes(intersection_sizes, [len(kmer_set) for kmer_set in query_data["kmer_sets"]])
+
+    def score_result(self, result: list) -> np.ndarray:
+        """
+        Computes the confidence scores of the per-query result tuples
+        returned by classify (see score).
+        """
+        return score_intersection_sizes(np.array([sizes for _, _, sizes in result], dtype=np.int64).reshape(len(result), -1),
+                                           [query_set_size for _, query_set_size, _ in result])
+
+    def classify(self, queries, orient: bool = False, deduplicate: bool = False):
+        """
+        Parses and matches a batch of queries.
+
+        Returns
+        -------
+        tuple
+            Tuple of the form (result, reference_names, runtime_info) as
+            returned by the path-based drivers.
+        """
+        start_time = time.perf_counter()
+        query_data = self.parse_queries(queries, orient, deduplicate)
+
+        match_start_time = time.perf_counter()
+        intersection_sizes = self.match(query_data)
+        match_time = time.perf_counter() - match_start_time
+
+        result = parser.build_result(query_data, intersection_sizes.tolist())
+        runtime_info = {
+            "query_count": len(result),
+            "calculate_intersection_sizes_time": match_time,
+            "request_processing_time": time.perf_counter() - start_time,
+            "index_load_time": self.load_time,
+            "pool_start_time": self.pool_start_time,
+            "num_workers": self.num_workers,
+        }
+        return result, self.reference_names, runtime_info
@@ -0,0 +1,193 @@
+"""
+result_matrix.py
+
+Description
+-----------
+Module for storing the query × reference intersection size matrix on
+disk.
+
+The matrix is stored in a memory-mapped file as a grid of tiles of
+tile_queries × tile_references entries, each tile being contiguous.
+Writing a reference column touches one column of each tile in a tile
+column, and reading tile_queries query rows reads one contiguous tile
+row, so that neither workers nor the scorer ever hold more than a tile
+row in memory.
+
+Completed reference columns are flagged in a second memory-mapped file
+that is flushed after the column itself. A matrix directory whose header
+matches the requested shape, tile shape and key is reopened, so that an
+interrupted run resumes with the references that were not completed.
+"""
+import json
+from pathlib import Path
+import numpy as np
+
+HEADER_NAME = "header.json"
+TILES_NAME = "tiles.dat"
+COMPLETED_NAME = "completed.dat"
+
+DEFAULT_TILE_SHAPE = (256, 64)
+DTYPE = np.int32
+
+def open_result_matrix(matrix_dir: Path, query_count: int, reference_count: int, key: str, tile_shape=DEFAULT_TILE_SHAPE) -> dict:
+    """
+    Opens the result matrix stored in matrix_dir, or creates a new one if
+    the directory holds no matrix with the same shape, tile shape and
+    key.
+
+    Parameters
+    ----------
+    matrix_dir : pathlib.Path
+        Directory of the matrix files.
+    query_count : int
+        Number of matrix rows.
+    reference_count : int
+        Number of matrix columns.
+    key : str
+        Identifier of the matching run; a matrix written with another
+        key is discarded.
+    tile_shape : tuple of int, optional
+        Number of queries and references per tile.
+
+    Returns
+    -------
+    dict
+        Dictionary with the memory-mapped "tiles" and "completed" arrays,
+        the matrix "shape" and "tile_shape", the directory "path" and the
+        "pending" references marked as completed but not yet flushed.
+    """
+    tile_queries, tile_references = (int(size) for size in tile_shape)
+    if tile_queries <= 0 or tile_references <= 0:
+        raise ValueError(f"The tile shape must be positive, got {tile_shape}")
+
+    matrix_dir = Path(matrix_dir)
+    matrix_dir.mkdir(parents=True, exist_ok=True)
+    header = {
+        "query_count": query_count,
+        "reference_count": reference_count,
+        "tile_shape": [tile_queries, tile_references],
+        "key": key,
+    }
+    grid_shape = (-(-max(query_count, 1) // tile_queries), -(-max(reference_count, 1) // tile_references), tile_queries, tile_references)
+
+    header_path = matrix_dir / HEADER_NAME
+    resume = header_path.exists() and json.loads(header_path.read_text()) == header
+    mode = "r+" if resume else "w+"
+    if not resume:
+        header_path.unlink(missing_ok=True)
+
+    tiles = np.memmap(matrix_dir / TILES_NAME, dtype=DTYPE, mode=mode, shape=grid_shape)
+    completed = np.memmap(matrix_dir / COMPLETED_NAME, dtype=np.uint8, mode=mode, shape=(max(reference_count, 1),))
+
+    #the header is written last, so that a matrix is only resumed once its files exist
+    if not resume:
+        tiles.flush()
+        completed.flush()
+        header_path.write_text(json.dumps(header))
+
+    return {
+        "tiles": tiles,
+        "completed": completed,
+        "shape": (query_count, reference_count),
+        "tile_shape": (tile_queries, tile_references),
+        "path": matrix_dir,
+        "pending": [],
+    }
+
+def write_column(matrix: dict, reference_id: int, values: np.ndarray):
+    """
+    Writes the intersection sizes of all queries with one reference.
+    """
+    tiles = matrix["tiles"]
+    tile_queries, tile_references = matrix["tile_shape"]
+
+    column = np.zeros(tiles.shape[0] * tile_queries, dtype=DTYPE)
+    column[:matrix["shape"][0]] = values
+    tiles[:, reference_id // tile_references, :, reference_id % tile_references] = column.reshape(tiles.shape[0], tile_queries)
+
+def read_column(matrix: dict, reference_id: int) -> np.ndarray:
+    """
+    Returns the intersection sizes of all queries with one reference.
+    """
+    tile_references = matrix["tile_shape"][1]
+    column = matrix["tiles"][:, reference_id // tile_references, :, reference_id % tile_references]
+    return np.asarray(column).reshape(-1)[:matrix["shape"][0]]
+
+def mark_completed(matrix: dict, reference_id: int, flush: bool = True):
+    """
+    Flags a reference as completed. Without flush, the flag is only
+    written by the next flush_result_matrix.
+    """
+    matrix["pending"].append(reference_id)
+    if flush:
+        flush_result_matrix(matrix)
+
+def flush_result_matrix(matrix: dict):
+    """
+    Flushes the written columns to disk and then flags the pending
+    references as completed, so that no reference is flagged before its
+    column is on disk.
+    """
+    matrix["tiles"].flush()
+    for reference_id in matrix["pending"]:
+        matrix["completed"][reference_id] = 1
+    matrix["completed"].flush()
+    matrix["pending"].clear()
+
+def get_completed_references(matrix: dict) -> np.ndarray:
+    """
+    Returns the ids of the references whose column is complete.
+    """
+    return np.flatnonzero(matrix["completed"][:matrix["shape"][1]])
+
+def read_rows(matrix: dict, tile_row: int) -> np.ndarray:
+    """
+    Returns the query × reference block of the queries in one tile row.
+    """
+    query_count, reference_count = matrix["shape"]
+    tile_queries, tile_references = matrix["tile_shape"]
+
+    block = np.asarray(matrix["tiles"][tile_row])
+    block = block.transpose(1, 0, 2).reshape(tile_queries, -1)
+    return block[:min(tile_queries, query_count - tile_row * tile_queries), :reference_count]
+
+def read_row(matrix: dict, query_id: int, cache: dict) -> np.ndarray:
+    """
+    Returns the intersection sizes of one query, reading the tile row of
+    the query into cache unless it is already cached there.
+    """
+    tile_row, row = divmod(query_id, matrix["tile_shape"][0])
+    if cache.get("tile_row") != tile_row:
+        cache["tile_row"] = tile_row
+        cache["rows"] = read_rows(matrix, tile_row)
+    return cache["rows"][row]
+
+class ResultRows:
+    """
+    Sequence of per-query result tuples (query_name, query_kmer_set_size,
+    intersection_sizes) read from a result matrix one tile row at a time,
+    equal to the list built by parser_short_long.build_result.
+
+    Duplicate queries (query_groups) and duplicate references
+    (reference_groups) are fanned out while reading.
+    """
+    def __init__(self, matrix: dict, query_data: dict, reference_groups: np.ndarray | None = None):
+        self.matrix = matrix
+        self.query_data = query_data
+        self.reference_groups = reference_groups
+
+    def __len__(self):
+        return len(self.query_data.get("all_query_names", self.query_data["query_names"]))
+
+    def __iter__(self):
+        if "query_groups" in self.query_data:
+            query_ids = zip(self.query_data["all_query_names"], self.query_data["query_groups"])
+        else:
+            query_ids = ((query_name, query_id) for query_id, query_name in enumerate(self.query_data["query_names"]))
+
+        cache = {}
+        for query_name, query_id in query_ids:
+            row = read_row(self.matrix, query_id, cache)
+            if self.reference_groups is not None:
+                row = row[self.reference_groups]
+            yield query_name, len(self.query_data["kmer_sets"][query_id]), row.tolist()
@@ -0,0 +1,52 @@
+"""
+segments.py
+
+Description
+-----------
+Module for splitting long references into overlapping segments.
+
+A reference longer than the segment length is stored as a series of
+segments of at most segment_length bases, where consecutive segments
+share segment_overlap bases. Every window of a query of length at most
+segment_overlap + 1 lies within a single segment, and every window of a
+segment is part of a window of the whole reference. Hence the maximum
+of the windowed intersection sizes over all segments equals the
+windowed intersection size with the whole reference, and segments of
+one reference can be processed independently.
+"""
+import numpy as np
+
+def segment_bounds(sequence_length: int, segment_length: int, segment_overlap: int) -> list[tuple[int, int]]:
+    """
+    Returns the (start, end) base ranges of the segments of a sequence.
+    Sequences of at most segment_length bases form a single segment.
+
+    Raises
+    ------
+    ValueError
+        If the overlap is negative or not shorter than the segments.
+    """
+    if segment_overlap < 0 or segment_overlap >= segment_length:
+        raise ValueError(f"The segment overlap must lie in [0, {segment_length}), got {segment_overlap}")
+
+    if sequence_length <= segment_length:
+        return [(0, sequence_length)]
+
+    step = segment_length - segment_overlap
+    starts = np.arange(0, sequence_length - segment_overlap, step)
+    return [(int(start), int(min(start + segment_length, sequence_length))) for start in starts]
+
+def check_query_lengths(query_sequence_lengths, segment_overlap: int):
+    """
+    Ensures that no query is too long for segment-wise matching to be
+    exact.
+
+    Raises
+    ------
+    ValueError
+        If a query is longer than the segment overlap.
+    """
+    max_query_length = max(query_sequence_lengths, default=0)
+    if max_query_length > segment_overlap:
+        raise ValueError(f"Queries of up to {max_query_length} bases require a segment overlap of at least {max_query_length}, "
+                         f"but the lookup table was built with {segment_overlap}")
@@ -0,0 +1,254 @@
+"""
+server.py
+
+Description
+-----------
+Module for serving classifications from a resident lookup table.
+
+The server keeps the lookup table in memory as a ReferenceIndex (see
+reference_index), optionally together with a warm pool of worker
+processes that hold their own decoded copy. Query batches are accepted over HTTP, either
+on a local TCP port or on a Unix socket:
+
+- GET /info returns the reference names and the index statistics.
+- POST /classify takes a JSON body {"queries": [[name, sequence], ...],
+  "orient": bool, "deduplicate": bool, "scores": bool} and returns
+  {"result": [...], "reference_names": [...], "runtime_info": {...}},
+  where result holds the per-query tuples (query_name,
+  query_kmer_set_size, intersection_sizes) of ReferenceIndex.classify
+  and, with scores, "scores" holds the filtered (name, confidence_score)
+  pairs of every query as written to results.out.
+
+Usage
+-----
+python -m raxtax_extension_prototype.server REFERENCE_FASTA (--socket PATH | --port PORT) [--workers N] [--kernel KERNEL]
+"""
+import sys
+import json
+import time
+import socket
+import signal
+import argparse
+import socketserver
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import raxtax_extension_prototype.parser_short_long as parser
+import raxtax_extension_prototype.output_adapters as output_adapters
+from raxtax_extension_prototype.reference_index import ReferenceIndex
+
+def classify_batch(index: ReferenceIndex, queries, orient: bool = False, scores: bool = False, deduplicate: bool = False) -> dict:
+    """
+    Classifies a batch of queries against a resident index.
+
+    Parameters
+    ----------
+    index : ReferenceIndex
+        Lookup table held by the server, optionally with a warm worker
+        pool.
+    queries : list of tuple
+        Pairs of the form (query_name, sequence).
+    orient : bool, optional
+        If True, queries are oriented prior to matching.
+    scores : bool, optional
+        If True, the filtered confidence scores of every query are
+        returned as well.
+    deduplicate : bool, optional
+        If True, identical queries are matched once (see
+        ReferenceIndex.classify).
+
+    Returns
+    -------
+    dict
+        Response dictionary as described in the module docstring.
+    """
+    start_time = time.perf_counter()
+
+    result, reference_names, runtime_info = index.classify(queries, orient, deduplicate)
+    response = {"result": result, "reference_names": reference_names, "runtime_info": runtime_info}
+
+    if scores:
+        response["scores"] = [output_adapters.evaluate_confidence_scores(reference_names, confidence_scores)
+                              for confidence_scores in index.score_result(result)]
+        runtime_info["request_processing_time"] = time.perf_counter() - start_time
+    return response
+
+def to_json(data) -> bytes:
+    """
+    Serializes a response, converting NumPy scalars and arrays.
+    """
+    return json.dumps(data, default=lambda value: value.tolist() if hasattr(value, "tolist") else str(value)).encode("utf-8")
+
+class ClassificationHandler(BaseHTTPRequestHandler):
+    """
+    Handles the /info and /classify requests of a classification server.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path != "/info":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        index = self.server.index
+        self.send_json(200, {"reference_names": index.reference_names, "kernel": index.kernel, "num_workers": index.num_workers, **index.index_info})
+
+    def do_POST(self):
+        if self.path != "/classify":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            response = classify_batch(self.server.index, request["queries"], request.get("orient", False), request.get("scores", False),
+                                      request.get("deduplicate", False))
+        except (ValueError, KeyError) as error:
+            self.send_json(400, {"error": str(error)})
+            return
+        self.send_json(200, response)
+
+    def send_json(self, status: int, data):
+        body = to_json(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    HTTP server listening on a Unix socket.
+    """
+    daemon_threads = True
+
+def create_server(index: ReferenceIndex, socket_path: Path | None = None, host: str = "127.0.0.1", port: int = 0):
+    """
+    Creates a classification server on a Unix socket if socket_path is
+    given and on host:port otherwise.
+    """
+    if socket_path is not None:
+        Path(socket_path).unlink(missing_ok=True)
+        server = ThreadingUnixHTTPServer(str(socket_path), ClassificationHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ClassificationHandler)
+    server.index = index
+    return server
+
+def serve(reference_path: Path, socket_path: Path | None = None, host: str = "127.0.0.1", port: int = 0, kernel: str = "exact",
+          num_workers: int = 0, redo: bool = False, index_options: dict | None = None):
+    """
+    Builds or reuses the lookup table of a reference FASTA file, loads it
+    and serves classifications until interrupted.
+
+    Parameters
+    ----------
+    reference_path : pathlib.Path
+        Path to the reference FASTA file.
+    socket_path : pathlib.Path, optional
+        Unix socket to listen on. If None, the server listens on
+        host:port.
+    host : str, optional
+        Host of the TCP endpoint.
+    port : int, optional
+        Port of the TCP endpoint; 0 selects a free port.
+    kernel : str, optional
+        Matching kernel (see parser_short_long.get_intersection_sizes).
+    num_workers : int, optional
+        Size of the warm worker pool; 0 matches in the server process.
+    redo : bool, optional
+        If True, the lookup table is recomputed.
+    index_options : dict, optional
+        Keyword arguments forwarded to parse_reference_fasta.
+    """
+    index = ReferenceIndex.from_fasta(reference_path, redo, index_options, kernel, num_workers)
+    print(f"Loading the index and starting {num_workers} workers took {index.load_time + index.pool_start_time} seconds.")
+
+    server = create_server(index, socket_path, host, port)
+    address = socket_path if socket_path is not None else f"http://{server.server_address[0]}:{server.server_address[1]}"
+    print(f"Serving on {address}", flush=True)
+
+    #terminate like on an interrupt, so that the worker pool is shut down
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        index.close()
+        if socket_path is not None:
+            Path(socket_path).unlink(missing_ok=True)
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a Unix socket.
+    """
+    def __init__(self, socket_path: Path, timeout: float | None = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = str(socket_path)
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def open_connection(socket_path: Path | None = None, host: str = "127.0.0.1", port: int | None = None, timeout: float | None = None):
+    """
+    Opens a persistent connection to a classification server.
+    """
+    if socket_path is not None:
+        return UnixHTTPConnection(socket_path, timeout)
+    return http.client.HTTPConnection(host, port, timeout=timeout)
+
+def send_request(connection: http.client.HTTPConnection, method: str, path: str, payload: dict | None = None) -> dict:
+    """
+    Sends a request to a classification server and returns the decoded
+    response.
+
+    Raises
+    ------
+    RuntimeError
+        If the server answers with an error.
+    """
+    body = None if payload is None else to_json(payload)
+    headers = {} if body is None else {"Content-Type": "application/json"}
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    data = json.loads(response.read())
+    if response.status != 200:
+        raise RuntimeError(f"Classification server returned {response.status}: {data.get('error')}")
+    return data
+
+def classify_remote(connection: http.client.HTTPConnection, queries, orient: bool = False, deduplicate: bool = False):
+    """
+    Classifies a batch of (query_name, sequence) pairs on a
+    classification server. Confidence scores computed by the server can
+    be requested with send_request and {"scores": true}.
+
+    Returns
+    -------
+    tuple
+        Tuple of the form (result, reference_names, runtime_info) as
+        returned by the matching drivers.
+    """
+    data = send_request(connection, "POST", "/classify", {"queries": [list(query) for query in queries], "orient": orient,
+                                                          "deduplicate": deduplicate})
+    return [tuple(entry) for entry in data["result"]], data["reference_names"], data["runtime_info"]
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Serves classifications from a resident lookup table.")
+    argument_parser.add_argument("reference_path", type=Path, help="reference FASTA file")
+    argument_parser.add_argument("--socket", type=Path, default=None, help="Unix socket to listen on")
+    argument_parser.add_argument("--host", default="127.0.0.1", help="host of the TCP endpoint")
+    argument_parser.add_argument("--port", type=int, default=0, help="port of the TCP endpoint")
+    argument_parser.add_argument("--kernel", default="exact", choices=parser.KERNELS, help="matching kernel")
+    argument_parser.add_argument("--workers", type=int, default=0, help="size of the warm worker pool")
+    argument_parser.add_argument("--redo", action="store_true", help="recompute the lookup table")
+    arguments = argument_parser.parse_args()
+
+    serve(arguments.reference_path, arguments.socket, arguments.host, arguments.port, arguments.kernel, arguments.workers, arguments.redo)
+
+if __name__ == "__main__":
+    main()
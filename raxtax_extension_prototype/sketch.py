@@ -0,0 +1,164 @@
+"""
+sketch.py
+
+Description
+-----------
+Module for the MinHash sketch screening stage.
+
+For every reference, a bottom-s MinHash sketch of its k-mer set is
+stored in the lookup table: the s smallest values of a fixed 64-bit hash
+over the distinct reference k-mers. The sketch hashes of all references
+are kept in an inverted index (hash -> references), so screening a query
+only touches the references that share sampled k-mers with it, plus a
+contiguous slice of the references ordered by their largest sketch hash
+(those without evidence, see below).
+
+Since queries are much shorter than references, the Jaccard similarity
+of a query and a reference is small even for a perfect match. Screening
+therefore estimates the containment of the query k-mer set in each
+reference: among the query k-mers whose hash lies below the largest
+sketch hash of a reference, the fraction contained in the sketch.
+References for which no query k-mer falls into this range carry no
+evidence and are kept as candidates. References sharing none of the
+sampled query k-mers have containment 0, so that a threshold of 0 or
+less keeps all references.
+"""
+import numpy as np
+import h5py
+
+import raxtax_extension_prototype.constants as constants
+
+#padding of sketches of references with fewer than sketch_size distinct k-mers
+SKETCH_PADDING = np.iinfo(np.uint64).max
+
+def hash_kmers(kmers: np.ndarray) -> np.ndarray:
+    """
+    Maps k-mer indices to 64-bit hashes using the splitmix64 finalizer.
+    """
+    values = np.asarray(kmers, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+KMER_HASHES = hash_kmers(np.arange(constants.KMER_COUNT))
+
+def build_sketch(kmers: np.ndarray, sketch_size: int) -> np.ndarray:
+    """
+    Builds the bottom-s sketch of a set of distinct k-mers, padded with
+    SKETCH_PADDING to sketch_size entries.
+    """
+    hashes = KMER_HASHES[np.asarray(kmers, dtype=np.int64)]
+    if len(hashes) > sketch_size:
+        hashes = np.partition(hashes, sketch_size - 1)[:sketch_size]
+    sketch = np.full(sketch_size, SKETCH_PADDING, dtype=np.uint64)
+    sketch[:len(hashes)] = np.sort(hashes)
+    return sketch
+
+def write_sketches(f: h5py.File, sketches: np.ndarray, sketch_size: int):
+    """
+    Writes the reference × sketch_size matrix of sketches into the
+    "sketches" group of a lookup table.
+    """
+    grp = f.create_group("sketches")
+    grp.attrs["sketch_size"] = sketch_size
+    grp.create_dataset("hashes", data=sketches, dtype=np.uint64, compression="gzip")
+
+def load_sketch_index(result_path) -> dict:
+    """
+    Loads the reference sketches of a lookup table and builds the
+    inverted index used for screening.
+
+    Returns
+    -------
+    dict
+        Dictionary containing the unique sketch hashes ("hashes"), the
+        CSR postings of reference ids ("offsets", "reference_ids"), the
+        largest sketch hash of every reference ("thresholds") and the
+        references ordered by it ("threshold_order",
+        "sorted_thresholds"), as well as the reference count and the
+        sketch size.
+
+    Raises
+    ------
+    ValueError
+        If the lookup table contains no sketches.
+    """
+    with h5py.File(result_path, "r") as f:
+        if "sketches" not in f:
+            raise ValueError(f"No sketches found in {result_path}, rebuild the lookup table")
+        sketches = f["sketches"]["hashes"][:]
+
+    reference_count, sketch_size = sketches.shape
+    reference_ids = np.repeat(np.arange(reference_count, dtype=np.int64), sketch_size)
+    hashes = sketches.ravel()
+    stored = hashes != SKETCH_PADDING
+    hashes = hashes[stored]
+    reference_ids = reference_ids[stored]
+
+    order = np.argsort(hashes, kind="stable")
+    unique_hashes, counts = np.unique(hashes[order], return_counts=True)
+
+    #references with fewer than sketch_size k-mers are sketched completely
+    full = np.all(sketches != SKETCH_PADDING, axis=1)
+    thresholds = np.where(full, sketches[:, -1], SKETCH_PADDING)
+    threshold_order = np.argsort(thresholds, kind="stable")
+
+    return {
+        "hashes": unique_hashes,
+        "offsets": np.concatenate(([0], np.cumsum(counts))),
+        "reference_ids": reference_ids[order],
+        "thresholds": thresholds,
+        "threshold_order": threshold_order,
+        "sorted_thresholds": thresholds[threshold_order],
+        "reference_count": reference_count,
+        "sketch_size": sketch_size,
+    }
+
+def screen_query(sketch_index: dict, kmer_set: np.ndarray, containment_threshold: float) -> np.ndarray:
+    """
+    Selects the candidate references of one query by their estimated
+    containment of the query k-mer set.
+
+    Parameters
+    ----------
+    sketch_index : dict
+        Index as returned by load_sketch_index.
+    kmer_set : numpy.ndarray
+        Query k-mer set.
+    containment_threshold : float
+        Minimum estimated containment of a candidate reference.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sorted ids of the candidate references.
+    """
+    if containment_threshold <= 0:
+        return np.arange(sketch_index["reference_count"], dtype=np.int64)
+
+    query_hashes = np.sort(KMER_HASHES[np.asarray(kmer_set, dtype=np.int64)])
+    if len(query_hashes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    #references whose sketch range contains no query k-mer carry no evidence
+    no_evidence_count = np.searchsorted(sketch_index["sorted_thresholds"], query_hashes[0], side="left")
+    no_evidence = sketch_index["threshold_order"][:no_evidence_count]
+
+    if len(sketch_index["hashes"]) == 0:
+        return np.sort(no_evidence)
+
+    #count the query k-mers found in each sketch through the inverted index
+    positions = np.minimum(np.searchsorted(sketch_index["hashes"], query_hashes), len(sketch_index["hashes"]) - 1)
+    positions = positions[sketch_index["hashes"][positions] == query_hashes]
+    posting_starts = sketch_index["offsets"][positions]
+    posting_sizes = sketch_index["offsets"][positions + 1] - posting_starts
+    first_entries = np.cumsum(posting_sizes) - posting_sizes
+    entries = np.arange(int(posting_sizes.sum()), dtype=np.int64) + np.repeat(posting_starts - first_entries, posting_sizes)
+    hit_references, shared_counts = np.unique(sketch_index["reference_ids"][entries], return_counts=True)
+
+    #all other references with sampled query k-mers share none of them, i.e. have containment 0 and fail the positive threshold
+    sampled_counts = np.searchsorted(query_hashes, sketch_index["thresholds"][hit_references], side="right")
+    containment = shared_counts / np.maximum(sampled_counts, 1)
+    selected = hit_references[containment >= containment_threshold]
+
+    return np.union1d(selected, no_evidence)
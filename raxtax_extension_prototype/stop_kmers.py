@@ -0,0 +1,107 @@
+"""
+stop_kmers.py
+
+Description
+-----------
+Module for masking over-represented ("stop") k-mers.
+
+Low-complexity k-mers such as poly-A occur at many reference positions
+and dominate the work of the windowed kernels. Stop k-mers are selected
+from the global k-mer occurrence counts, either above a percentile of
+the counts of all occurring k-mers or above an absolute cap. They are
+removed from the stored position lists at build time and from the
+query k-mer sets at query time, so that query set sizes and match
+counts passed to the probability model refer to the same k-mers. The
+packed_sequence store keeps the full sequence, so its stop k-mers are
+masked when the k-mer indices are derived at load time.
+"""
+import numpy as np
+import h5py
+
+import raxtax_extension_prototype.constants as constants
+
+def select_stop_kmers(kmer_occurrence_count: np.ndarray, percentile: float | None = None, cap: int | None = None) -> np.ndarray:
+    """
+    Selects the k-mers whose occurrence count exceeds the given
+    percentile of the counts of all occurring k-mers or the given
+    absolute cap.
+
+    Parameters
+    ----------
+    kmer_occurrence_count : numpy.ndarray
+        Number of occurrences of every k-mer in all references.
+    percentile : float, optional
+        Percentile in [0, 100]; k-mers counted more often are masked.
+    cap : int, optional
+        Absolute cap; k-mers counted more often are masked.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sorted stop k-mers.
+    """
+    kmer_occurrence_count = np.asarray(kmer_occurrence_count, dtype=np.int64)
+    masked = np.zeros(constants.KMER_COUNT, dtype=bool)
+
+    occurring = kmer_occurrence_count[kmer_occurrence_count > 0]
+    if percentile is not None and len(occurring) > 0:
+        masked |= kmer_occurrence_count > np.percentile(occurring, percentile)
+    if cap is not None:
+        masked |= kmer_occurrence_count > cap
+
+    return np.flatnonzero(masked)
+
+def write_stop_kmers(f: h5py.File, stop_kmers: np.ndarray, percentile: float | None, cap: int | None):
+    """
+    Stores the stop k-mers and the criteria used to select them in a
+    lookup table.
+    """
+    f.create_dataset("stop_kmers", data=stop_kmers, dtype=np.uint16)
+    f["stop_kmers"].attrs["percentile"] = -1 if percentile is None else percentile
+    f["stop_kmers"].attrs["cap"] = -1 if cap is None else cap
+
+def read_stop_kmers(f: h5py.File) -> np.ndarray:
+    """
+    Returns the stop k-mers stored in a lookup table, an empty array if
+    none were masked at build time.
+    """
+    if "stop_kmers" not in f:
+        return np.zeros(0, dtype=np.int64)
+    return f["stop_kmers"][:].astype(np.int64)
+
+def read_stop_criteria(f: h5py.File) -> tuple:
+    """
+    Returns the percentile and cap used to select the stop k-mers of a
+    lookup table, -1 for criteria that were not given.
+    """
+    if "stop_kmers" not in f:
+        return -1, -1
+    return float(f["stop_kmers"].attrs["percentile"]), int(f["stop_kmers"].attrs["cap"])
+
+def mask_kmer_indices(kmer_indices: np.ndarray, stop_kmers: np.ndarray) -> np.ndarray:
+    """
+    Sets the stop k-mers of a per-position k-mer index array to -1, like
+    k-mers with ambiguous bases.
+    """
+    if len(stop_kmers) == 0:
+        return kmer_indices
+
+    stop_mask = np.zeros(constants.KMER_COUNT, dtype=bool)
+    stop_mask[stop_kmers] = True
+    return np.where(stop_mask[np.maximum(kmer_indices, 0)], -1, kmer_indices)
+
+def mask_kmer_sets(kmer_sets, stop_kmers: np.ndarray) -> list:
+    """
+    Removes the stop k-mers from every k-mer set.
+    """
+    if len(stop_kmers) == 0:
+        return list(kmer_sets)
+
+    stop_mask = np.zeros(constants.KMER_COUNT, dtype=bool)
+    stop_mask[stop_kmers] = True
+
+    masked_sets = []
+    for kmer_set in kmer_sets:
+        kmer_set = np.asarray(kmer_set, dtype=np.int64)
+        masked_sets.append(kmer_set[~stop_mask[kmer_set]].tolist())
+    return masked_sets
@@ -0,0 +1,147 @@
+"""
+streaming.py
+
+Description
+-----------
+Module for matching query files chunk by chunk.
+
+Queries are read lazily and matched in chunks of chunk_size records,
+so that only the k-mer sets and intersection sizes of one chunk are held
+in memory at a time. The lookup table is built (or reused) once before
+the first chunk. Each chunk is matched with a streaming-capable backend
+(see backends) and yielded as (result, reference_names, runtime_info), where result has the
+form returned by the driver for the queries of the chunk.
+
+Query deduplication, stop k-mer percentiles and confidence errors apply
+within a chunk.
+"""
+import itertools
+from pathlib import Path
+
+from Bio import SeqIO
+
+import raxtax_extension_prototype.parser_short_long as parser
+import raxtax_extension_prototype.backends as backends
+
+#runtime_info entries that are summed over chunks
+SUMMED_KEYS = (
+    "query_parse_time",
+    "orient_queries_time",
+    "calculate_intersection_sizes_time",
+    "average_reference_processing_time",
+    "prefilter_time",
+    "prefilter_candidate_pairs",
+    "sketch_time",
+    "sketch_candidate_pairs",
+    "clade_time",
+    "clade_candidate_pairs",
+    "bitmask_count",
+    "length_bucket_recheck_time",
+    "length_bucket_recheck_pairs",
+    "length_bucket_changed_top_hits",
+    "duplicate_query_count",
+)
+
+#runtime_info entries for which the maximum over chunks is kept
+MAXIMUM_KEYS = (
+    "max_confidence_error",
+    "length_bucket_max_deviation",
+)
+
+def iter_query_chunks(query_path: Path, chunk_size: int):
+    """
+    Yields the records of a query FASTA file in lists of at most
+    chunk_size records.
+
+    Raises
+    ------
+    ValueError
+        If the chunk size is not positive.
+    """
+    if chunk_size <= 0:
+        raise ValueError(f"The query chunk size must be positive, got {chunk_size}")
+
+    records = SeqIO.parse(query_path, "fasta")
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def stream_intersection_sizes(reference_path: Path, query_path: Path, chunk_size: int, orient_query: bool = False, redo: bool = False,
+                              backend: str = "sequential", num_workers: int = 0, index_options: dict | None = None, calibration_options: dict | None = None,
+                              **matching_options):
+    """
+    Computes k-mer intersection sizes chunk by chunk.
+
+    Parameters
+    ----------
+    reference_path : pathlib.Path
+        Path to the reference FASTA file.
+    query_path : pathlib.Path
+        Path to the query FASTA file.
+    chunk_size : int
+        Number of queries matched at a time.
+    orient_query : bool, optional
+        If True, the queries of each chunk are oriented in memory prior
+        to matching.
+    redo : bool, optional
+        If True, the reference lookup table is recomputed before the
+        first chunk.
+    backend : str, optional
+        Name of a streaming-capable backend or "auto". The automatic
+        selection is calibrated once, on the first chunk.
+    num_workers : int, optional
+        Number of workers of parallel backends.
+    index_options : dict, optional
+        Keyword arguments forwarded to parse_reference_fasta.
+    calibration_options : dict, optional
+        Keyword arguments forwarded to backends.select_backend.
+    **matching_options
+        Keyword arguments forwarded to the backend driver.
+
+    Yields
+    ------
+    tuple
+        Tuple of the form (result, reference_names, runtime_info) for
+        each chunk, as returned by the driver.
+    """
+    if backend != "auto" and not backends.get_backend(backend)["capabilities"]["streaming"]:
+        raise ValueError(f"The matching backend '{backend}' cannot match query chunks")
+
+    selection_info = None
+    for chunk_id, query_records in enumerate(iter_query_chunks(query_path, chunk_size)):
+        chunk_redo = redo and chunk_id == 0
+        if backend == "auto":
+            result_path = reference_path.with_name(reference_path.stem + "_data.h5")
+            parser.parse_reference_fasta(reference_path, result_path, chunk_redo, **(index_options or {}))
+            chunk_redo = False
+            backend, selection_info = backends.select_backend(reference_path, query_path, orient_query, num_workers, index_options, query_records,
+                                                              matching_options, streaming=True, **(calibration_options or {}))
+        chunk = backends.run_backend(backend, reference_path, query_path, orient_query=orient_query, redo=chunk_redo, num_workers=num_workers,
+                                     index_options=index_options, query_records=query_records, **matching_options)
+        if selection_info is not None:
+            chunk[2].update(selection_info)
+        print(f"Matched query chunk {chunk_id} ({len(query_records)} queries).")
+        yield chunk
+
+def merge_runtime_info(merged: dict | None, runtime_info: dict, chunk_size: int) -> dict:
+    """
+    Merges the runtime information of one chunk into the runtime
+    information of all previous chunks. Entries in SUMMED_KEYS are
+    summed, entries in MAXIMUM_KEYS maximized, and all other entries are
+    those of the first chunk.
+    """
+    if merged is None:
+        merged = {**runtime_info, "query_chunk_size": chunk_size, "query_chunk_count": 0}
+    else:
+        for key, value in runtime_info.items():
+            if key in SUMMED_KEYS:
+                merged[key] = merged.get(key, 0) + value
+            elif key in MAXIMUM_KEYS:
+                merged[key] = max(merged.get(key, value), value)
+            elif key not in merged:
+                merged[key] = value
+
+    merged["query_chunk_count"] += 1
+    return merged
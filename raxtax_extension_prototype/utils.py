@@ -33,6 +33,42 @@ def sequence_to_kmer_set(seq: str, k: int = 8) -> list[int]:
 
     return sorted(kmer_set)
 
+def sequence_to_codes(seq: str) -> np.ndarray:
+    """
+    Converts a sequence string to its 2-bit nucleotide codes
+    (A=0, C=1, G=2, T=3). Ambiguous bases are encoded as 4.
+    """
+    code_table = np.full(256, 4, dtype=np.uint8)
+    for base, code in zip(b"ACGT", range(4)):
+        code_table[base] = code
+    return code_table[np.frombuffer(seq.encode("ascii"), dtype=np.uint8)]
+
+def codes_to_kmer_indices(codes: np.ndarray, k: int = constants.K) -> np.ndarray:
+    """
+    Computes the integer representation of the k-mer starting at every
+    position of a 2-bit encoded sequence using vectorized shifts.
+    K-mers containing ambiguous bases (code 4) are set to -1.
+    """
+    kmer_count = len(codes) - k + 1
+    if kmer_count <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    kmer_indices = np.zeros(kmer_count, dtype=np.int64)
+    for j in range(k):
+        kmer_indices = (kmer_indices << 2) | (codes[j:j + kmer_count] & 3)
+
+    ambiguous = np.concatenate(([0], np.cumsum(codes == 4)))
+    kmer_indices[ambiguous[k:] - ambiguous[:kmer_count] > 0] = -1
+
+    return kmer_indices
+
+def sequence_to_kmer_indices(seq: str, k: int = constants.K) -> np.ndarray:
+    """
+    Converts a sequence string to the integer representation of the
+    k-mer starting at every position, -1 for k-mers with ambiguous bases.
+    """
+    return codes_to_kmer_indices(sequence_to_codes(seq), k)
+
 def complement_sequence_str(sequence: str) -> str:
     """
     Computes the complementary sequence.
@@ -12,10 +12,11 @@ import inspect
 
 import raxtax_extension_prototype.utils as utils
 
-def create_config_at_path(base_dir: Path, redo_config: bool=False, leaf_count: int=1000, sequence_length: int=50000, tree_height: float=0.1, query_count: int=200, core_count: int=8,
+def create_config_at_path(base_dir: Path, redo_config: bool=False, leaf_count: int=1000, sequence_length: int=50000, tree_height: float=0.1, query_count: int=200, core_count: int | None = 8,
                           query_min_length: int=100, fragment_count: int=50, nick_freq: float=0.005, overhang_parameter: float=1.0, double_strand_deamination: float=0.0, single_strand_deamination: float=0.0,
                           iqtree_seed: int | None = None, pygargammel_seed: int | None = None, query_selection_seed: int | None=None,
-                          mutation_rate: float | None = None, mutation_seed: int | None = None, disorientation_probability: float | None = None, disorientation_seed: int | None = None):
+                          mutation_rate: float | None = None, mutation_seed: int | None = None, disorientation_probability: float | None = None, disorientation_seed: int | None = None,
+                          index_options: dict | None = None, matching_options: dict | None = None, matching_backend: str | None = None):
     config_path = base_dir / "config.yaml"
 
     # Write config only if redo_config is True or file does not exist
@@ -63,6 +64,13 @@ def create_config_at_path(base_dir: Path, redo_config: bool=False, leaf_count: i
             "disorientation_seed": disorientation_seed,
         }
 
+        if index_options is not None:
+            config_data["index_options"] = index_options
+        if matching_options is not None:
+            config_data["matching_options"] = matching_options
+        if matching_backend is not None:
+            config_data["matching_backend"] = matching_backend
+
         with config_path.open("w") as f:
             yaml.dump(config_data, f, sort_keys=False)
 
@@ -86,15 +94,22 @@ def create_config_at_path(base_dir: Path, redo_config: bool=False, leaf_count: i
         print("        iqtree_seed: " + str(iqtree_seed))
         print("        pygargammel_seed: " + str(pygargammel_seed))
         print("        query_selection_seed: " + str(query_selection_seed))
+        if index_options is not None:
+            print("        index_options: " + str(index_options))
+        if matching_options is not None:
+            print("        matching_options: " + str(matching_options))
+        if matching_backend is not None:
+            print("        matching_backend: " + matching_backend)
     else:
         print(f"[INFO] Configuration file already exists at {config_path}, skipping creation")
 
     return config_path
 
-def create_config_here(redo_config: bool=False, leaf_count: int=1000, sequence_length: int=50000, tree_height: float=0.1, query_count: int=200, core_count: int=8,
+def create_config_here(redo_config: bool=False, leaf_count: int=1000, sequence_length: int=50000, tree_height: float=0.1, query_count: int=200, core_count: int | None = 8,
                        query_min_lenght: int=100, fragment_count: int=50, nick_freq: float=0.005, overhang_parameter: float=1.0, double_strand_deamination: float=0.0, single_strand_deamination: float=0.0,
                        iqtree_seed: int | None = None, pygargammel_seed: int | None = None, query_selection_seed: int | None=None,
-                       mutation_rate: float | None = None, mutation_seed: int | None = None, disorientation_probability: float | None = None, disorientation_seed: int | None = None):
+                       mutation_rate: float | None = None, mutation_seed: int | None = None, disorientation_probability: float | None = None, disorientation_seed: int | None = None,
+                       index_options: dict | None = None, matching_options: dict | None = None, matching_backend: str | None = None):
 
     # Get the path of the file that called this function
     base_dir = Path(inspect.stack()[1].filename).resolve().parent
@@ -102,13 +117,15 @@ def create_config_here(redo_config: bool=False, leaf_count: int=1000, sequence_l
     return create_config_at_path(base_dir, redo_config, leaf_count, sequence_length, tree_height, query_count, core_count,
                                  query_min_lenght, fragment_count, nick_freq, overhang_parameter, double_strand_deamination, single_strand_deamination,
                                  iqtree_seed, pygargammel_seed, query_selection_seed,
-                                 mutation_rate, mutation_seed, disorientation_probability, disorientation_seed)
+                                 mutation_rate, mutation_seed, disorientation_probability, disorientation_seed,
+                                 index_options, matching_options, matching_backend)
 
 def modify_config_at_path(base_dir: Path, redo_config: bool=False, leaf_count: int | None = None, sequence_length: int | None = None, tree_height: float | None = None, query_count: int | None = None, core_count: int | None = None,
                           query_min_length: int | None = None, fragment_count: int | None = None, nick_freq: float | None = None, overhang_parameter: float | None = None, double_strand_deamination: float | None = None, single_strand_deamination: float | None = None,
                           iqtree_seed: int | None = None, pygargammel_seed: int | None = None, query_selection_seed: int | None=None,
                           mutation_rate: float | None = None, mutation_seed: int | None = None, disorientation_probability: float | None = None, disorientation_seed: int | None = None,
-                          missing_references_selection_seed: int | None = None):
+                          missing_references_selection_seed: int | None = None, index_options: dict | None = None, matching_options: dict | None = None,
+                          matching_backend: str | None = None):
     config_path = base_dir / "config.yaml"
 
     if not redo_config:
@@ -156,6 +173,12 @@ def modify_config_at_path(base_dir: Path, redo_config: bool=False, leaf_count: i
         config["disorientation_seed"] = disorientation_seed
     if missing_references_selection_seed is not None:
         config["missing_references_selection_seed"] = missing_references_selection_seed
+    if index_options is not None:
+        config["index_options"] = index_options
+    if matching_options is not None:
+        config["matching_options"] = matching_options
+    if matching_backend is not None:
+        config["matching_backend"] = matching_backend
 
     with config_path.open("w") as f:
         yaml.dump(config, f, sort_keys=False)
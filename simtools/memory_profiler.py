@@ -4,6 +4,11 @@ memory_profiler.py
 Purpose
 -------
 Executable script that measures the peak memory usage of the implemented method during execution.
+
+The peak is the summed RSS of the process and its children, which counts
+pages shared copy-on-write by forked workers once per worker. The
+pss_peak divides shared pages among the processes mapping them and thus
+measures the actual memory usage (Linux only; 0 elsewhere).
 """
 import psutil
 import subprocess
@@ -19,11 +24,23 @@ parent = psutil.Process(p.pid)
 peak = 0
 parent_peak = 0
 children_peak = 0
+pss_peak = 0
+
+def get_pss(proc):
+    """
+    Returns the proportional set size of a process, or 0 where it is
+    unavailable.
+    """
+    try:
+        return getattr(proc.memory_full_info(), "pss", 0)
+    except psutil.AccessDenied:
+        return 0
 
 while p.poll() is None:
     try:
         procs_children = parent.children(recursive=True)
         total = 0
+        pss_total = get_pss(parent)
 
         parent_memory = parent.memory_info().rss
         parent_peak = max(parent_peak, parent_memory)
@@ -35,10 +52,12 @@ while p.poll() is None:
                 children_memory = proc.memory_info().rss
                 total += children_memory
                 children_peak = max(children_peak, children_memory)
+                pss_total += get_pss(proc)
             except psutil.NoSuchProcess:
                 pass
 
         peak = max(peak, total)
+        pss_peak = max(pss_peak, pss_total)
 
     except psutil.NoSuchProcess:
         break
@@ -49,6 +68,7 @@ cmd_str = " ".join(CMD)
 peak_gb = peak / 1024 / 1024 / 1024
 parent_peak_gb = parent_peak / 1024 / 1024 / 1024
 children_peak_gb = children_peak / 1024 / 1024 / 1024
+pss_peak_gb = pss_peak / 1024 / 1024 / 1024
 
 file_name = CMD[-1].split(".")[-1]
 
@@ -57,3 +77,4 @@ with open(memory_result_path, "a") as f:
     f.write(f"{file_name} peak (GB): {peak_gb} \n")
     f.write(f"{file_name} parent_peak (GB): {parent_peak_gb} \n")
     f.write(f"{file_name} children_peak (GB): {children_peak_gb} \n")
+    f.write(f"{file_name} pss_peak (GB): {pss_peak_gb} \n")
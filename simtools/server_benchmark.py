@@ -0,0 +1,99 @@
+"""
+server_benchmark.py
+
+Purpose
+-------
+Provides functions for measuring the latency and throughput of
+classifications with a fresh process per batch and with a resident
+classification server.
+"""
+from pathlib import Path
+import sys
+import csv
+import time
+import subprocess
+from Bio import SeqIO
+
+import raxtax_extension_prototype.server as server
+
+def select_batch(queries: list, batch_size: int, offset: int) -> list:
+    """
+    Returns batch_size queries starting at offset, wrapping around the
+    query list.
+    """
+    return [queries[(offset + i) % len(queries)] for i in range(batch_size)]
+
+def write_batch_fasta(batch: list, batch_path: Path):
+    """
+    Writes a batch of (query_name, sequence) pairs to a FASTA file.
+    """
+    with batch_path.open("w") as f:
+        for query_name, sequence in batch:
+            f.write(f">{query_name}\n{sequence}\n")
+
+def measure_cold_latency(reference_path: Path, batch_path: Path) -> float:
+    """
+    Returns the wall-clock time of classifying a batch in a new Python
+    process that imports the package and opens the lookup table, as
+    done by simulator.execute_raxtax.
+    """
+    script = ("from pathlib import Path\n"
+              "import raxtax_extension_prototype.parser_short_long as parser\n"
+              f"parser.get_intersection_sizes(Path({str(reference_path)!r}), Path({str(batch_path)!r}))\n")
+    start_time = time.perf_counter()
+    subprocess.run([sys.executable, "-c", script], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start_time
+
+def start_server(reference_path: Path, socket_path: Path, num_workers: int) -> subprocess.Popen:
+    """
+    Starts a classification server on a Unix socket and waits until it
+    accepts requests.
+    """
+    process = subprocess.Popen([sys.executable, "-m", "raxtax_extension_prototype.server", str(reference_path), "--socket", str(socket_path),
+                                "--workers", str(num_workers)], stdout=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        if line.startswith("Serving"):
+            break
+    return process
+
+def run_server_benchmark(reference_path: Path, query_path: Path, result_dir: Path, batch_sizes: list[int], repetitions: int, cold_repetitions: int,
+                         num_workers: int):
+    """
+    Measures the latency of classifying batches of each size with a new
+    process per batch ("cold") and with a resident server ("server"), and
+    writes one row per request to server_benchmark.csv in result_dir.
+    """
+    result_dir.mkdir(exist_ok=True)
+    queries = [(record.id, str(record.seq)) for record in SeqIO.parse(query_path, "fasta")]
+    rows = []
+
+    batch_path = result_dir / "batch.fasta"
+    for batch_size in batch_sizes:
+        for repetition in range(cold_repetitions):
+            write_batch_fasta(select_batch(queries, batch_size, repetition * batch_size), batch_path)
+            latency = measure_cold_latency(reference_path, batch_path)
+            rows.append({"mode": "cold", "batch_size": batch_size, "repetition": repetition, "latency": latency, "throughput": batch_size / latency})
+            print(f"Cold batch of {batch_size} queries took {latency} seconds.")
+    batch_path.unlink(missing_ok=True)
+
+    socket_path = result_dir / "server.sock"
+    process = start_server(reference_path, socket_path, num_workers)
+    try:
+        connection = server.open_connection(socket_path)
+        for batch_size in batch_sizes:
+            for repetition in range(repetitions):
+                batch = select_batch(queries, batch_size, repetition * batch_size)
+                start_time = time.perf_counter()
+                server.classify_remote(connection, batch)
+                latency = time.perf_counter() - start_time
+                rows.append({"mode": "server", "batch_size": batch_size, "repetition": repetition, "latency": latency, "throughput": batch_size / latency})
+            print(f"Server batches of {batch_size} queries took {sum(row['latency'] for row in rows[-repetitions:]) / repetitions} seconds on average.")
+        connection.close()
+    finally:
+        process.terminate()
+        process.wait()
+
+    with (result_dir / "server_benchmark.csv").open("w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["mode", "batch_size", "repetition", "latency", "throughput"])
+        writer.writeheader()
+        writer.writerows(rows)
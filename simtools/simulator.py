@@ -13,11 +13,84 @@ import inspect
 
 import simtools.data_generator as data_generator
 import simtools.fasta_editor as fasta_editor
-import raxtax_extension_prototype.parser_short_long as parser
+import simtools.server_benchmark as server_benchmark
 import raxtax_extension_prototype.output_adapters as output_adapters
+import raxtax_extension_prototype.streaming as streaming
+import raxtax_extension_prototype.backends as backends
 from raxtax_extension_prototype.parser_short_long import parse_reference_fasta
 
 
+def get_matching_backend(config: dict) -> str:
+    """
+    Returns the matching backend specified in the configuration. Without
+    matching_backend, the backend is derived from matching_mode and
+    core_count (see backends.get_backend_name).
+    """
+    if config.get("matching_backend") is not None:
+        return config["matching_backend"]
+    return backends.get_backend_name(config.get("matching_mode", "reference"), config.get("core_count"))
+
+def get_matching_options(config: dict, backend_name: str) -> dict:
+    """
+    Returns the matching options specified in the configuration. Without
+    core_count, the worker count and chunk size of backends supporting
+    it are tuned automatically (see
+    raxtax_extension_prototype.autotune) unless tune_workers is disabled
+    in the matching options.
+    """
+    matching_options = dict(config.get("matching_options", {}))
+    if config.get("core_count") is None and backend_name != "auto" and "tune_workers" in backends.get_backend(backend_name)["capabilities"]["options"]:
+        matching_options.setdefault("tune_workers", True)
+    return matching_options
+
+def compute_intersection_sizes(config: dict, reference_path: Path, query_path: Path, orient_query: bool, redo: bool):
+    """
+    Computes the intersection sizes with the matching backend, core
+    count, index options and matching options specified in the
+    configuration. Matching options (e.g. prefilter_floor or
+    result_matrix_path) must be supported by the backend (see backends);
+    with matching_backend "auto", backend_calibration holds the options
+    of the calibration run. Without core_count, the worker count is tuned
+    (see get_matching_options).
+    """
+    backend_name = get_matching_backend(config)
+    return backends.run_backend(backend_name, reference_path, query_path, orient_query=orient_query, redo=redo,
+                                num_workers=config.get("core_count") or 0, index_options=config.get("index_options", {}),
+                                calibration_options=config.get("backend_calibration", {}), **get_matching_options(config, backend_name))
+
+def stream_intersection_sizes(config: dict, reference_path: Path, query_path: Path, orient_query: bool, redo: bool):
+    """
+    Yields the intersection sizes chunk by chunk, with chunks of
+    query_chunk_size queries and otherwise the same options as
+    compute_intersection_sizes (see streaming).
+    """
+    backend_name = get_matching_backend(config)
+    return streaming.stream_intersection_sizes(reference_path, query_path, config["query_chunk_size"], orient_query=orient_query, redo=redo,
+                                               backend=backend_name, num_workers=config.get("core_count") or 0,
+                                               index_options=config.get("index_options", {}), calibration_options=config.get("backend_calibration", {}),
+                                               **get_matching_options(config, backend_name))
+
+def classify_queries(config: dict, base_dir: Path, reference_path: Path, query_path: Path, orient_query: bool, redo: bool, start_time: float):
+    """
+    Computes the intersection sizes and writes the classification
+    results into a result directory within base_dir. If
+    query_chunk_size is specified in the configuration, queries are
+    matched, scored and written chunk by chunk.
+    """
+    output_dir_name = f"results_{reference_path.stem}_{query_path.stem}"
+    result_dir = base_dir / output_dir_name
+
+    if config.get("query_chunk_size") is not None:
+        chunks = stream_intersection_sizes(config, reference_path, query_path, orient_query=orient_query, redo=redo)
+        output_adapters.output_s_t_stream(chunks, result_dir, start_time)
+        return
+
+    results, names, runtime_info = compute_intersection_sizes(config, reference_path, query_path, orient_query=orient_query, redo=redo)
+
+    end_time = time.perf_counter()
+    total_execution_time = end_time - start_time
+    output_adapters.output_s_t(results, names, runtime_info, result_dir, total_execution_time)
+
 def run_simulation(config_dir: Path | None = None):
     """
     Runs a simulation using the configuration file located in config_dir.
@@ -39,8 +112,6 @@ def run_simulation(config_dir: Path | None = None):
     reference_path = base_dir / "references" / "references.fasta"
     query_path = base_dir / "queries" / f"queries_{config['query_count']}.fasta"
 
-    core_count = config.get("core_count", 0)
-
     mutation_rate = config.get("mutation_rate", -1)
     mutation_seed = config.get("mutation_seed", -1)
     disorientation_probability = config.get("disorientation_probability", -1)
@@ -58,20 +129,7 @@ def run_simulation(config_dir: Path | None = None):
         query_path = query_disoriented_path
         orient_query_bool = True
 
-    if core_count == 0:
-        results, names, runtime_info = parser.get_intersection_sizes(reference_path, query_path, orient_query=orient_query_bool,redo=True)
-    else:
-        results, names, runtime_info = parser.get_intersection_sizes_parallel(reference_path, query_path, redo=True, orient_query=orient_query_bool, num_workers=core_count)
-
-    ref_name = reference_path.stem
-    query_name = query_path.stem
-    output_dir_name = f"results_{ref_name}_{query_name}"
-
-    result_dir = base_dir / output_dir_name
-
-    end_time = time.perf_counter()
-    total_execution_time = end_time - start_time
-    output_adapters.output_s_t(results, names, runtime_info, result_dir, total_execution_time)
+    classify_queries(config, base_dir, reference_path, query_path, orient_query=orient_query_bool, redo=True, start_time=start_time)
 
 def run_non_present_query_simulation(config_dir: Path | None = None) :
     """
@@ -93,22 +151,7 @@ def run_non_present_query_simulation(config_dir: Path | None = None) :
     reference_path = base_dir / "references" / "present_references.fasta"
     query_path = base_dir / "queries" / f"queries_{config['query_count']}.fasta"
 
-    core_count = config.get("core_count", 0)
-
-    if core_count == 0:
-        results, names, runtime_info = parser.get_intersection_sizes(reference_path, query_path, redo=True)
-    else:
-        results, names, runtime_info = parser.get_intersection_sizes_parallel(reference_path, query_path, redo=True, num_workers=core_count)
-
-    ref_name = reference_path.stem
-    query_name = query_path.stem
-    output_dir_name = f"results_{ref_name}_{query_name}"
-
-    result_dir = base_dir / output_dir_name
-
-    end_time = time.perf_counter()
-    total_execution_time = end_time - start_time
-    output_adapters.output_s_t(results, names, runtime_info, result_dir, total_execution_time)
+    classify_queries(config, base_dir, reference_path, query_path, orient_query=False, redo=True, start_time=start_time)
 
 def run_all_main():
     """
@@ -166,7 +209,14 @@ def calculate_lookup():
     reference_path = base_dir / "references" / "references.fasta"
     result_path = reference_path.with_name(reference_path.stem + "_data.h5")
 
-    parse_reference_fasta(reference_path, result_path, redo=True)
+    index_options = {}
+    config_path = base_dir / "config.yaml"
+    if config_path.exists():
+        with open(config_path, "r") as file:
+            config = yaml.safe_load(file)
+        index_options = config.get("index_options", {})
+
+    parse_reference_fasta(reference_path, result_path, redo=True, **index_options)
 
 def execute_raxtax(config_dir: Path | None = None) :
     """
@@ -185,8 +235,6 @@ def execute_raxtax(config_dir: Path | None = None) :
     reference_path = base_dir / "references" / "references.fasta"
     query_path = base_dir / "queries" / f"queries_{config['query_count']}.fasta"
 
-    core_count = config.get("core_count", 0)
-
     mutation_rate = config.get("mutation_rate", -1)
     mutation_seed = config.get("mutation_seed", -1)
     disorientation_probability = config.get("disorientation_probability", -1)
@@ -204,20 +252,32 @@ def execute_raxtax(config_dir: Path | None = None) :
         query_path = query_disoriented_path
         orient_query_bool = True
 
-    if core_count == 0:
-        results, names, runtime_info = parser.get_intersection_sizes(reference_path, query_path, orient_query=orient_query_bool,redo=False)
-    else:
-        results, names, runtime_info = parser.get_intersection_sizes_parallel(reference_path, query_path, redo=False, orient_query=orient_query_bool, num_workers=core_count)
+    classify_queries(config, base_dir, reference_path, query_path, orient_query=orient_query_bool, redo=False, start_time=start_time)
 
-    ref_name = reference_path.stem
-    query_name = query_path.stem
-    output_dir_name = f"results_{ref_name}_{query_name}"
+def run_server_benchmark(config_dir: Path | None = None):
+    """
+    Generates test data, computes the lookup table and measures the
+    classification latency with a new process per batch and with a
+    resident classification server (see server_benchmark).
+    """
+    base_dir = Path(inspect.stack()[1].filename).resolve().parent
+    if config_dir is None:
+        config_dir = base_dir
+    config_path = config_dir / "config.yaml"
 
-    result_dir = base_dir / output_dir_name
+    data_generator.simulate_references_queries_with_config(config_path, base_dir)
 
-    end_time = time.perf_counter()
-    total_execution_time = end_time - start_time
-    output_adapters.output_s_t(results, names, runtime_info, result_dir, total_execution_time)
+    with open(config_path, "r") as file:
+        config = yaml.safe_load(file)
+
+    reference_path = base_dir / "references" / "references.fasta"
+    query_path = base_dir / "queries" / f"queries_{config['query_count']}.fasta"
+    result_path = reference_path.with_name(reference_path.stem + "_data.h5")
+    parse_reference_fasta(reference_path, result_path, redo=True, **config.get("index_options", {}))
+
+    result_dir = base_dir / f"results_server_{reference_path.stem}_{query_path.stem}"
+    server_benchmark.run_server_benchmark(reference_path, query_path, result_dir, config.get("server_batch_sizes", [1, 10, 100]),
+                                          config.get("server_repetitions", 20), config.get("cold_repetitions", 3), config.get("core_count") or 0)
 
 def run_executable_dir_list(executable_dir_list: list[Path]) :
     """